@@ -2,18 +2,28 @@
 
 import streamlit as st
 import time
-import base64
 import os
 import sqlite3 # Added
 import asyncio # Add asyncio import
-import random # Import random for tie-breaking
+import uuid
+from functools import partial
 # import sys # Not used, can remove
-from assets.texts import character_intros, character_names, monokuma_tutorial, character_profiles, game_introduction_text, hint_text # Import hint_text
-from collections import Counter
+from assets.texts import select_roster
+from utils.game_content import CONTENT # Static profiles, intros, tutorial and hint text shared by all sessions
 
 # Import the flow creation function
 # from flow import create_character_decision_flow # Keep the old name if needed, or remove if only parallel is used
-from flow import create_character_decision_flow, create_parallel_decision_flow # Import both
+from flow import create_character_decision_flow, create_parallel_decision_flow, create_night_actions_dag, DecisionDraft, VoteBatchDraft
+from utils.db_writer import DBWriter, ReadPool
+from utils.game_db import (connect, assign_roles_and_log, night_decision_logged, new_game_id, create_game,
+                           game_exists, save_game_state, load_game_state, cleanup_due, cleanup_games, FINISHED_STATES)
+from utils import session_registry, profiling, metrics
+from utils.seeding import new_seed, game_rng
+from utils.votes import tally_votes, format_vote_summary
+from utils.media import get_asset_path, get_hidden_autoplay_html
+
+RUN_STARTED = time.perf_counter() # Start of this script run (the app_run_seconds histogram)
+metrics.start_http_server() # Prometheus metrics on METRICS_PORT, if set (once per process)
 
 # --- Page Config (MUST be the first Streamlit command) ---
 st.set_page_config(
@@ -33,122 +43,36 @@ PLAYER_MODE_OPTION = ":small[🎮 **You Play:** Make choices, investigate, vote!
 SHUICHI_VIEW_OPTION = ":small[🍿 **AI Plays (Character View):** AI decides actions. You watch from one character's perspective.]"
 MONOKUMA_VIEW_OPTION = ":small[🔮 **AI Plays (Monokuma View):** AI decides actions. You watch with full info (secrets revealed!).]"
 
-# --- Asset Path Helper ---
-def get_asset_path(character_name, asset_type, emotion="normal"):
-    """Constructs path to character assets. asset_type can be 'avatar' or 'audio'."""
-    extension = "png" if asset_type == "avatar" else "wav"
-    path = f"./assets/{character_name}/{emotion}.{extension}"
-    return path
-
-# --- Database Utility Functions ---
-def init_db():
-    """Initializes the in-memory SQLite database and returns the connection."""
-    conn = sqlite3.connect(":memory:", check_same_thread=False) # Use check_same_thread=False for Streamlit
-    cursor = conn.cursor()
-
-    # Create roles table
-    cursor.execute("""
-    CREATE TABLE roles (
-        id INTEGER PRIMARY KEY,
-        name TEXT UNIQUE NOT NULL,
-        role TEXT NOT NULL,
-        is_alive BOOLEAN NOT NULL CHECK (is_alive IN (0, 1))
-    )
-    """)
-
-    # Create actions table with emotion column
-    cursor.execute("""
-    CREATE TABLE actions (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        day INTEGER NOT NULL,
-        phase TEXT NOT NULL,
-        actor_name TEXT NOT NULL,
-        action_type TEXT NOT NULL,
-        content TEXT,
-        target_name TEXT,
-        emotion TEXT
-    )
-    """)
-    conn.commit()
-    return conn
-
-def assign_roles_and_log(conn, character_list):
-    """Assigns roles, populates the roles table, and logs the assignment."""
-    cursor = conn.cursor()
-    num_players = len(character_list)
-    # Example role distribution (adjust as needed)
-    roles = ["Blackened"] * 3 + ["Truth-Seeker"] * 1 + ["Guardian"] * 1 + ["Student"] * (num_players - 5)
-    random.shuffle(roles)
-
-    for i, name in enumerate(character_list):
-        role = roles[i]
-        player_order = i + 1 # 1-based initial order
-        # Insert into roles table
-        cursor.execute(
-            "INSERT INTO roles (id, name, role, is_alive) VALUES (?, ?, ?, ?)",
-            (player_order, name, role, True)
-        )
-    conn.commit()
-
-def tally_votes(individual_votes, tie_break_strategy='none'):
-    """Tally votes based on plurality, handling Abstain and tie-breaking.
-
-    Args:
-        individual_votes (list): List of tuples (actor_name, target_name).
-                                target_name can be None for Abstain.
-        tie_break_strategy (str): 'none' (tie means no winner) or
-                                  'random' (tie means random winner).
-
-    Returns:
-        str or None: The name of the winning target, or None if Abstain wins,
-                     there's an unbreakable tie, or no votes were cast.
-    """
-    if not individual_votes:
-        return None
-
-    # Count votes for each target, including None (Abstain)
-    vote_counts = Counter(target for _, target in individual_votes)
-
-    if not vote_counts:
-        return None # Should not happen if individual_votes is not empty, but safe check
-
-    # Find the maximum vote count
-    max_votes = 0
-    for count in vote_counts.values():
-        if count > max_votes:
-            max_votes = count
-
-    # Find all targets (including None) that received the maximum votes
-    winners = [target for target, count in vote_counts.items() if count == max_votes]
-
-    # --- Determine Outcome ---
-    if None in winners:
-        # Abstain received the highest votes (or tied), so no winner/target
-        return None
-    elif len(winners) == 1:
-        # Exactly one non-abstain target received the most votes
-        return winners[0]
-    elif len(winners) > 1:
-        # Tie between multiple non-abstain targets
-        if tie_break_strategy == 'random':
-            return random.choice(winners) # Randomly pick one of the tied winners
-        else: # Default or 'none'
-            return None # Tie means no winner
-    else:
-        # No winners found (e.g., only votes were for Abstain but it wasn't max?)
-        # This case *shouldn't* be reachable given the logic, but default to None
-        return None
-
 # --- Session State Initialization ---
+# A session released by the idle reaper starts over and resumes its game from the store
+if 'session_token' in st.session_state and not session_registry.is_resident(st.session_state.session_token):
+    st.session_state.clear()
+
 # Initialize only if keys don't exist
 if 'current_state' not in st.session_state:
+    # A ?game=<id> link resumes that game from the shared game store
+    resume_game_id = st.query_params.get("game")
+    saved_state = None
+    if game_exists(resume_game_id):
+        st.session_state.game_id = resume_game_id
+        st.session_state.db_conn = connect(resume_game_id)
+        saved_state = load_game_state(st.session_state.db_conn, resume_game_id)
+    if saved_state is None:
+        if cleanup_due():
+            cleanup_games() # Archive finished games and drop abandoned ones, at most hourly per process
+        st.session_state.game_id = new_game_id()
+        st.session_state.game_seed = st.query_params.get("seed") or new_seed() # ?seed= replays a game's random decisions
+        create_game(st.session_state.game_id, st.session_state.game_seed)
+        st.session_state.db_conn = connect(st.session_state.game_id) # Sees only this game's rows
+    st.query_params["game"] = st.session_state.game_id
+    st.session_state.db_writer = DBWriter(partial(connect, st.session_state.game_id)) # Serializes decision logging
+    st.session_state.db_read_pool = ReadPool(partial(connect, st.session_state.game_id)) # Per-thread reads for concurrent decisions
+
     # Core State
     st.session_state.current_state = "SHOW_PRE_GAME_OPTIONS" # Changed from IDLE
     st.session_state.current_day = 0
-    st.session_state.db_conn = init_db() # Initialize DB
     st.session_state.task_queue = []
     st.session_state.user_character_name = "Shuichi" # Hardcoded assumption
-    st.session_state.game_introduction_text = game_introduction_text # Load game intro text here
     st.session_state.current_phase_actors = None # NEW: Initialize to None
     st.session_state.user_input = None          # NEW: General user input
     st.session_state.inner_thought_submitted = False # NEW: Control submit button state
@@ -156,25 +80,36 @@ if 'current_state' not in st.session_state:
     # UI State
     st.session_state.buttons_used = set() # Will store "tutorial", "intro", "start_game" etc.
 
-    # Game Data / Setup
-    _temp_names = character_names[:]
-    random.shuffle(_temp_names)
-    st.session_state.shuffled_character_order = _temp_names
-    assign_roles_and_log(st.session_state.db_conn, st.session_state.shuffled_character_order) # Assign roles
+    if saved_state is not None:
+        # Resumed game: roles and actions are already in the database
+        for key, value in saved_state.items():
+            if value is not None:
+                st.session_state[key] = value
+    else:
+        # Game Data / Setup: pick this game's cast, then its speaking order (all derived from the game's seed)
+        _temp_names = select_roster(f"{st.session_state.game_seed}:roster")
+        game_rng(st.session_state.game_seed, "speaking_order").shuffle(_temp_names)
+        st.session_state.shuffled_character_order = _temp_names
+        assign_roles_and_log(st.session_state.db_conn, st.session_state.shuffled_character_order,
+                             rng=game_rng(st.session_state.game_seed, "roles")) # Assign roles
 
-    # Static Game Info
-    st.session_state.character_profiles = character_profiles
-    st.session_state.hint_text = hint_text
+        # Messages & Turn Tracking
+        st.session_state.messages = []
 
-    # Messages & Turn Tracking
-    st.session_state.messages = []
+        # Initial system message
+        st.session_state.messages.append({
+            "role": "Shuichi", # Assuming Shuichi is the user avatar initially
+            "content": '*(You wake in a classroom with Monokuma and other students. No memory of arrival. The air crackles with tension. Unravel the mystery before despair takes hold.)* \n\n **Shuichi:** *"Uh... where am I? What is this place?"*',
+            "emotion": "worried",
+        })
 
-    # Initial system message
-    st.session_state.messages.append({
-        "role": "Shuichi", # Assuming Shuichi is the user avatar initially
-        "content": '*(You wake in a classroom with Monokuma and other students. No memory of arrival. The air crackles with tension. Unravel the mystery before despair takes hold.)* \n\n **Shuichi:** *"Uh... where am I? What is this place?"*',
-        "emotion": "worried",
-    })
+    # Let the reaper release this session's connections and history once it goes idle
+    st.session_state.session_token = uuid.uuid4().hex
+    session_registry.register(
+        st.session_state.session_token, st.session_state.game_id,
+        closables=[st.session_state.db_writer, st.session_state.db_read_pool, st.session_state.db_conn],
+        clearables=[st.session_state.messages],
+    )
 
 # --- CSS ---
 st.markdown(
@@ -228,38 +163,21 @@ st.markdown(
 # Add a separator below the footnote
 st.markdown("--- ")
 
-# --- Function to generate HIDDEN autoplay audio HTML ---
-def get_hidden_autoplay_html(file_path,errorLoop=False):
-    """Generates minimal HTML for AUTOPLAY audio. ASSUMES file exists & is .wav"""
-    # DON'T check if file exists first. Let it fail if it doesn't.
-    try:
-        with open(file_path, "rb") as f:
-            data = f.read()
-        b64 = base64.b64encode(data).decode()
-        mime_type = "audio/wav" # Assume wav for simplicity
-        html = f"""
-        <audio autoplay style="display:none">
-            <source src="data:{mime_type};base64,{b64}" type="{mime_type}">
-            Your browser does not support the audio element.
-        </audio>
-        """
-    except:
-        if errorLoop: return ""
-        else: return get_hidden_autoplay_html(file_path="assets/Monokuma/think.wav",errorLoop=True)
-        # Fail safely for missing audio, using a default file if possible
-    
-    return html
-
 # --- Function to display a character message during processing ---
-def display_interactive_message(character_name, content, emotion="normal", sleep_time=10, audio_path=None):
-    """Displays a character's message with avatar, audio, text, and pause."""
+def display_interactive_message(character_name, content, emotion="normal", sleep_time=10, audio_path=None, placeholder=None):
+    """Displays a character's message with avatar, audio, text, and pause.
+    If `placeholder` (an st.empty) is given, the message replaces whatever was streamed into it."""
     avatar_img_path = get_asset_path(character_name, "avatar", emotion)
     effective_audio_path = audio_path or get_asset_path(character_name, "audio", emotion)
 
     # Use a placeholder avatar if the real one isn't found
     display_avatar = avatar_img_path if avatar_img_path and os.path.exists(avatar_img_path) else "❓"
 
-    with st.chat_message(character_name, avatar=display_avatar):
+    if display_avatar != "❓":
+        metrics.increment("asset_bytes_served", os.path.getsize(display_avatar), type="avatar")
+
+    chat_message = placeholder.chat_message if placeholder else st.chat_message
+    with chat_message(character_name, avatar=display_avatar):
         # Generate audio HTML
         audio_html = get_hidden_autoplay_html(effective_audio_path) # Handles missing file
         if audio_html:
@@ -277,6 +195,27 @@ def display_interactive_message(character_name, content, emotion="normal", sleep
     if sleep_time > 0:
         time.sleep(sleep_time)
 
+# --- Function to stream a statement into a chat bubble while it is generated ---
+def make_streaming_bubble(placeholder, character_name, prefix):
+    """Returns a callback for DecisionNode's 'stream_callback' param that renders the
+    partial statement into `placeholder`. Finish with display_interactive_message(placeholder=...)."""
+    avatar_img_path = get_asset_path(character_name, "avatar", "normal")
+    display_avatar = avatar_img_path if os.path.exists(avatar_img_path) else "❓"
+
+    def render_partial_statement(talking_so_far):
+        with placeholder.chat_message(character_name, avatar=display_avatar):
+            st.markdown(f"{prefix}{talking_so_far} ▌" if talking_so_far else f"{prefix}*...*")
+    return render_partial_statement
+
+# --- Function to show how many votes are in while a voting batch runs ---
+def make_votes_in_indicator():
+    """Returns (on_progress, clear). on_progress(done_count, total) updates a 'Votes in: x/y' bar."""
+    placeholder = st.empty()
+
+    def on_progress(done_count, total):
+        placeholder.progress(done_count / total if total else 1.0, text=f"🗳️ Votes in: {done_count}/{total}")
+    return on_progress, placeholder.empty
+
 # --- Callback Function for Buttons (Simplified) ---
 def handle_button_click(action_type, content):
     """Handles button clicks, populates task queue based on action_type."""
@@ -292,7 +231,7 @@ def handle_button_click(action_type, content):
         total_intros = len(character_list)
         for i, character_name in enumerate(character_list):
             # Use content (assuming character_intros provides content based on name)
-            intro_content = character_intros.get(character_name, "...")
+            intro_content = CONTENT.character_intros.get(character_name, "...")
             task = {
                 'character_name': character_name,
                 'content': f"({i + 1}/{total_intros}) **{character_name}:** {intro_content}",
@@ -304,8 +243,8 @@ def handle_button_click(action_type, content):
 
     elif action_type == 'tutorial':
         st.session_state.current_state = "RUNNING_TUTORIAL"
-        total_tutorial_lines = len(monokuma_tutorial)
-        for i, dialog_entry in enumerate(monokuma_tutorial):
+        total_tutorial_lines = len(CONTENT.monokuma_tutorial)
+        for i, dialog_entry in enumerate(CONTENT.monokuma_tutorial):
             task = {
                 'character_name': dialog_entry["speaker"],
                 'content': f"({i + 1}/{total_tutorial_lines}) **{dialog_entry['speaker']}:** {dialog_entry['line']}",
@@ -358,9 +297,9 @@ def display_pre_game_buttons():
         
         st.radio(
             "Select Character to Play:",
-            options=character_names,
+            options=st.session_state.shuffled_character_order, # This game's cast
             key="user_name",
-            index=0, # Default to Shuichi
+            index=st.session_state.shuffled_character_order.index(st.session_state.user_character_name), # Default to Shuichi
             help=(
                 "Choose a character to play as."
             )
@@ -391,39 +330,6 @@ def display_pre_game_buttons():
                  )
              )
 
-# --- Vote Summary Helper ---
-def format_vote_summary(individual_votes):
-    """Formats a list of votes into an aggregated summary string.
-
-    Args:
-        individual_votes (list): List of tuples (actor_name, target_name).
-                                target_name can be None for Abstain.
-
-    Returns:
-        str: A formatted string summarizing the votes, or an empty string
-             if no votes were cast.
-    """
-    if not individual_votes:
-        return ""
-
-    votes_by_target = {}
-    for actor, target in individual_votes:
-        target_display = target if target is not None else "Abstain"
-        if target_display not in votes_by_target:
-            votes_by_target[target_display] = []
-        votes_by_target[target_display].append(actor)
-
-    summary_lines = []
-    # Sort targets alphabetically, potentially placing "Abstain" last or first if needed
-    sorted_targets = sorted(votes_by_target.keys(), key=lambda x: (x == "Abstain", x))
-
-    for target in sorted_targets:
-        voters = votes_by_target[target]
-        voter_list_str = ", ".join(sorted(voters)) # Sort voters for consistent output
-        summary_lines.append(f"- **{target}** ({len(voters)}): {voter_list_str}")
-
-    return "\n\n**Vote Breakdown:**\n" + "\n".join(summary_lines)
-
 # --- Main Display Area ---
 chat_container = st.container()
 
@@ -442,7 +348,41 @@ with chat_container:
             # st.markdown("debug: " + content)
             st.markdown(content)
 
+# --- Persist the game (when it changed) so ?game=<id> can resume it after a restart or eviction ---
+def persist_game():
+    save_key = (st.session_state.current_state, st.session_state.current_day, len(st.session_state.messages),
+                tuple(st.session_state.current_phase_actors or ()), len(st.session_state.buttons_used),
+                st.session_state.get("total_speakers_this_trial"), st.session_state.get("user_speaker_index"))
+    if st.session_state.get("saved_game_key") != save_key:
+        save_game_state(st.session_state.db_conn, st.session_state.game_id, st.session_state)
+        st.session_state.saved_game_key = save_key
+    session_registry.touch(st.session_state.session_token,
+                           in_progress=st.session_state.current_day > 0 and st.session_state.current_state not in FINISHED_STATES)
+
+# --- Record how long this script run took, then rerun or stop it ---
+def observe_run(outcome):
+    metrics.observe("app_run_seconds", time.perf_counter() - RUN_STARTED,
+                    state=st.session_state.current_state, outcome=outcome)
+
+def rerun():
+    observe_run("rerun")
+    st.rerun()
+
+def stop():
+    persist_game() # The game-over states stop here; saving marks the game finished
+    observe_run("stop")
+    st.stop()
+
+# --- Profile a state's block when it is selected (no-op otherwise; see utils/profiling.py) ---
+def profile_state(state):
+    profiling.phase("app", state, st.session_state.profile_phases, tag=st.session_state.game_id[:8])
+
+# Phases to capture with cProfile/tracemalloc (PROFILE_PHASES, or ?profile= when PROFILE_QUERY=1)
+st.session_state.profile_phases = profiling.selected_phases(st.query_params.get("profile"))
+
 while True:
+    persist_game()
+
     # --- Process Task Queue if in a RUNNING state ---
     if st.session_state.current_state in ["RUNNING_TUTORIAL", "RUNNING_INTRO"]:
         tasks_to_process = st.session_state.task_queue[:]
@@ -459,15 +399,17 @@ while True:
         st.session_state.task_queue = [] # Clear queue after processing
 
         st.session_state.current_state = "SHOW_PRE_GAME_OPTIONS" # Return to pre-game options
-        st.rerun()
+        rerun()
 
     # --- Pre-Game Button Display ---
     if st.session_state.current_state == "SHOW_PRE_GAME_OPTIONS":
+        profile_state("SHOW_PRE_GAME_OPTIONS")
         display_pre_game_buttons()
         break
 
     # --- Reveal User Role and Speaking Order ---
     if st.session_state.current_state == "GAME_START_INFO":
+        profile_state("GAME_START_INFO")
         # --- User Role Reveal ---
         conn = st.session_state.db_conn
         cursor = conn.cursor()
@@ -475,7 +417,6 @@ while True:
         user_name = st.session_state.get("user_name", PLAYER_MODE_OPTION)
         st.session_state.user_character_name = user_name
         #user_name = "Shuichi" # Hardcoded user character name
-        st.session_state.hint_text.replace("PLAYERCHARACTER",user_name) # Patch the AI's avoiding of the playing message
 
         # Assume Shuichi exists and has a role from the setup
         cursor.execute("SELECT role FROM roles WHERE name = ?", (user_name,))
@@ -527,6 +468,7 @@ while True:
 
     # --- Night Phase: Blackened User Input ---
     if st.session_state.current_state == "NIGHT_PHASE_BLACKENED_USER_INPUT":
+        profile_state("NIGHT_PHASE_BLACKENED_USER_INPUT")
         conn = st.session_state.db_conn
         cursor = conn.cursor()
         current_day = st.session_state.current_day
@@ -536,6 +478,11 @@ while True:
         if not st.session_state.inner_thought_submitted:
              st.session_state.inner_thought_submitted = False
 
+        # Pre-generate the character's own decision while the form is up; used if the input is left empty
+        draft_key = (current_day, st.session_state.current_state)
+        if not st.session_state.inner_thought_submitted and getattr(st.session_state.get("user_decision_draft"), "key", None) != draft_key:
+            st.session_state.user_decision_draft = DecisionDraft(st.session_state, user_character_name, key=draft_key)
+
         # --- Display form --- #
         
         st.info(f"🤫 It's **{user_character_name}'s** turn to scheme! Whisper your wicked plans to guide **{user_character_name}** (100 chars max)!") # Modified line
@@ -559,7 +506,7 @@ while True:
             if submitted:
                 # Set the flag immediately and trigger a rerun to hide the form
                 st.session_state.inner_thought_submitted = True
-                st.rerun() # Force immediate re-render without the form
+                rerun() # Force immediate re-render without the form
             elif not st.session_state.inner_thought_submitted:
                 # --- If the form was NOT submitted AND we are not in the processing phase, break the loop ---
                 break # Exit the while True loop and wait for user interaction
@@ -571,11 +518,17 @@ while True:
                 user_thought = st.session_state.get("blackened_thought_input") # Get value from form state
                 st.session_state.user_input = user_thought # Store for the flow
 
-                # Run DecisionNode for the user, incorporating their input
-                decision_flow = create_character_decision_flow()
-                decision_flow.set_params({'character_name': user_character_name})
-                # Pass the entire session state, node's prep will read user_input
-                asyncio.run(decision_flow.run_async(st.session_state))
+                draft = st.session_state.pop("user_decision_draft", None)
+                if not (user_thought or "").strip() and draft is not None and draft.key == draft_key and draft.commit(st.session_state):
+                    pass # No input: the pre-generated decision has been logged
+                else:
+                    if draft is not None:
+                        draft.discard()
+                    # Run DecisionNode for the user, incorporating their input
+                    decision_flow = create_character_decision_flow()
+                    decision_flow.set_params({'character_name': user_character_name})
+                    # Pass the entire session state, node's prep will read user_input
+                    asyncio.run(decision_flow.run_async(st.session_state))
 
                 # Retrieve the AI-generated statement (which considered user input)
                 cursor.execute(
@@ -605,6 +558,7 @@ while True:
     
     # --- Night Phase: Blackened Discussion ---
     if st.session_state.current_state == "NIGHT_PHASE_BLACKENED_DISCUSSION":
+        profile_state("NIGHT_PHASE_BLACKENED_DISCUSSION")
         conn = st.session_state.db_conn
         cursor = conn.cursor()
         current_day = st.session_state.current_day
@@ -669,11 +623,6 @@ while True:
                     break # Exit the while loop
                 else:
                     # It's an AI's turn or Viewer Mode
-                    # Run DecisionNode for the AI actor (Node decides based on its own perspective)
-                    decision_flow = create_character_decision_flow()
-                    decision_flow.set_params({'character_name': current_actor})
-                    asyncio.run(decision_flow.run_async(st.session_state))
-
                     # Determine if the AI's statement should be DISPLAYED based on viewer mode
                     user_is_blackened = False
                     cursor.execute("SELECT role FROM roles WHERE name = ?", (user_character_name,))
@@ -684,6 +633,16 @@ while True:
                     show_statement = (viewer_mode_selection == MONOKUMA_VIEW_OPTION) or \
                                      (user_is_blackened and (viewer_mode_selection == PLAYER_MODE_OPTION or viewer_mode_selection == SHUICHI_VIEW_OPTION))
 
+                    # Run DecisionNode for the AI actor (Node decides based on its own perspective)
+                    decision_flow = create_character_decision_flow()
+                    decision_params = {'character_name': current_actor}
+                    if show_statement:
+                        # Stream the statement into its bubble as it is generated
+                        statement_placeholder = st.empty()
+                        decision_params['stream_callback'] = make_streaming_bubble(statement_placeholder, current_actor, f"**{current_actor}:** ")
+                    decision_flow.set_params(decision_params)
+                    asyncio.run(decision_flow.run_async(st.session_state))
+
                     if show_statement:
                         # Retrieve the statement (already logged by the node)
                         cursor.execute(
@@ -702,9 +661,11 @@ while True:
                             character_name=current_actor,
                             content=full_actor_message,
                             emotion=actor_emotion,
-                            sleep_time=0.5 # No sleep in loop
+                            sleep_time=0.5, # No sleep in loop
+                            placeholder=statement_placeholder
                         )
                     # Else: Don't display the AI statement (e.g., Shuichi View and user is not Blackened)
+                    persist_game() # Save after each statement, so a resumed game doesn't replay it
 
                     # Loop continues to the next actor
 
@@ -712,7 +673,7 @@ while True:
             if transitioned_to_input:
                 # Sleep after the loop finishes to allow the last message to be read
                 time.sleep(7)
-                st.rerun() # Rerun to enter the user input state
+                rerun() # Rerun to enter the user input state
             elif not st.session_state.current_phase_actors: # Loop finished naturally
                 st.session_state.current_phase_actors = None # Reset for next day
                 st.session_state.current_state = "NIGHT_PHASE_BLACKENED_VOTE"
@@ -720,6 +681,7 @@ while True:
 
     # --- Night Phase: Blackened Vote --- (MODIFIED for User Input)
     if st.session_state.current_state == "NIGHT_PHASE_BLACKENED_VOTE":
+        profile_state("NIGHT_PHASE_BLACKENED_VOTE")
         current_day = st.session_state.current_day
         current_phase = st.session_state.current_state
         conn = st.session_state.db_conn
@@ -737,38 +699,42 @@ while True:
 
         next_state = None
 
+        # AI Blackened voters (the user votes through the form instead)
+        ai_blackened_voters = [name for name in all_blackened_voters
+                               if not (user_needs_to_vote and name == user_character_name)]
+
+        # The Truth-Seeker and Guardian don't depend on the Blackened target, so AI ones decide
+        # alongside the vote. Their reveals still play in order; a user-played role keeps its form.
+        ai_night_roles = {}
+        for night_role in ["Truth-Seeker", "Guardian"]:
+            cursor.execute("SELECT name FROM roles WHERE role = ? AND is_alive = 1", (night_role,))
+            night_role_result = cursor.fetchone()
+            if night_role_result and not (night_role_result[0] == user_character_name and viewer_mode_selection == PLAYER_MODE_OPTION):
+                ai_night_roles[night_role] = night_role_result[0]
+
+        night_dag = create_night_actions_dag(
+            ai_blackened_voters,
+            truth_seeker_name=ai_night_roles.get("Truth-Seeker"),
+            guardian_name=ai_night_roles.get("Guardian")
+        )
+        if night_dag.steps:
+            # Run async flow (independent steps run concurrently)
+            asyncio.run(night_dag.run_async(st.session_state))
+
         if user_needs_to_vote:
             # --- User Votes Scenario ---
-            # Get list of AI Blackened voters (excluding user)
-            ai_blackened_voters = [name for name in all_blackened_voters if name != user_character_name]
-
-            # Run parallel flow for AI voters if any exist
-            if ai_blackened_voters:
-                st.session_state["acting_characters"] = ai_blackened_voters
-                parallel_vote_flow = create_parallel_decision_flow()
-                # Run async flow
-                asyncio.run(parallel_vote_flow.run_async(st.session_state))
-                st.session_state.pop("acting_characters", None) # Clean up
-
             # Transition to user input state
             st.session_state.current_state = "NIGHT_PHASE_BLACKENED_VOTE_USER_INPUT"
-            st.rerun() # Rerun to process the next state immediately
+            rerun() # Rerun to process the next state immediately
 
         else:
             # --- AI Votes Only Scenario (or Viewer Mode) ---
-            # Run parallel flow for ALL Blackened voters if any exist
-            if all_blackened_voters:
-                st.session_state["acting_characters"] = all_blackened_voters
-                parallel_vote_flow = create_parallel_decision_flow()
-                # Run async flow
-                asyncio.run(parallel_vote_flow.run_async(st.session_state))
-                st.session_state.pop("acting_characters", None) # Clean up
-
             # Transition directly to reveal state
             st.session_state.current_state = "NIGHT_PHASE_BLACKENED_VOTE_REVEAL"
 
     # --- Night Phase: Blackened Vote User Input --- (NEW STATE)
     if st.session_state.current_state == "NIGHT_PHASE_BLACKENED_VOTE_USER_INPUT":
+        profile_state("NIGHT_PHASE_BLACKENED_VOTE_USER_INPUT")
         current_day = st.session_state.current_day
         current_phase = st.session_state.current_state # Log user vote in this phase
         conn = st.session_state.db_conn
@@ -804,7 +770,7 @@ while True:
             if vote_submitted_button:
                 # Set flag immediately and rerun to hide the form
                 st.session_state.vote_form_submitted = True
-                st.rerun()
+                rerun()
             elif not st.session_state.vote_form_submitted:
                 # If the form was NOT submitted and we are not in the processing phase,
                 # break the loop and wait for user interaction
@@ -836,6 +802,7 @@ while True:
 
     # --- Night Phase: Blackened Vote Reveal --- (NEW STATE - Replaces old consolidation logic)
     if st.session_state.current_state == "NIGHT_PHASE_BLACKENED_VOTE_REVEAL":
+        profile_state("NIGHT_PHASE_BLACKENED_VOTE_REVEAL")
         current_day = st.session_state.current_day
         # Votes could have come from VOTE or VOTE_USER_INPUT phases
         possible_vote_phases = ['NIGHT_PHASE_BLACKENED_VOTE', 'NIGHT_PHASE_BLACKENED_VOTE_USER_INPUT']
@@ -853,7 +820,8 @@ while True:
         individual_blackened_votes = cursor.fetchall()
 
         # Tally votes
-        final_blackened_target = tally_votes(individual_blackened_votes, tie_break_strategy='random')
+        final_blackened_target = tally_votes(individual_blackened_votes, tie_break_strategy='random',
+                                             rng=game_rng(st.session_state.get("game_seed"), "blackened_tie_break", current_day))
 
         # Log the final decision
         cursor.execute(
@@ -920,6 +888,7 @@ while True:
 
     # --- Night Phase: Truth-Seeker Investigation --- (MODIFIED for User Input)
     if st.session_state.current_state == "NIGHT_PHASE_TRUTH_SEEKER":
+        profile_state("NIGHT_PHASE_TRUTH_SEEKER")
         current_day = st.session_state.current_day
         current_phase = st.session_state.current_state
         conn = st.session_state.db_conn
@@ -950,13 +919,15 @@ while True:
                 time.sleep(3)
                 # Transition to user input state
                 st.session_state.current_state = "NIGHT_PHASE_TRUTH_SEEKER_USER_INPUT"
-                st.rerun() # Rerun to show the form
+                rerun() # Rerun to show the form
             else:
-                # Run Decision Flow for AI Truth-Seeker
-                decision_flow = create_character_decision_flow()
-                decision_flow.set_params({'character_name': truth_seeker_name})
-                # Run async flow
-                asyncio.run(decision_flow.run_async(st.session_state))
+                # Usually decided already alongside the Blackened vote; only call the LLM if not
+                if not night_decision_logged(cursor, truth_seeker_name, 'truth_seeker_decision', current_day):
+                    # Run Decision Flow for AI Truth-Seeker
+                    decision_flow = create_character_decision_flow()
+                    decision_flow.set_params({'character_name': truth_seeker_name})
+                    # Run async flow
+                    asyncio.run(decision_flow.run_async(st.session_state))
                 # DecisionNode logs the action, no need to retrieve target here
                 st.session_state.current_state = "NIGHT_PHASE_TRUTH_SEEKER_REVEAL"
                 # NO rerun here, main loop continues to the reveal state
@@ -972,6 +943,7 @@ while True:
 
     # --- Night Phase: Truth-Seeker User Input --- (NEW STATE)
     if st.session_state.current_state == "NIGHT_PHASE_TRUTH_SEEKER_USER_INPUT":
+        profile_state("NIGHT_PHASE_TRUTH_SEEKER_USER_INPUT")
         current_day = st.session_state.current_day
         current_phase = st.session_state.current_state # Log user decision in this phase
         conn = st.session_state.db_conn
@@ -1009,7 +981,7 @@ while True:
             if investigation_submitted:
                 # Set flag immediately and rerun to hide the form
                 st.session_state.ts_form_submitted = True
-                st.rerun()
+                rerun()
             elif not st.session_state.ts_form_submitted:
                 # Wait for user submission
                  break
@@ -1040,6 +1012,7 @@ while True:
 
     # --- Night Phase: Truth-Seeker Reveal --- (NEW STATE - Replaces old reveal logic)
     if st.session_state.current_state == "NIGHT_PHASE_TRUTH_SEEKER_REVEAL":
+        profile_state("NIGHT_PHASE_TRUTH_SEEKER_REVEAL")
         current_day = st.session_state.current_day
         # Decision could have come from TRUTH_SEEKER or TRUTH_SEEKER_USER_INPUT phases
         possible_decision_phases = ['NIGHT_PHASE_TRUTH_SEEKER', 'NIGHT_PHASE_TRUTH_SEEKER_USER_INPUT']
@@ -1118,6 +1091,7 @@ while True:
 
     # --- Night Phase: Guardian Protection --- (MODIFIED for User Input)
     if st.session_state.current_state == "NIGHT_PHASE_GUARDIAN":
+        profile_state("NIGHT_PHASE_GUARDIAN")
         current_day = st.session_state.current_day
         current_phase = st.session_state.current_state
         conn = st.session_state.db_conn
@@ -1148,13 +1122,15 @@ while True:
                 time.sleep(10)
                 # Transition to user input state
                 st.session_state.current_state = "NIGHT_PHASE_GUARDIAN_USER_INPUT"
-                st.rerun() # Rerun to show the form
+                rerun() # Rerun to show the form
             else:
-                # Run Decision Flow for AI Guardian
-                decision_flow = create_character_decision_flow()
-                decision_flow.set_params({'character_name': guardian_name})
-                # Run async flow
-                asyncio.run(decision_flow.run_async(st.session_state))
+                # Usually decided already alongside the Blackened vote; only call the LLM if not
+                if not night_decision_logged(cursor, guardian_name, 'guardian_decision', current_day):
+                    # Run Decision Flow for AI Guardian
+                    decision_flow = create_character_decision_flow()
+                    decision_flow.set_params({'character_name': guardian_name})
+                    # Run async flow
+                    asyncio.run(decision_flow.run_async(st.session_state))
                 # DecisionNode logs the action
                 st.session_state.current_state = "NIGHT_PHASE_GUARDIAN_REVEAL"
                 # NO rerun here, main loop continues to the reveal state
@@ -1170,6 +1146,7 @@ while True:
 
     # --- Night Phase: Guardian User Input --- (NEW STATE)
     if st.session_state.current_state == "NIGHT_PHASE_GUARDIAN_USER_INPUT":
+        profile_state("NIGHT_PHASE_GUARDIAN_USER_INPUT")
         current_day = st.session_state.current_day
         conn = st.session_state.db_conn
         cursor = conn.cursor()
@@ -1233,7 +1210,7 @@ while True:
                 if protection_submitted:
                     # Set flag immediately and rerun
                     st.session_state.g_form_submitted = True
-                    st.rerun()
+                    rerun()
                 elif not st.session_state.g_form_submitted:
                     # Wait for user submission
                     break
@@ -1264,6 +1241,7 @@ while True:
 
     # --- Night Phase: Guardian Reveal --- (NEW STATE - Replaces old reveal logic)
     if st.session_state.current_state == "NIGHT_PHASE_GUARDIAN_REVEAL":
+        profile_state("NIGHT_PHASE_GUARDIAN_REVEAL")
         current_day = st.session_state.current_day
         reveal_phase = st.session_state.current_state
         conn = st.session_state.db_conn
@@ -1322,6 +1300,7 @@ while True:
 
     # --- Morning Announcement: Resolve Night Actions ---
     if st.session_state.current_state == "MORNING_ANNOUNCEMENT":
+        profile_state("MORNING_ANNOUNCEMENT")
         # --- Monokuma Intro ---
         monokuma_intro_speech = (
             '**Monokuma:** ☀️ *"Rise and shine, kiddos! It\'s another gorgeous day for a KILLING GAME! Puhuhu! Let\'s see what happened while you were all snug in your beds..."*'
@@ -1460,6 +1439,7 @@ while True:
 
     # --- Class Trial: User Input ---
     if st.session_state.current_state == "CLASS_TRIAL_USER_INPUT":
+        profile_state("CLASS_TRIAL_USER_INPUT")
         conn = st.session_state.db_conn
         cursor = conn.cursor()
         current_day = st.session_state.current_day
@@ -1469,6 +1449,11 @@ while True:
         if not st.session_state.inner_thought_submitted:
              st.session_state.inner_thought_submitted = False
 
+        # Pre-generate the character's own decision while the form is up; used if the input is left empty
+        draft_key = (current_day, st.session_state.current_state)
+        if not st.session_state.inner_thought_submitted and getattr(st.session_state.get("user_decision_draft"), "key", None) != draft_key:
+            st.session_state.user_decision_draft = DecisionDraft(st.session_state, user_character_name, key=draft_key)
+
         # --- Display form --- #
         st.info(f"⚖️ It's **{user_character_name}'s** turn to speak up! Lay out the case to guide **{user_character_name}** (100 chars max)!") # Modified line
 
@@ -1490,7 +1475,7 @@ while True:
 
             if submitted:
                 st.session_state.inner_thought_submitted = True
-                st.rerun() # Rerun immediately after submit to hide the form
+                rerun() # Rerun immediately after submit to hide the form
             elif not st.session_state.inner_thought_submitted:
                 # --- If the form was NOT submitted AND we are not in the processing phase, break the loop ---
                 break # Exit the while True loop and wait for user interaction
@@ -1501,11 +1486,17 @@ while True:
             user_trial_input = st.session_state.get("trial_thought_input") # Get value from form state
             st.session_state.user_input = user_trial_input # Store for the flow
 
-            # Run DecisionNode for the user, incorporating their input
-            decision_flow = create_character_decision_flow()
-            decision_flow.set_params({'character_name': user_character_name})
-            # Pass the entire session state, node's prep will read user_input
-            asyncio.run(decision_flow.run_async(st.session_state))
+            draft = st.session_state.pop("user_decision_draft", None)
+            if not (user_trial_input or "").strip() and draft is not None and draft.key == draft_key and draft.commit(st.session_state):
+                pass # No input: the pre-generated decision has been logged
+            else:
+                if draft is not None:
+                    draft.discard()
+                # Run DecisionNode for the user, incorporating their input
+                decision_flow = create_character_decision_flow()
+                decision_flow.set_params({'character_name': user_character_name})
+                # Pass the entire session state, node's prep will read user_input
+                asyncio.run(decision_flow.run_async(st.session_state))
 
             # Retrieve the AI-generated statement (which considered user input)
             cursor.execute(
@@ -1541,6 +1532,7 @@ while True:
 
     # --- Class Trial: Discussion ---
     if st.session_state.current_state == "CLASS_TRIAL_DISCUSSION":
+        profile_state("CLASS_TRIAL_DISCUSSION")
         current_day = st.session_state.current_day
         current_phase = st.session_state.current_state
         conn = st.session_state.db_conn
@@ -1619,8 +1611,13 @@ while True:
                 # --- If not user input, process AI ---
 
                 # Generate Speaker's statement using the Flow (Node acts based on its own perspective)
+                # The statement streams into its bubble as it is generated
+                statement_placeholder = st.empty()
                 decision_flow = create_character_decision_flow()
-                decision_flow.set_params({'character_name': current_actor})
+                decision_flow.set_params({
+                    'character_name': current_actor,
+                    'stream_callback': make_streaming_bubble(statement_placeholder, current_actor, f"({current_speaker_index}/{total_speakers_this_trial}) **{current_actor}:** "),
+                })
                 asyncio.run(decision_flow.run_async(st.session_state))
 
                 # Retrieve the statement from the database (always logged by node)
@@ -1641,17 +1638,27 @@ while True:
                     character_name=current_actor,
                     content=full_speaker_message,
                     emotion=speaker_emotion,
-                    sleep_time=0.5
+                    sleep_time=0.5,
+                    placeholder=statement_placeholder
                 )
+                persist_game() # Save after each statement, so a resumed game doesn't replay it
                 # No rerun inside the loop
 
+            if not transitioned_to_input:
+                # The vote only depends on the discussion log: start it now so it overlaps the
+                # pause and Monokuma's closing line. Votes are logged when CLASS_TRIAL_VOTE commits them.
+                cursor.execute("SELECT name FROM roles WHERE is_alive = 1 ORDER BY id")
+                trial_ai_voters = [name for name, in cursor.fetchall()
+                                   if not (name == user_character_name and viewer_mode_selection == PLAYER_MODE_OPTION)]
+                st.session_state.trial_vote_draft = VoteBatchDraft(st.session_state, trial_ai_voters, "CLASS_TRIAL_VOTE", key=current_day)
+
             time.sleep(8)
 
             # --- After the loop --- #
             # If we broke for user input, do nothing here; the main loop will handle the state change.
             # If the loop finished naturally, transition to the vote phase.
             if transitioned_to_input:
-                st.rerun() # Rerun to enter the user input state
+                rerun() # Rerun to enter the user input state
             if not transitioned_to_input and not st.session_state.current_phase_actors:
                 st.session_state.current_phase_actors = None # Reset for next day/phase
                 # --- ADDED: Reset total speakers ---
@@ -1669,6 +1676,7 @@ while True:
 
     # --- Class Trial: Vote --- (MODIFIED for User Input)
     if st.session_state.current_state == "CLASS_TRIAL_VOTE":
+        profile_state("CLASS_TRIAL_VOTE")
         current_day = st.session_state.current_day
         current_phase = st.session_state.current_state
         conn = st.session_state.db_conn
@@ -1686,29 +1694,48 @@ while True:
 
         next_state = None
 
+        # "Votes in: x/y" while the AI votes come in (cleared once they are all logged)
+        show_votes_in, clear_votes_in = make_votes_in_indicator()
+
+        # AI votes usually started right after the last statement; commit them if they match
+        ai_voters = [name for name in living_voters if not (user_needs_to_vote and name == user_character_name)]
+        trial_vote_draft = st.session_state.pop("trial_vote_draft", None)
+        if trial_vote_draft is not None and trial_vote_draft.key == current_day and trial_vote_draft.character_names == ai_voters:
+            trial_vote_draft.commit(st.session_state, on_progress=show_votes_in)
+            ai_voters = [] # Already logged
+        elif trial_vote_draft is not None:
+            trial_vote_draft.discard() # Stale (another day, or the voters changed); the flow below re-runs them
+
         if user_needs_to_vote:
             # --- User Votes Scenario ---
-            ai_voters = [name for name in living_voters if name != user_character_name]
             # Run parallel flow for AI voters if any exist
             if ai_voters:
                 st.session_state["acting_characters"] = ai_voters
-                parallel_trial_vote_flow = create_parallel_decision_flow()
+                show_votes_in(0, len(ai_voters))
+                parallel_trial_vote_flow = create_parallel_decision_flow(
+                    on_result=lambda params, status, done_count, total: show_votes_in(done_count, total)
+                )
                 # Run async flow
                 asyncio.run(parallel_trial_vote_flow.run_async(st.session_state))
                 st.session_state.pop("acting_characters", None) # Clean up
+            clear_votes_in()
             # Transition to user input state
             st.session_state.current_state = "CLASS_TRIAL_VOTE_USER_INPUT"
-            st.rerun()
+            rerun()
 
         else:
             # --- AI Votes Only Scenario (Viewer Mode) ---
             # Run parallel flow for ALL voters if any exist
-            if living_voters:
-                st.session_state["acting_characters"] = living_voters
-                parallel_trial_vote_flow = create_parallel_decision_flow()
+            if ai_voters:
+                st.session_state["acting_characters"] = ai_voters
+                show_votes_in(0, len(ai_voters))
+                parallel_trial_vote_flow = create_parallel_decision_flow(
+                    on_result=lambda params, status, done_count, total: show_votes_in(done_count, total)
+                )
                 # Run async flow
                 asyncio.run(parallel_trial_vote_flow.run_async(st.session_state))
                 st.session_state.pop("acting_characters", None) # Clean up
+            clear_votes_in()
             # Transition directly to reveal state
             st.session_state.current_state = "EXECUTION_REVEAL"
             # No rerun needed, main loop continues
@@ -1716,6 +1743,7 @@ while True:
 
     # --- Class Trial: Vote User Input --- (NEW STATE)
     if st.session_state.current_state == "CLASS_TRIAL_VOTE_USER_INPUT":
+        profile_state("CLASS_TRIAL_VOTE_USER_INPUT")
         current_day = st.session_state.current_day
         current_phase = st.session_state.current_state # Log user vote here
         conn = st.session_state.db_conn
@@ -1751,7 +1779,7 @@ while True:
             if vote_submitted_button:
                 # Set flag immediately and rerun
                 st.session_state.ct_vote_form_submitted = True
-                st.rerun()
+                rerun()
             elif not st.session_state.ct_vote_form_submitted:
                 # Wait for user submission
                  break
@@ -1782,6 +1810,7 @@ while True:
 
     # --- Execution Reveal --- (MODIFIED for User Input Consolidation)
     if st.session_state.current_state == "EXECUTION_REVEAL":
+        profile_state("EXECUTION_REVEAL")
         current_day = st.session_state.current_day
         # Votes could have come from VOTE or VOTE_USER_INPUT phases
         possible_vote_phases = ['CLASS_TRIAL_VOTE', 'CLASS_TRIAL_VOTE_USER_INPUT']
@@ -1915,6 +1944,7 @@ while True:
 
     # --- Game Over: Hope Wins ---
     if st.session_state.current_state == "GAME_OVER_HOPE":
+        profile_state("GAME_OVER_HOPE")
         st.balloons()
         st.success("GAME OVER: HOPE WINS!")
         display_interactive_message(
@@ -1924,10 +1954,11 @@ while True:
             sleep_time=0.5,
             audio_path="./assets/notover.wav"
         )
-        st.stop() # End the app execution
+        stop() # End the app execution
 
     # --- Game Over: Despair Wins ---
     if st.session_state.current_state == "GAME_OVER_DESPAIR":
+        profile_state("GAME_OVER_DESPAIR")
         st.error("GAME OVER: DESPAIR WINS!")
         conn = st.session_state.db_conn
         cursor = conn.cursor()
@@ -1943,8 +1974,14 @@ while True:
             emotion="blackened",
             sleep_time=0.5
         )
-        st.stop() # End the app execution
+        stop() # End the app execution
 
+    profiling.end_phase()
     print("DEBUG: current_state", st.session_state.current_state)
     # wait for 1 second
     time.sleep(1)
+
+profiling.end_phase()
+# Save what this run added (e.g. messages shown before waiting on the user)
+persist_game()
+observe_run("done")
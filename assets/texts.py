@@ -4,28 +4,34 @@ import random
 #     "Gonta", "Kaede", "Kiibo", "Kokichi", "Maki", "Ryoma", "Tenko", "Himiko", "Kaito", "Kirumi", "Korekiyo", "Miu", "Rantaro", "Shuichi", "Tsumugi"
 # ]
 
-character_names = [
+# Every character that can be cast; a game's roster is picked with select_roster()
+character_names = (
     "Gonta", "Kaede", "Kiibo", "Kokichi", "Maki",
     "Ryoma", "Himiko", "Kaito", "Kirumi", "Miu",
     "Rantaro", "Shuichi", "Tsumugi", "Tenko", "Korekiyo",
     "ChatGPT","Monokuma"
-]
+)
 
-rare_characters = ["Monokuma"]
+rare_characters = ("Monokuma",)
 rare_character_chance = 25 # percent chance to include a randomly pulled rare character
 
-required_characters = ["Shuichi"]
+required_characters = ("Shuichi",)
 character_count = 12
-actual_characters = required_characters
-for c in required_characters: character_names.remove(c)
-
-while len(required_characters) < character_count and len(character_names) > 0:
-    c = random.choice(character_names)
-    character_names.remove(c)
-    if c in rare_characters and random.randint(1,100) > rare_character_chance:
-        continue
-    actual_characters.append(c)
-character_names = actual_characters
+
+def select_roster(seed=None, count=character_count, rare_chance=rare_character_chance):
+    """Picks a game's cast: the required characters plus random others, up to `count`.
+    A rare character that gets pulled only joins with `rare_chance` percent probability.
+    The same seed always gives the same roster; None draws a fresh one."""
+    rng = random.Random(seed)
+    roster = list(required_characters)
+    pool = [c for c in character_names if c not in required_characters]
+    while len(roster) < count and len(pool) > 0:
+        c = rng.choice(pool)
+        pool.remove(c)
+        if c in rare_characters and rng.randint(1,100) > rare_chance:
+            continue
+        roster.append(c)
+    return roster
 
 # --- Character Introduction Data ---
 character_intros = {
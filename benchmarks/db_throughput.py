@@ -0,0 +1,113 @@
+"""Measures DecisionNode database throughput with concurrent decision batches.
+
+Several threads (the Streamlit script thread plus background drafts, in the app) each run
+batches of DecisionNode prep/post concurrently against one game database, with the LLM
+call replaced by a fixed vote. Two set-ups are compared:
+
+  shared  - one connection shared by every thread (the original app set-up)
+  writer  - a game in the shared WAL store, with a per-thread read pool and the serialized DBWriter
+
+and writes/s, reads/s and errors are reported for each.
+
+    python -m benchmarks.db_throughput --threads 4 --batches 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from functools import partial
+
+from benchmarks.reasoning_modes import HISTORY, ROSTER, _create_game
+from nodes import DecisionNode
+from utils.db_writer import DBWriter, ReadPool
+from utils import game_db
+from utils.game_db import connect, create_game, new_game_id
+
+SETUPS = ["shared", "writer"]
+PHASE = "CLASS_TRIAL_VOTE"
+
+def _create_shared(setup):
+    shared = _create_game(PHASE)
+    if setup == "writer":
+        game_id = new_game_id() # A game in the shared WAL store, as in the app
+        create_game(game_id)
+        conn = connect(game_id)
+        for table in ["roles", "actions"]:
+            rows = shared["db_conn"].execute(f"SELECT * FROM {table}").fetchall()
+            conn.executemany(f"INSERT INTO {table} VALUES ({', '.join('?' * len(rows[0]))})", rows)
+        conn.commit()
+        shared["db_conn"] = conn
+        shared["db_writer"] = DBWriter(partial(connect, game_id))
+        shared["db_read_pool"] = ReadPool(partial(connect, game_id))
+    return shared
+
+async def _decide(shared, character_name, counts):
+    node = DecisionNode()
+    node.set_params({"character_name": character_name})
+    try:
+        prep_res = await node.prep_async(shared)
+        counts["reads"] += 1
+        # Stand-in for the LLM call: vote for the first valid target
+        target = prep_res["valid_target_names"][0] if prep_res["valid_target_names"] else None
+        await node.post_async(shared, prep_res, {"thinking": "benchmark", "validated_target_name": target})
+        counts["writes"] += 2 # thinking + vote
+    except Exception as e:
+        counts[f"error: {type(e).__name__}: {e}"] += 1
+
+def _worker(shared, batches, voters, counts):
+    async def run():
+        for _ in range(batches):
+            await asyncio.gather(*(_decide(shared, name, counts) for name in voters))
+    asyncio.run(run())
+
+def benchmark(setup, threads, batches):
+    shared = _create_shared(setup)
+    voters = [name for name, _ in ROSTER]
+    per_thread = [Counter() for _ in range(threads)]
+    workers = [threading.Thread(target=_worker, args=(shared, batches, voters, counts)) for counts in per_thread]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    if shared.get("db_writer"):
+        shared["db_writer"].close()
+        shared["db_read_pool"].close()
+    counts = sum(per_thread, Counter())
+    logged = shared["db_conn"].execute("SELECT COUNT(*) FROM actions").fetchone()[0] - len(HISTORY)
+    errors = {k: v for k, v in counts.items() if k.startswith("error")}
+    return {
+        "elapsed_s": round(elapsed, 3),
+        "writes_per_s": round(counts["writes"] / elapsed, 1),
+        "reads_per_s": round(counts["reads"] / elapsed, 1),
+        "rows_logged": logged,
+        "rows_expected": threads * batches * len(voters) * 2,
+        "errors": sum(errors.values()),
+        "error_kinds": errors,
+    }
+
+def main(argv=None):
+    game_db.GAME_STORE_PATH = os.path.join(tempfile.mkdtemp(), "games.db") # Keep benchmark games out of the real store
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--setups", nargs="+", default=SETUPS, choices=SETUPS)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--batches", type=int, default=50, help="Decision batches per thread (8 voters each)")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for setup in args.setups:
+        results[setup] = benchmark(setup, args.threads, args.batches)
+        print(f"{setup:>6} {json.dumps(results[setup])}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+"""Checks that background drafts from many sessions run at the same time instead of queueing.
+
+Each simulated session starts what app.py starts while it waits on the user: a
+`DecisionDraft` for the user's character and a `VoteBatchDraft` for a 12-voter class-trial
+vote, on its own game (synthetic one-day log, temporary store). Every LLM call takes
+`--llm-latency` seconds (offline stand-in plus a sleep). If drafts overlap, every draft is
+ready after about one LLM latency however many sessions are waiting; if they queued
+behind a fixed number of workers, the slowest would wait for sessions / workers latencies.
+
+For each level (`--sessions`, default 1 4 16 64) it reports the wall time until every draft
+was ready, the slowest and median draft, and `slowest_over_latency` (about 1 when they
+overlap).
+
+    python -m benchmarks.draft_overlap
+    python -m benchmarks.draft_overlap --sessions 8 32 --llm-latency 2 --output draft_overlap.json
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import flow
+import nodes
+from benchmarks.hot_path import _create_game
+from utils import call_llm, game_db
+
+def _with_latency(call, latency):
+    async def slow(prompt, *args, **kwargs):
+        await asyncio.sleep(latency)
+        return await call(prompt, *args, **kwargs)
+    return slow
+
+def run_level(sessions, latency):
+    games = [_create_game("day1")[0] for _ in range(sessions)]
+    for shared in games:
+        shared["current_state"] = "CLASS_TRIAL_DISCUSSION"
+    start = time.perf_counter()
+    ready = [] # Seconds from a draft's start until its result was ready
+    drafts = []
+    for shared in games:
+        for make in (lambda: flow.DecisionDraft(shared, "Shuichi"),
+                     lambda: flow.VoteBatchDraft(shared, shared["shuffled_character_order"], "CLASS_TRIAL_VOTE")):
+            started = time.perf_counter()
+            draft = make()
+            draft.future.add_done_callback(lambda _, started=started: ready.append(time.perf_counter() - started))
+            drafts.append(draft)
+    for draft in drafts:
+        draft.future.result()
+    wall = time.perf_counter() - start
+    for shared in games:
+        shared["db_conn"].close()
+    return {
+        "sessions": sessions,
+        "drafts": len(drafts),
+        "wall_s": round(wall, 3),
+        "draft_s_median": round(statistics.median(ready), 3),
+        "draft_s_max": round(max(ready), 3),
+        "slowest_over_latency": round(max(ready) / latency, 2),
+    }
+
+def main(argv=None):
+    game_db.GAME_STORE_PATH = os.path.join(tempfile.mkdtemp(), "games.db") # Keep benchmark games out of the real store
+    call_llm.LLM_BACKEND = "local"
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 4, 16, 64], help="Sessions drafting at once")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="Seconds every LLM call takes")
+    parser.add_argument("--verbose", action="store_true", help="Show the decision nodes' own output")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    nodes.call_llm_async = _with_latency(nodes.call_llm_async, args.llm_latency)
+    results = {}
+    for level in args.sessions:
+        with open(os.devnull, "w") as devnull, \
+                contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+            summary = run_level(level, args.llm_latency)
+        results[str(level)] = summary
+        print(f"{level:>4} {json.dumps(summary)}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"llm_latency_s": args.llm_latency, "levels": results}, f, indent=2)
+
+if __name__ == "__main__":
+    sys.exit(main())
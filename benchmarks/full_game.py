@@ -0,0 +1,337 @@
+"""Plays complete AI-vs-AI games through app.py's state machine and reports throughput and
+where each game's time goes, at several concurrency levels.
+
+Every game runs app.py under Streamlit's app testing framework (Monokuma view, so the AI
+plays every character) with its own seed, in a temporary game store. LLM calls are answered
+by the offline stand-in after `--llm-latency` seconds. The UI's pauses (app.py's
+`time.sleep` calls) are counted at their full length but only slept for `--sleep-scale` of
+it (0 skips them).
+
+For each level (`--levels`, default 1 10 100 simultaneous games) it reports games/hour,
+games per CPU-hour (games/hour per fully used core), wall-clock per game day, the split
+of game time into sleep / LLM wait / engine, and peak RSS and thread count. Rates count
+completed games only; games that failed or were still playing after `--max-runs` reruns
+are reported as `incomplete`, with the state they stopped in and their error.
+
+    python -m benchmarks.full_game --levels 1 10 --llm-latency 2
+    python -m benchmarks.full_game --levels 1 --sleep-scale 1 --output full_game.json   # real pacing
+"""
+import argparse
+import asyncio
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import streamlit
+from streamlit.runtime.runtime import Runtime
+from streamlit.runtime.scriptrunner import magic
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from streamlit.testing.v1 import AppTest
+
+import flow
+import nodes
+from utils import call_llm, game_db
+from utils.session_registry import process_rss_bytes
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+MONOKUMA_VIEW = 2 # Index of the Monokuma (AI plays, full info) option in the game mode radio
+_real_sleep = time.sleep
+_game = contextvars.ContextVar("benchmark_game", default=None) # Game id for work handed to background threads
+
+class _GameTimes:
+    """Sleep and LLM intervals recorded for one game."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sleeps = [] # (start, end) on the script thread
+        self.nominal_sleep = 0.0 # What the UI asked for, before --sleep-scale
+        self.llm_calls = [] # (start, end), possibly overlapping (parallel decisions)
+
+    def breakdown(self, wall):
+        """Splits wall time into sleep, LLM wait (LLM in flight while not sleeping) and engine."""
+        sleep = sum(end - start for start, end in self.sleeps)
+        merged = []
+        for start, end in sorted(self.llm_calls):
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        llm = sum(end - start for start, end in merged)
+        llm -= sum(max(0.0, min(end, s_end) - max(start, s_start))
+                   for start, end in merged for s_start, s_end in self.sleeps)
+        return sleep, llm, max(0.0, wall - sleep - llm)
+
+class _Instrumentation:
+    """Patches time.sleep, the DecisionNode LLM calls and background submission to attribute
+    time to games and to apply the configured sleep scale and LLM latency."""
+    def __init__(self, sleep_scale, llm_latency):
+        self.sleep_scale = sleep_scale
+        self.llm_latency = llm_latency
+        self.games = {}
+        self._lock = threading.Lock()
+
+    def times(self, game_id):
+        with self._lock:
+            return self.games.setdefault(game_id, _GameTimes())
+
+    def current_game_id(self):
+        """The game the calling code belongs to: a script thread's session, or the game that
+        submitted the background work."""
+        game_id = _game.get()
+        if game_id is None:
+            ctx = get_script_run_ctx(suppress_warning=True)
+            if ctx is not None:
+                try:
+                    game_id = ctx.session_state["game_id"]
+                except KeyError:
+                    pass
+        return game_id
+
+    def current(self):
+        game_id = self.current_game_id()
+        return self.times(game_id) if game_id else None
+
+    def install(self):
+        time.sleep = self._sleep
+        nodes.call_llm_async = self._timed_call(nodes.call_llm_async)
+        nodes.stream_llm_async = self._timed_stream(nodes.stream_llm_async)
+        flow.submit_async = self._submit_with_game(flow.submit_async)
+        streamlit.image = lambda *args, **kwargs: None # The banner image isn't shipped with the repo
+        _share_test_runtime()
+        _serialize_compilation()
+
+    def _sleep(self, seconds):
+        # Only app.py's own pauses are UI pacing; other sleeps (e.g. polling a draft) wait for real
+        times = self.current() if sys._getframe(1).f_code.co_filename == APP_PATH else None
+        if times is None:
+            return _real_sleep(seconds)
+        start = time.perf_counter()
+        _real_sleep(seconds * self.sleep_scale)
+        with times.lock:
+            times.sleeps.append((start, time.perf_counter()))
+            times.nominal_sleep += seconds
+
+    def _timed_call(self, call):
+        async def timed(prompt, *args, **kwargs):
+            times, start = self.current(), time.perf_counter()
+            try:
+                if self.llm_latency:
+                    await asyncio.sleep(self.llm_latency)
+                return await call(prompt, *args, **kwargs)
+            finally:
+                if times is not None:
+                    with times.lock:
+                        times.llm_calls.append((start, time.perf_counter()))
+        return timed
+
+    def _timed_stream(self, stream):
+        async def timed(prompt, *args, **kwargs):
+            times, start = self.current(), time.perf_counter()
+            try:
+                if self.llm_latency:
+                    await asyncio.sleep(self.llm_latency)
+                async for chunk in stream(prompt, *args, **kwargs):
+                    yield chunk
+            finally:
+                if times is not None:
+                    with times.lock:
+                        times.llm_calls.append((start, time.perf_counter()))
+        return timed
+
+    def _submit_with_game(self, submit):
+        def submit_for_game(coro_fn, *args):
+            game_id = self.current_game_id()
+            async def run(*run_args):
+                _game.set(game_id)
+                return await coro_fn(*run_args)
+            return submit(run, *args)
+        return submit_for_game
+
+def _share_test_runtime():
+    """AppTest installs a mock Runtime singleton for each run and clears it when the run ends,
+    which breaks any other game still running. Fall back to the last one installed."""
+    installed = {}
+    def instance(cls):
+        if cls._instance is not None:
+            installed["runtime"] = cls._instance
+            return cls._instance
+        if "runtime" in installed:
+            return installed["runtime"]
+        raise RuntimeError("Runtime hasn't been created!")
+    Runtime.instance = classmethod(instance)
+    Runtime.exists = classmethod(lambda cls: cls._instance is not None or "runtime" in installed)
+
+def _serialize_compilation():
+    """Every AppTest compiles app.py itself, and ast.parse isn't thread-safe (CPython 3.11 raises
+    "SystemError: AST constructor recursion depth mismatch" when two threads parse at once).
+    Streamlit only logs that, and the game silently never starts."""
+    lock, add_magic = threading.Lock(), magic.add_magic
+    def add_magic_serialized(code, script_path):
+        with lock:
+            return add_magic(code, script_path)
+    magic.add_magic = add_magic_serialized
+
+class _ErrorLog(logging.Handler):
+    """Collects errors Streamlit logs instead of raising (e.g. a script that failed to compile)."""
+    def __init__(self, errors):
+        super().__init__(logging.ERROR)
+        self.errors = errors
+
+    def emit(self, record):
+        self.errors.append(f"{record.name}: {record.getMessage()}" + (f": {record.exc_info[1]!r}" if record.exc_info else ""))
+
+def _streamlit_loggers():
+    # Streamlit's loggers don't propagate to the "streamlit" parent, so attach to each one
+    return [logger for name, logger in logging.Logger.manager.loggerDict.items()
+            if name.startswith("streamlit") and isinstance(logger, logging.Logger)]
+
+def _play(seed, timeout, max_runs, results):
+    """Plays one game to GAME_OVER (or until it fails or runs out of reruns) and appends its
+    record to `results`. A failure is recorded with the state the game had reached."""
+    record = {"seed": seed, "game_id": None, "wall_s": 0.0, "days": 0, "outcome": None, "runs": 0, "error": None}
+    at, start = None, time.perf_counter()
+    try:
+        at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+        at.query_params["seed"] = seed
+        at.run()
+        mode = at.radio(key="viewer_mode_selection")
+        mode.set_value(mode.options[MONOKUMA_VIEW])
+        start = time.perf_counter()
+        at.button(key="start_game_button").click().run()
+        record["runs"] = 1
+        while not at.session_state.current_state.startswith("GAME_OVER") and record["runs"] < max_runs and not at.exception:
+            at.run()
+            record["runs"] += 1
+        if at.exception:
+            record["error"] = at.exception[0].message
+    except Exception as e:
+        record["error"] = repr(e)
+    record["wall_s"] = time.perf_counter() - start
+    if at is not None:
+        for key, field in (("game_id", "game_id"), ("days", "current_day"), ("outcome", "current_state")):
+            try:
+                record[key] = at.session_state[field]
+            except Exception: # The script never got that far
+                pass
+    results.append(record)
+
+def _sample_resources(stop, peak):
+    while not stop.is_set():
+        peak["rss"] = max(peak["rss"], process_rss_bytes() or 0)
+        peak["threads"] = max(peak["threads"], threading.active_count())
+        stop.wait(0.2)
+
+def run_level(instrumentation, concurrency, games, seed, timeout, max_runs):
+    """Plays `games` games, at most `concurrency` at a time, and summarizes them. Games that
+    didn't reach GAME_OVER are reported as incomplete, with the state they stopped in."""
+    results, peak, stop = [], {"rss": 0, "threads": 0}, threading.Event()
+    thread_errors = [] # Exceptions that escaped a thread (e.g. Streamlit's script runner) instead of reaching AppTest
+    default_excepthook = threading.excepthook
+    def record_thread_error(args):
+        thread_errors.append(f"{args.thread.name if args.thread else '?'}: {args.exc_type.__name__}: {args.exc_value}")
+        default_excepthook(args)
+    threading.excepthook = record_thread_error
+    error_log = _ErrorLog(thread_errors)
+    for logger in _streamlit_loggers():
+        logger.addHandler(error_log)
+    sampler = threading.Thread(target=_sample_resources, args=(stop, peak), daemon=True)
+    sampler.start()
+    seeds = iter(f"{seed}:{i}" for i in range(games))
+    seeds_lock = threading.Lock()
+
+    def player():
+        while True:
+            with seeds_lock:
+                game_seed = next(seeds, None)
+            if game_seed is None:
+                return
+            _play(game_seed, timeout, max_runs, results)
+
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    players = [threading.Thread(target=player, name=f"game-{i}") for i in range(min(concurrency, games))]
+    for t in players:
+        t.start()
+    try:
+        for t in players:
+            t.join()
+    finally:
+        threading.excepthook = default_excepthook
+        for logger in _streamlit_loggers():
+            logger.removeHandler(error_log)
+    wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+    stop.set()
+    sampler.join()
+
+    completed = [r for r in results if r["outcome"] and r["outcome"].startswith("GAME_OVER")]
+    incomplete = [r for r in results if not (r["outcome"] or "").startswith("GAME_OVER")]
+    split = {"sleep": 0.0, "llm": 0.0, "engine": 0.0}
+    nominal_sleep, day_walls = 0.0, []
+    for r in completed:
+        times = instrumentation.times(r["game_id"])
+        sleep, llm, engine = times.breakdown(r["wall_s"])
+        split["sleep"] += sleep
+        split["llm"] += llm
+        split["engine"] += engine
+        nominal_sleep += times.nominal_sleep
+        day_walls.append(r["wall_s"] / max(1, r["days"]))
+    game_time = sum(split.values()) or 1.0
+    return {
+        "concurrency": concurrency,
+        "games": games,
+        "completed": len(completed),
+        "incomplete": len(incomplete), # Failed, or still playing after --max-runs reruns
+        "incomplete_games": [{"seed": r["seed"], "state": r["outcome"], "day": r["days"], "runs": r["runs"], "error": r["error"]}
+                             for r in incomplete][:5],
+        "errors": ([r["error"] for r in results if r["error"]] + thread_errors)[:5],
+        "wall_s": round(wall, 2),
+        "cpu_s": round(cpu, 2),
+        "games_per_hour": round(len(completed) / wall * 3600, 1),
+        "games_per_cpu_hour": round(len(completed) / cpu * 3600, 1) if cpu else None,
+        "game_wall_s_mean": round(statistics.mean(r["wall_s"] for r in completed), 2) if completed else None,
+        "day_wall_s_p50": round(statistics.median(day_walls), 2) if day_walls else None,
+        "day_wall_s_max": round(max(day_walls), 2) if day_walls else None,
+        "mean_days": round(statistics.mean(r["days"] for r in completed), 2) if completed else None,
+        "sleep_share": round(split["sleep"] / game_time, 3),
+        "llm_share": round(split["llm"] / game_time, 3),
+        "engine_share": round(split["engine"] / game_time, 3),
+        "nominal_sleep_s_per_game": round(nominal_sleep / len(completed), 1) if completed else None,
+        "peak_rss_mb": round(peak["rss"] / 2**20, 1),
+        "peak_threads": peak["threads"],
+    }
+
+def main(argv=None):
+    game_db.GAME_STORE_PATH = os.path.join(tempfile.mkdtemp(), "games.db") # Keep benchmark games out of the real store
+    call_llm.LLM_BACKEND = "local" # Responses come from the offline stand-in, after --llm-latency
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 10, 100], help="Simultaneous games")
+    parser.add_argument("--games", type=int, default=None, help="Games per level (default: the level)")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="Seconds added to every LLM call")
+    parser.add_argument("--sleep-scale", type=float, default=0.0, help="Fraction of the UI pauses actually slept")
+    parser.add_argument("--seed", default="bench", help="Game seeds are <seed>:<n>, so levels replay the same games")
+    parser.add_argument("--timeout", type=float, default=3600, help="Seconds a single script run may take")
+    parser.add_argument("--max-runs", type=int, default=50, help="Give up on a game after this many reruns")
+    parser.add_argument("--verbose", action="store_true", help="Show the app's own output")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    instrumentation = _Instrumentation(args.sleep_scale, args.llm_latency)
+    instrumentation.install()
+    results = {}
+    for level in args.levels:
+        with open(os.devnull, "w") as devnull, \
+                contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+            summary = run_level(instrumentation, level, args.games or level, args.seed, args.timeout, args.max_runs)
+        results[str(level)] = summary
+        print(f"{level:>4} {json.dumps(summary)}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"llm_latency_s": args.llm_latency, "sleep_scale": args.sleep_scale, "levels": results}, f, indent=2)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,228 @@
+"""Times the DecisionNode hot path and the vote/audio helpers app.py calls on every rerun.
+
+`DecisionNode.prep_async`, `exec_async` (LLM stubbed by the offline stand-in) and
+`post_async` run against games in a temporary store whose action log is synthetic:
+`day1` (one day of play), `day5` (five days) and `10k` (10,000 actions). `tally_votes`,
+`format_vote_summary` and `get_hidden_autoplay_html` are timed on their own.
+
+Results are per-call times (min, median and p95, in ms). `--output` writes them as JSON;
+`--baseline` compares against a stored run and exits with status 1 if any case got slower
+by more than `--tolerance`. Cases are compared on their fastest sample, which is the least
+disturbed by other load on the machine.
+
+    python -m benchmarks.hot_path --output benchmarks/baselines/hot_path.json   # refresh the baseline
+    python -m benchmarks.hot_path --baseline benchmarks/baselines/hot_path.json
+    python -m benchmarks.hot_path --logs 10k --profile /tmp/hot_path              # one .pstats file per case
+"""
+import argparse
+import asyncio
+import cProfile
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from nodes import DecisionNode
+from utils import call_llm, game_db
+from utils.game_db import connect, create_game, new_game_id
+from utils.media import get_asset_path, get_hidden_autoplay_html
+from utils.votes import format_vote_summary, tally_votes
+
+ROSTER = [
+    ("Kaede", "Truth-Seeker"), ("Kokichi", "Blackened"), ("Shuichi", "Student"), ("Maki", "Blackened"),
+    ("Kaito", "Guardian"), ("Himiko", "Student"), ("Gonta", "Student"), ("Tsumugi", "Student"),
+    ("Kirumi", "Student"), ("Korekiyo", "Student"), ("Kiibo", "Student"), ("Rantaro", "Student"),
+]
+LOGS = {"day1": {"days": 1}, "day5": {"days": 5}, "10k": {"actions": 10000}}
+PHASES = ["CLASS_TRIAL_DISCUSSION", "CLASS_TRIAL_VOTE"]
+STATEMENT = "I was in the library all night. {target} is the only one without an alibi, and that's suspicious."
+THINKING = "{target} keeps dodging questions. If I push now the others might follow, but I can't look too eager."
+
+def _synthetic_day(day, rng):
+    """One day of actions in the order the game logs them (night, morning, trial)."""
+    names = [name for name, _ in ROSTER]
+    blackened = [name for name, role in ROSTER if role == "Blackened"]
+    rows = []
+    for actor in blackened:
+        rows.append((day, "NIGHT_PHASE_BLACKENED_DISCUSSION", actor, "thinking", THINKING.format(target=rng.choice(names)), None, None))
+        rows.append((day, "NIGHT_PHASE_BLACKENED_DISCUSSION", actor, "statement", STATEMENT.format(target=rng.choice(names)), None, None))
+    for actor in blackened:
+        rows.append((day, "NIGHT_PHASE_BLACKENED_VOTE", actor, "blackened_decision", None, rng.choice(names), None))
+    rows.append((day, "NIGHT_PHASE_TRUTH_SEEKER", "Kaede", "truth_seeker_decision", None, rng.choice(names), None))
+    rows.append((day, "NIGHT_PHASE_TRUTH_SEEKER_REVEAL", "Kaede", "reveal_role_private", "They are a Student.", "Kaede", None))
+    rows.append((day, "NIGHT_PHASE_GUARDIAN", "Kaito", "guardian_decision", None, rng.choice(names), None))
+    rows.append((day, "MORNING_ANNOUNCEMENT", "Monokuma", "announcement", "Nobody died last night. Upupupu...", None, None))
+    for actor in names:
+        rows.append((day, "CLASS_TRIAL_DISCUSSION", actor, "thinking", THINKING.format(target=rng.choice(names)), None, None))
+        rows.append((day, "CLASS_TRIAL_DISCUSSION", actor, "statement", STATEMENT.format(target=rng.choice(names)),
+                     None, rng.choice(["normal", "determined", "think", "worried"])))
+    for actor in names:
+        rows.append((day, "CLASS_TRIAL_VOTE", actor, "thinking", THINKING.format(target=rng.choice(names)), None, None))
+        rows.append((day, "CLASS_TRIAL_VOTE", actor, "vote", None, rng.choice(names + [None]), None))
+    return rows
+
+def _synthetic_log(days=None, actions=None, seed=0):
+    """Returns (rows, day the log ends on): `days` full days, or days until there are `actions` rows."""
+    rng = random.Random(seed)
+    rows, day = [], 0
+    while (days is not None and day < days) or (actions is not None and len(rows) < actions):
+        day += 1
+        rows.extend(_synthetic_day(day, rng))
+    return (rows[:actions] if actions is not None else rows), day
+
+def _create_game(log):
+    """A game in the (temporary) store with the fixed roster and the synthetic log."""
+    rows, last_day = _synthetic_log(**LOGS[log])
+    game_id = new_game_id()
+    create_game(game_id)
+    conn = connect(game_id)
+    conn.executemany("INSERT INTO roles (id, name, role, is_alive) VALUES (?, ?, ?, 1)",
+                     [(i + 1, name, role) for i, (name, role) in enumerate(ROSTER)])
+    conn.executemany("INSERT INTO actions (day, phase, actor_name, action_type, content, target_name, emotion) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    return {
+        "db_conn": conn,
+        "current_day": last_day + 1,
+        "shuffled_character_order": [name for name, _ in ROSTER],
+        "user_character_name": None,
+    }, len(rows)
+
+def _summary(samples):
+    ordered = sorted(samples)
+    return {
+        "min_ms": round(ordered[0] * 1000, 4),
+        "median_ms": round(statistics.median(ordered) * 1000, 4),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 4),
+        "runs": len(ordered),
+    }
+
+class _Profiler:
+    """Collects one cProfile per benchmark case when --profile is given."""
+    def __init__(self, directory):
+        self.directory = directory
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        if not self.directory:
+            return None
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def stop(self, profile, case):
+        if profile is not None:
+            profile.disable()
+            profile.dump_stats(os.path.join(self.directory, case.replace("/", "_") + ".pstats"))
+
+async def _time_node(shared, phase, repeat, profiler, results, log):
+    """Times prep, exec and post for one character, `repeat` times each."""
+    node = DecisionNode()
+    node.set_params({"character_name": "Shuichi", "phase": phase})
+    shared["current_state"] = phase
+
+    for step in ("prep", "exec", "post"):
+        samples = []
+        profile = profiler.start()
+        for _ in range(repeat):
+            start = time.perf_counter()
+            if step == "prep":
+                context = await node.prep_async(shared)
+            elif step == "exec":
+                exec_res = await node.exec_async(context)
+            else:
+                await node.post_async(shared, context, exec_res)
+            samples.append(time.perf_counter() - start)
+        case = f"{log}/{phase}/{step}"
+        profiler.stop(profile, case)
+        results[case] = _summary(samples)
+        print(f"{case:<40} {json.dumps(results[case])}")
+
+def _time_function(name, fn, repeat, number, profiler, results):
+    """Times `number` calls of fn per sample and reports the per-call time."""
+    samples = []
+    profile = profiler.start()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - start) / number)
+    profiler.stop(profile, name)
+    results[name] = _summary(samples)
+    print(f"{name:<40} {json.dumps(results[name])}")
+
+def benchmark(logs, repeat, number, profile_dir=None):
+    profiler = _Profiler(profile_dir)
+    results = {}
+    for log in logs:
+        shared, action_count = _create_game(log)
+        print(f"{log}: {action_count} actions, day {shared['current_day']}")
+        for phase in PHASES:
+            asyncio.run(_time_node(shared, phase, repeat, profiler, results, log))
+        shared["db_conn"].close()
+
+    rng = random.Random(0)
+    names = [name for name, _ in ROSTER]
+    votes = [(voter, rng.choice(names + [None])) for voter in names]
+    _time_function("tally_votes", lambda: tally_votes(votes), repeat, number, profiler, results)
+    _time_function("tally_votes/random_tie", lambda: tally_votes(votes[:2], tie_break_strategy='random', rng=rng),
+                   repeat, number, profiler, results)
+    _time_function("format_vote_summary", lambda: format_vote_summary(votes), repeat, number, profiler, results)
+    audio_path = get_asset_path("Kaede", "audio", "normal")
+    _time_function("get_hidden_autoplay_html", lambda: get_hidden_autoplay_html(audio_path),
+                   repeat, max(1, number // 10), profiler, results)
+    _time_function("get_hidden_autoplay_html/missing", lambda: get_hidden_autoplay_html("assets/missing.wav"),
+                   repeat, max(1, number // 10), profiler, results)
+    return results
+
+def compare(results, baseline, tolerance, min_delta_ms):
+    """Returns the cases whose fastest run is more than `tolerance` (a fraction) slower than the baseline.
+    Differences below `min_delta_ms` are treated as noise."""
+    regressions = []
+    for case, current in results.items():
+        before = baseline.get(case)
+        if before is None:
+            print(f"{case:<40} new")
+            continue
+        delta = current["min_ms"] - before["min_ms"]
+        ratio = current["min_ms"] / before["min_ms"] if before["min_ms"] else float("inf")
+        regressed = ratio > 1 + tolerance and delta > min_delta_ms
+        print(f"{case:<40} {before['min_ms']:>10.4f} -> {current['min_ms']:>10.4f} ms  x{ratio:.2f}{'  REGRESSION' if regressed else ''}")
+        if regressed:
+            regressions.append(case)
+    return regressions
+
+def main(argv=None):
+    game_db.GAME_STORE_PATH = os.path.join(tempfile.mkdtemp(), "games.db") # Keep benchmark games out of the real store
+    call_llm.LLM_BACKEND = "local" # exec_async gets its response from the offline stand-in, not the network
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logs", nargs="+", default=list(LOGS), choices=list(LOGS))
+    parser.add_argument("--repeat", type=int, default=30, help="Samples per case")
+    parser.add_argument("--number", type=int, default=1000, help="Calls per sample for the helper functions")
+    parser.add_argument("--profile", help="Write a cProfile .pstats file per case into this directory")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", help="Compare against the results in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="Allowed slowdown per case (0.5 = 50%%)")
+    parser.add_argument("--min-delta-ms", type=float, default=0.01, help="Ignore slowdowns smaller than this")
+    args = parser.parse_args(argv)
+
+    results = benchmark(args.logs, args.repeat, args.number, args.profile)
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(), "results": results}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance, args.min_delta_ms)
+        if regressions:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
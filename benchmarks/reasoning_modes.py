@@ -0,0 +1,155 @@
+"""Compares DecisionNode reasoning modes (full / short / none) on a fixed voting scenario.
+
+For every mode and phase it runs the parallel decision flow `--trials` times on a fresh
+game state and reports phase latency (p50/p95), thinking length, abstain rate, parse
+retries, agreement with the full-reasoning votes and, for trial votes, how often the
+Hope team voted for a Blackened.
+
+    python -m benchmarks.reasoning_modes --trials 5
+    LLM_BACKEND=local python -m benchmarks.reasoning_modes --trials 1   # dry run, no API calls
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import yaml
+
+from flow import create_parallel_decision_flow
+from utils import metrics, model_routing
+
+PHASES = ["CLASS_TRIAL_VOTE", "NIGHT_PHASE_BLACKENED_VOTE", "NIGHT_PHASE_TRUTH_SEEKER", "NIGHT_PHASE_GUARDIAN"]
+
+# Fixed 8-player scenario on day 2: the Truth-Seeker has publicly outed one Blackened
+ROSTER = [
+    ("Kaede", "Truth-Seeker"), ("Kokichi", "Blackened"), ("Shuichi", "Student"), ("Maki", "Blackened"),
+    ("Kaito", "Guardian"), ("Himiko", "Student"), ("Gonta", "Student"), ("Tsumugi", "Student"),
+]
+HISTORY = [
+    (1, "NIGHT_PHASE_TRUTH_SEEKER", "Kaede", "truth_seeker_decision", None, "Kokichi", None),
+    (1, "NIGHT_PHASE_TRUTH_SEEKER_REVEAL", "Kaede", "reveal_role_private", "Kokichi is Blackened.", "Kaede", None),
+    (2, "CLASS_TRIAL_DISCUSSION", "Kaede", "statement", "I investigated Kokichi last night. He is Blackened. Vote Kokichi!", None, "determined"),
+    (2, "CLASS_TRIAL_DISCUSSION", "Kokichi", "statement", "Kaede is lying! She's the real Blackened, nishishi.", None, "normal"),
+    (2, "CLASS_TRIAL_DISCUSSION", "Shuichi", "statement", "Kaede has no reason to lie. I'm voting Kokichi.", None, "think"),
+    (2, "CLASS_TRIAL_DISCUSSION", "Maki", "statement", "Kaede is too sure of herself. I don't trust her.", None, "normal"),
+    (2, "CLASS_TRIAL_DISCUSSION", "Himiko", "statement", "Nyeh... Kokichi always lies. Kokichi.", None, "worried"),
+]
+ACTING_ROLES = {
+    "CLASS_TRIAL_VOTE": None, # everyone
+    "NIGHT_PHASE_BLACKENED_VOTE": "Blackened",
+    "NIGHT_PHASE_TRUTH_SEEKER": "Truth-Seeker",
+    "NIGHT_PHASE_GUARDIAN": "Guardian",
+}
+
+def _create_game(phase):
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
+    conn.execute("CREATE TABLE roles (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL, role TEXT NOT NULL, is_alive BOOLEAN NOT NULL)")
+    conn.execute("""CREATE TABLE actions (id INTEGER PRIMARY KEY AUTOINCREMENT, day INTEGER NOT NULL, phase TEXT NOT NULL,
+                    actor_name TEXT NOT NULL, action_type TEXT NOT NULL, content TEXT, target_name TEXT, emotion TEXT)""")
+    conn.executemany("INSERT INTO roles (id, name, role, is_alive) VALUES (?, ?, ?, 1)",
+                     [(i + 1, name, role) for i, (name, role) in enumerate(ROSTER)])
+    conn.executemany("INSERT INTO actions (day, phase, actor_name, action_type, content, target_name, emotion) VALUES (?, ?, ?, ?, ?, ?, ?)", HISTORY)
+    conn.commit()
+    acting_role = ACTING_ROLES[phase]
+    return {
+        "db_conn": conn,
+        "current_state": phase,
+        "current_day": 2,
+        "shuffled_character_order": [name for name, _ in ROSTER],
+        "user_character_name": None,
+        "acting_characters": [name for name, role in ROSTER if acting_role in (None, role)],
+    }
+
+def _use_routing(mode, max_output_tokens, model):
+    """Points model routing at a temporary table that applies `mode` to every phase."""
+    table = {"default": {"model": model, "max_output_tokens": max_output_tokens, "reasoning": mode}, "routes": []}
+    handle, path = tempfile.mkstemp(suffix=".yaml")
+    with os.fdopen(handle, "w") as f:
+        yaml.safe_dump(table, f)
+    model_routing.ROUTING_FILE = path
+    return path
+
+def _percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] if ordered else None
+
+async def _run_phase(phase):
+    shared = _create_game(phase)
+    start = time.perf_counter()
+    await create_parallel_decision_flow().run_async(shared)
+    elapsed = time.perf_counter() - start
+    rows = shared["db_conn"].execute(
+        "SELECT actor_name, action_type, content, target_name FROM actions WHERE day = 2 AND phase = ?", (phase,)
+    ).fetchall()
+    votes = {actor: target for actor, atype, _, target in rows if atype != "thinking"}
+    thinking = [content for _, atype, content, _ in rows if atype == "thinking"]
+    return elapsed, votes, thinking
+
+async def benchmark(modes, phases, trials, max_output_tokens, model):
+    roles = dict(ROSTER)
+    results = {}
+    reference_votes = {} # (phase, voter) -> most common full-mode vote
+    for mode in modes:
+        path = _use_routing(mode, max_output_tokens.get(mode), model)
+        try:
+            for phase in phases:
+                retries_before = metrics.get_counter("decision_output_retries", phase=phase)
+                latencies, all_votes, thinking_lengths = [], [], []
+                for _ in range(trials):
+                    elapsed, votes, thinking = await _run_phase(phase)
+                    latencies.append(elapsed)
+                    all_votes.append(votes)
+                    thinking_lengths.extend(len(t or "") for t in thinking)
+
+                cast = [(voter, target) for votes in all_votes for voter, target in votes.items()]
+                if mode == "full":
+                    for voter in {v for v, _ in cast}:
+                        reference_votes[(phase, voter)] = Counter(t for v, t in cast if v == voter).most_common(1)[0][0]
+                compared = [(voter, target) for voter, target in cast if (phase, voter) in reference_votes]
+                hope_votes = [target for voter, target in cast if roles[voter] != "Blackened"]
+                results[f"{mode}/{phase}"] = {
+                    "phase_latency_p50_s": round(statistics.median(latencies), 3),
+                    "phase_latency_p95_s": round(_percentile(latencies, 95), 3),
+                    "mean_thinking_chars": round(statistics.mean(thinking_lengths), 1) if thinking_lengths else 0,
+                    "abstain_rate": round(sum(1 for _, t in cast if t is None) / len(cast), 3) if cast else None,
+                    "parse_retries": metrics.get_counter("decision_output_retries", phase=phase) - retries_before,
+                    "agreement_with_full": round(
+                        sum(1 for v, t in compared if reference_votes[(phase, v)] == t) / len(compared), 3
+                    ) if compared else None,
+                    "hope_votes_on_blackened": round(
+                        sum(1 for t in hope_votes if t and roles[t] == "Blackened") / len(hope_votes), 3
+                    ) if phase == "CLASS_TRIAL_VOTE" and hope_votes else None,
+                }
+                print(f"{mode:>5} {phase:<28} {json.dumps(results[f'{mode}/{phase}'])}")
+        finally:
+            os.remove(path)
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--modes", nargs="+", default=model_routing.REASONING_MODES, choices=model_routing.REASONING_MODES)
+    parser.add_argument("--phases", nargs="+", default=PHASES, choices=PHASES)
+    parser.add_argument("--trials", type=int, default=3)
+    parser.add_argument("--model", default=None, help="Model for every call (default: GEMINI_MODEL)")
+    parser.add_argument("--full-tokens", type=int, default=None, help="max_output_tokens in full mode (default: no cap)")
+    parser.add_argument("--short-tokens", type=int, default=256)
+    parser.add_argument("--none-tokens", type=int, default=64)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args(argv)
+    if "full" in args.modes and args.modes[0] != "full":
+        args.modes = ["full"] + [m for m in args.modes if m != "full"] # full is the reference for agreement
+
+    max_output_tokens = {"full": args.full_tokens, "short": args.short_tokens, "none": args.none_tokens}
+    results = asyncio.run(benchmark(args.modes, args.phases, args.trials, max_output_tokens, args.model))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    sys.exit(main())
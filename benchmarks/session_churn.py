@@ -0,0 +1,82 @@
+"""Simulates churny traffic (sessions that open a game and never come back) and reports
+process memory, threads and resident sessions as sessions arrive.
+
+Each simulated session sets up what app.py does for a new game (a game in the store, its
+connection, DB writer thread and read pool) plus a chat history of `--messages` messages,
+then goes idle. With the reaper (`--ttl`, `--cap`) memory should level off; with
+`--ttl 0 --cap 0` (no reaping) it grows with every session.
+
+    python -m benchmarks.session_churn --sessions 500 --ttl 0.5
+    python -m benchmarks.session_churn --sessions 500 --ttl 0 --cap 0   # no reaping
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from functools import partial
+
+from utils import game_db, metrics, session_registry
+from utils.db_writer import DBWriter, ReadPool
+from utils.game_db import assign_roles_and_log, connect, create_game, new_game_id
+
+ROSTER = ["Kaede", "Kokichi", "Shuichi", "Maki", "Kaito", "Himiko", "Gonta", "Tsumugi"]
+
+def _open_session(messages_per_session):
+    game_id = new_game_id()
+    create_game(game_id)
+    conn = connect(game_id)
+    assign_roles_and_log(conn, ROSTER)
+    writer, read_pool = DBWriter(partial(connect, game_id)), ReadPool(partial(connect, game_id))
+    messages = [{"role": ROSTER[i % len(ROSTER)], "content": f"Statement {i}: " + "Upupupu... " * 50, "emotion": "normal"}
+                for i in range(messages_per_session)]
+    token = uuid.uuid4().hex
+    session_registry.register(token, game_id, closables=[writer, read_pool, conn], clearables=[messages])
+    session_registry.touch(token)
+    return messages # The caller drops it, as Streamlit eventually drops a closed tab
+
+def run(sessions, interval, messages_per_session, report_every):
+    samples = []
+    start = time.perf_counter()
+    for i in range(1, sessions + 1):
+        _open_session(messages_per_session)
+        time.sleep(interval)
+        if session_registry.SESSION_IDLE_TTL or session_registry.MAX_RESIDENT_GAMES:
+            session_registry.reap()
+        if i % report_every == 0:
+            sample = {
+                "sessions": i,
+                "resident": metrics.get_gauge("resident_sessions"),
+                "threads": threading.active_count(),
+                "rss_mb": round((session_registry.process_rss_bytes() or 0) / 2**20, 1),
+                "elapsed_s": round(time.perf_counter() - start, 2),
+            }
+            samples.append(sample)
+            print(json.dumps(sample))
+    return samples
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=500)
+    parser.add_argument("--interval", type=float, default=0.005, help="Seconds between session arrivals")
+    parser.add_argument("--messages", type=int, default=200, help="Chat messages held per session")
+    parser.add_argument("--ttl", type=float, default=0.5, help="SESSION_IDLE_TTL for the run (0 = never idle out)")
+    parser.add_argument("--cap", type=int, default=50, help="MAX_RESIDENT_GAMES for the run (0 = no cap)")
+    parser.add_argument("--report-every", type=int, default=50)
+    parser.add_argument("--output", help="Write the samples as JSON to this file")
+    args = parser.parse_args(argv)
+
+    game_db.GAME_STORE_PATH = os.path.join(tempfile.mkdtemp(), "games.db") # Keep benchmark games out of the real store
+    session_registry.SESSION_IDLE_TTL = args.ttl or float("inf")
+    session_registry.MAX_RESIDENT_GAMES = args.cap or sys.maxsize
+    session_registry.SESSION_MIN_IDLE = 0
+    samples = run(args.sessions, args.interval, args.messages, args.report_every)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(samples, f, indent=2)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,285 @@
+"""Load-tests one Streamlit server (as started by custom_script.py) with N simultaneous
+browser sessions and reports latency and server resources as N grows.
+
+Each simulated session speaks Streamlit's websocket protocol like a browser tab: it loads
+the page (with its own `?seed=`), waits `--think-time`, picks the Monokuma view (the AI
+plays every character) and clicks Start Game, then watches the game until it is over or
+the level ends. The server runs with the offline LLM stand-in and a temporary game store,
+and keeps the app's normal pacing.
+
+For each level (`--levels`) it reports:
+  - load latency: page load request until the first run finishes
+  - click latency: Start Game click until the server's first response
+  - rerun latency: one run ending for an `st.rerun()` until the next run's first output
+  - server CPU, RSS and thread count (sampled every second), and bytes sent to sessions
+
+`--output` writes a report labelled with `--label` (default: `git describe`); `--compare`
+prints it next to an earlier report, so releases can be compared.
+
+    python -m benchmarks.streamlit_load --levels 1 5 10 25 --duration 120 --output load.json
+    python -m benchmarks.streamlit_load --levels 10 --compare load.json
+    python -m benchmarks.streamlit_load --url http://host:8501 --server-pid 1234   # an already running server
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from tornado.websocket import websocket_connect
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MONOKUMA_VIEW = 2 # Index of the Monokuma (AI plays, full info) option in the game mode radio
+FINISHED_EARLY_FOR_RERUN = ForwardMsg.ScriptFinishedStatus.FINISHED_EARLY_FOR_RERUN
+COMPARED = ["load_latency_p95_s", "click_latency_p95_s", "rerun_latency_p95_s", "server_cpu_mean_pct", "server_rss_max_mb", "server_threads_max"]
+
+class _SessionStats:
+    def __init__(self):
+        self.load_latency = None
+        self.click_latency = None
+        self.rerun_latencies = []
+        self.bytes_received = 0
+        self.game_over = False
+        self.error = None
+
+class _ServerSampler:
+    """Samples a process's CPU use, RSS and thread count from /proc."""
+    def __init__(self, pid):
+        self.pid = pid
+        self.samples = [] # (cpu %, rss bytes, threads)
+
+    def _read(self):
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu_seconds = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        with open(f"/proc/{self.pid}/status") as f:
+            status = dict(line.split(":", 1) for line in f if ":" in line)
+        return cpu_seconds, int(status["VmRSS"].split()[0]) * 1024, int(status["Threads"])
+
+    async def run(self, stop):
+        last_cpu, last_time = self._read()[0], time.perf_counter()
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), 1.0)
+            except asyncio.TimeoutError:
+                pass
+            cpu, rss, threads = self._read()
+            now = time.perf_counter()
+            self.samples.append((100 * (cpu - last_cpu) / (now - last_time), rss, threads))
+            last_cpu, last_time = cpu, now
+
+def _rerun_message(query_string, widgets=()):
+    message = BackMsg()
+    message.rerun_script.query_string = query_string
+    for widget_id, field, value in widgets:
+        state = message.rerun_script.widget_states.widgets.add()
+        state.id = widget_id
+        setattr(state, field, value)
+    return message.SerializeToString()
+
+async def _session(ws_url, seed, think_time, deadline, stats):
+    """One browser tab: load, start an AI game, watch it until it ends or the deadline."""
+    ws = await websocket_connect(ws_url, subprotocols=["streamlit"], max_message_size=1 << 30)
+    query_string, widget_ids, rerun_ended = f"seed={seed}", {}, None
+
+    async def receive():
+        """Returns the next ForwardMsg, or None at the deadline or when the server closes."""
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            return None
+        try:
+            raw = await asyncio.wait_for(ws.read_message(), remaining)
+        except asyncio.TimeoutError:
+            return None
+        if raw is None:
+            raise ConnectionError("Server closed the session")
+        stats.bytes_received += len(raw)
+        message = ForwardMsg()
+        message.ParseFromString(raw)
+        return message
+
+    try:
+        start = time.perf_counter()
+        ws.write_message(_rerun_message(query_string), binary=True)
+        while True:
+            message = await receive()
+            if message is None:
+                return
+            kind = message.WhichOneof("type")
+            if kind == "page_info_changed":
+                query_string = message.page_info_changed.query_string # Now includes ?game=
+            elif kind == "delta" and message.delta.WhichOneof("type") == "new_element":
+                element = message.delta.new_element
+                widget = getattr(element, element.WhichOneof("type"))
+                if hasattr(widget, "id") and widget.id:
+                    widget_ids[widget.id.rsplit("-", 1)[-1]] = widget.id # Keyed by the widget's key
+            elif kind == "script_finished":
+                stats.load_latency = time.perf_counter() - start
+                break
+
+        await asyncio.sleep(think_time)
+        click = _rerun_message(query_string, [(widget_ids["viewer_mode_selection"], "int_value", MONOKUMA_VIEW),
+                                              (widget_ids["start_game_button"], "trigger_value", True)])
+        start = time.perf_counter()
+        ws.write_message(click, binary=True)
+        while True:
+            message = await receive()
+            if message is None:
+                return
+            kind = message.WhichOneof("type")
+            if kind == "delta":
+                if stats.click_latency is None:
+                    stats.click_latency = time.perf_counter() - start
+                if rerun_ended is not None:
+                    stats.rerun_latencies.append(time.perf_counter() - rerun_ended)
+                    rerun_ended = None
+                element = message.delta.new_element if message.delta.WhichOneof("type") == "new_element" else None
+                if element is not None and element.WhichOneof("type") == "alert" and "GAME OVER" in element.alert.body:
+                    stats.game_over = True
+            elif kind == "script_finished":
+                if message.script_finished == FINISHED_EARLY_FOR_RERUN:
+                    rerun_ended = time.perf_counter()
+                elif stats.game_over:
+                    return
+    except Exception as e:
+        stats.error = repr(e)
+    finally:
+        ws.close()
+
+def _percentile(values, p):
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))], 3) if ordered else None
+
+async def run_level(ws_url, sessions, duration, ramp, think_time, seed, server_pid):
+    """Keeps `sessions` sessions (started over `ramp` seconds) open for `duration` seconds."""
+    stop = asyncio.Event()
+    sampler = _ServerSampler(server_pid) if server_pid else None
+    sampler_task = asyncio.ensure_future(sampler.run(stop)) if sampler else None
+    deadline = time.perf_counter() + ramp + duration
+    stats = [_SessionStats() for _ in range(sessions)]
+
+    async def start_session(i):
+        await asyncio.sleep(ramp * i / sessions)
+        await _session(ws_url, f"{seed}:{i}", think_time, deadline, stats[i])
+
+    started = time.perf_counter()
+    await asyncio.gather(*(start_session(i) for i in range(sessions)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    if sampler_task:
+        await sampler_task
+
+    loads = [s.load_latency for s in stats if s.load_latency is not None]
+    clicks = [s.click_latency for s in stats if s.click_latency is not None]
+    reruns = [latency for s in stats for latency in s.rerun_latencies]
+    samples = sampler.samples if sampler else []
+    return {
+        "sessions": sessions,
+        "errors": [s.error for s in stats if s.error][:5],
+        "games_over": sum(s.game_over for s in stats),
+        "load_latency_p50_s": _percentile(loads, 50),
+        "load_latency_p95_s": _percentile(loads, 95),
+        "click_latency_p50_s": _percentile(clicks, 50),
+        "click_latency_p95_s": _percentile(clicks, 95),
+        "reruns": len(reruns),
+        "rerun_latency_p50_s": _percentile(reruns, 50),
+        "rerun_latency_p95_s": _percentile(reruns, 95),
+        "rerun_latency_max_s": round(max(reruns), 3) if reruns else None,
+        "sent_mb_per_s": round(sum(s.bytes_received for s in stats) / 2**20 / elapsed, 2),
+        "server_cpu_mean_pct": round(statistics.mean(c for c, _, _ in samples), 1) if samples else None,
+        "server_cpu_max_pct": round(max(c for c, _, _ in samples), 1) if samples else None,
+        "server_rss_max_mb": round(max(r for _, r, _ in samples) / 2**20, 1) if samples else None,
+        "server_threads_max": max(t for _, _, t in samples) if samples else None,
+    }
+
+def _start_server(port):
+    """Starts the app the way the container does (custom_script.py), with the offline LLM."""
+    store_dir = tempfile.mkdtemp()
+    env = dict(os.environ, STREAMLIT_SERVER_PORT=str(port), STREAMLIT_SERVER_ADDRESS="127.0.0.1",
+               LLM_BACKEND="local", GAME_DB_DIR=store_dir, GAME_ARCHIVE_DIR=os.path.join(store_dir, "archive"),
+               LOG_DIR=os.path.join(store_dir, "logs"))
+    server = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, "custom_script.py")], env=env, cwd=REPO_DIR)
+    _wait_healthy(f"http://127.0.0.1:{port}", server)
+    return server
+
+def _wait_healthy(url, server=None, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if server is not None and server.poll() is not None:
+            raise RuntimeError(f"Server exited with status {server.returncode}")
+        try:
+            with urllib.request.urlopen(f"{url}/_stcore/health", timeout=2) as response:
+                if response.status == 200:
+                    return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"{url} did not become healthy within {timeout}s")
+
+def _release_label():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def compare(report, previous):
+    print(f"{'':>6} {'metric':<22} {previous['label']:>14} {report['label']:>14}")
+    for level, current in report["levels"].items():
+        before = previous["levels"].get(level)
+        if before is None:
+            continue
+        for metric in COMPARED:
+            old, new = before.get(metric), current.get(metric)
+            change = f"x{new / old:.2f}" if old and new is not None else ""
+            print(f"{level:>6} {metric:<22} {str(old):>14} {str(new):>14} {change}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 5, 10, 25], help="Simultaneous sessions")
+    parser.add_argument("--duration", type=float, default=120, help="Seconds each level runs after its ramp-up")
+    parser.add_argument("--ramp", type=float, default=10, help="Seconds over which a level's sessions arrive")
+    parser.add_argument("--think-time", type=float, default=2, help="Seconds between page load and Start Game")
+    parser.add_argument("--seed", default="load", help="Session i plays ?seed=<seed>:<i>")
+    parser.add_argument("--port", type=int, default=8599, help="Port for the server this benchmark starts")
+    parser.add_argument("--url", help="Test an already running server instead of starting one")
+    parser.add_argument("--server-pid", type=int, help="With --url: the server's pid, for CPU/memory/thread samples")
+    parser.add_argument("--label", default=None, help="Release label for the report (default: git describe)")
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    parser.add_argument("--compare", help="Print this report next to an earlier one")
+    args = parser.parse_args(argv)
+
+    server = None if args.url else _start_server(args.port)
+    url = args.url or f"http://127.0.0.1:{args.port}"
+    if args.url:
+        _wait_healthy(url)
+    ws_url = url.replace("http", "ws", 1).rstrip("/") + "/_stcore/stream"
+    server_pid = server.pid if server else args.server_pid
+    report = {"label": args.label or _release_label(), "python": platform.python_version(),
+              "duration_s": args.duration, "levels": {}}
+    try:
+        for level in args.levels:
+            summary = asyncio.run(run_level(ws_url, level, args.duration, args.ramp, args.think_time, args.seed, server_pid))
+            report["levels"][str(level)] = summary
+            print(f"{level:>4} {json.dumps(summary)}")
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+if __name__ == "__main__":
+    sys.exit(main())
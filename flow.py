@@ -1,12 +1,26 @@
+import asyncio
+import os
+import time
+from collections import namedtuple
 from pocketflow import AsyncFlow, AsyncParallelBatchFlow
-from nodes import DecisionNode
+from nodes import DecisionNode, PHASE_ACTIONS
+from utils.retry_policy import RetryPolicy
+from utils import metrics
+from utils.background import submit_async
+
+# Overall deadline (seconds) for a parallel voting phase. Voters still thinking when it
+# expires are recorded as abstaining so one slow call can't hold up the whole reveal.
+PHASE_DEADLINE = float(os.getenv("LLM_PHASE_DEADLINE", "120"))
+# Most LLM calls a voting batch runs at once (0 = everyone at once). Keeps big rosters
+# under the per-minute quota instead of bursting into 429s.
+MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "0"))
 
 # --- Sequential Flow ---
 def create_character_decision_flow() -> AsyncFlow:
     """Creates a reusable AsyncFlow containing a single Async DecisionNode.
     The character name must be set via flow parameters before running.
     """
-    decision_node = DecisionNode(max_retries=3, wait=1) # Configure retries/wait
+    decision_node = DecisionNode(retry_policy=RetryPolicy()) # Backoff with jitter, separate parse/transport budgets
     # The flow consists of only this single node
     return AsyncFlow(start=decision_node)
 
@@ -14,38 +28,364 @@ def create_character_decision_flow() -> AsyncFlow:
 class ParallelCharacterDecisionFlow(AsyncParallelBatchFlow):
     """
     An AsyncParallelBatchFlow that runs the DecisionNode concurrently for multiple characters.
+    If `phase_deadline` (seconds) expires, unfinished characters default to Abstain.
+    At most `max_concurrency` characters run at once (0/None = all). Results are reported as
+    each character finishes: through `on_result(params, status, done_count, total)` when
+    run as a flow, or by iterating `stream_async(shared)`. `status` is "done" (the character's
+    decision is logged) or "abstained" (missed the deadline; an Abstain is logged). A character
+    whose decision raised fails the batch, as with asyncio.gather.
     """
+    def __init__(self, start=None, phase_deadline=None, max_concurrency=None, on_result=None):
+        super().__init__(start=start)
+        self.phase_deadline = phase_deadline
+        self.max_concurrency = max_concurrency
+        self.on_result = on_result
+
     async def prep_async(self, shared: dict) -> list[dict]:
         """
         Determines which characters need to act in the current phase and returns
         a list of parameter dictionaries, one for each character.
         Expects 'acting_characters' list in the shared state.
         """
-        acting_characters = shared.get("acting_characters")
+        # Set as a flow param when the batch runs inside a PhaseDAG; otherwise read from shared
+        acting_characters = self.params.get("acting_characters") or shared.get("acting_characters")
         if not acting_characters:
             print("Warning: 'acting_characters' not found or empty in shared state for ParallelCharacterDecisionFlow prep.")
             return [] # Return empty list if no one is acting
 
+        # A game resumed mid-batch already has some decisions logged; don't log them twice
+        current_phase = self.params.get("phase") or shared.get("current_state", "UNKNOWN_STATE")
+        logged = await self._logged_actors(shared, current_phase)
+        if logged:
+            print(f"Skipping {sorted(logged & set(acting_characters))}: already decided in {current_phase}.")
         # Create a list of parameter dictionaries for the batch flow
-        params_list = [{"character_name": name} for name in acting_characters]
+        params_list = [{"character_name": name} for name in acting_characters if name not in logged]
         print(f"Parallel flow prepared for characters: {acting_characters}") # Debug print
         return params_list
 
     # No exec_async or post_async needed for the BatchFlow itself,
     # as it delegates execution to its start node (DecisionNode) for each param set.
 
-def create_parallel_decision_flow() -> AsyncParallelBatchFlow:
+    async def _run_async(self, shared):
+        """Same as AsyncParallelBatchFlow, but bounded by the phase deadline and max concurrency."""
+        params_list = await self.prep_async(shared) or []
+        done_count = 0
+        async for params, status in self._stream(shared, params_list):
+            done_count += 1
+            if self.on_result:
+                self.on_result(params, status, done_count, len(params_list))
+        return await self.post_async(shared, params_list, None)
+
+    async def stream_async(self, shared):
+        """Runs the batch, yielding (params, status) for each character as soon as it finishes;
+        by then DecisionNode has logged the character's action to the DB ("done"). Characters
+        that miss the deadline are yielded last, with "abstained", once their Abstain is logged."""
+        params_list = await self.prep_async(shared) or []
+        async for item in self._stream(shared, params_list):
+            yield item
+
+    async def _stream(self, shared, params_list):
+        semaphore = asyncio.Semaphore(self.max_concurrency) if self.max_concurrency else None
+
+        async def run_one(bp):
+            if semaphore is None:
+                await self._orch_async(shared, {**self.params, **bp})
+            else:
+                async with semaphore: # Queued characters wait here; they still count against the deadline
+                    await self._orch_async(shared, {**self.params, **bp})
+            return "done" # pocketflow's _orch_async returns post's None, so report the outcome instead
+
+        tasks = {asyncio.ensure_future(run_one(bp)): bp for bp in params_list}
+        pending = set(tasks)
+        deadline = time.monotonic() + self.phase_deadline if self.phase_deadline else None
+        try:
+            while pending:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break # Deadline passed
+                for task in done:
+                    yield tasks[task], task.result() # Propagates failures like asyncio.gather would
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+            late, pending = pending, set()
+            for task in late:
+                if task.cancelled():
+                    logged = await self._log_default_abstain(shared, tasks[task])
+                    yield tasks[task], "abstained" if logged else "done"
+                else: # Finished between the deadline and the cancel; report it like any other
+                    yield tasks[task], task.result() # Propagates failures like asyncio.gather would
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _log_default_abstain(self, shared, params):
+        """Record an Abstain for a character who missed the phase deadline. Returns False if
+        their own decision was logged after all (nothing is recorded then)."""
+        character_name = params["character_name"]
+        current_phase = params.get("phase") or shared.get("current_state", "UNKNOWN_STATE")
+        if await self._decision_logged(shared, character_name, current_phase):
+            return False # Its post committed even though the task was cancelled (the write was already running)
+        print(f"Warning: {character_name} missed the {current_phase} deadline ({self.phase_deadline}s). Defaulting to Abstain.")
+        metrics.increment("phase_deadline_abstains", phase=current_phase)
+        prep_res = {"character_name": character_name, "current_phase": current_phase}
+        exec_res = {"thinking": "(No decision before the deadline. Abstaining.)", "validated_target_name": None}
+        await self.start_node.post_async(shared, prep_res, exec_res)
+        return True
+
+    async def _decision_logged(self, shared, character_name, current_phase):
+        """True if the character's decision for this phase and day is already in the DB."""
+        return character_name in await self._logged_actors(shared, current_phase)
+
+    async def _logged_actors(self, shared, current_phase):
+        """Names of the characters whose decision for this phase and day is already in the DB."""
+        action_type = PHASE_ACTIONS.get(current_phase, (None,))[0]
+        if action_type is None or action_type == "statement": # Only one decision per day for the voting phases
+            return set()
+        db_writer = shared.get("db_writer")
+        if db_writer:
+            await asyncio.wrap_future(db_writer.submit([])) # Let a write that is already running commit first
+        read_pool = shared.get("db_read_pool")
+        cursor = (read_pool.get() if read_pool else shared["db_conn"]).cursor()
+        cursor.execute(
+            "SELECT DISTINCT actor_name FROM actions WHERE phase = ? AND action_type = ? AND day = ?",
+            (current_phase, action_type, shared.get("current_day", 0))
+        )
+        return {name for name, in cursor.fetchall()}
+
+def create_parallel_decision_flow(phase_deadline=PHASE_DEADLINE, max_concurrency=MAX_CONCURRENCY, on_result=None) -> AsyncParallelBatchFlow:
     """
     Creates and returns the parallel decision flow.
+    `phase_deadline` bounds the whole batch (seconds); None or 0 waits for every voter.
+    `max_concurrency` caps simultaneous LLM calls; `on_result` is called as each character finishes.
     """
     # Instantiate the node that will be run in parallel for each character
-    # Configure retries and wait time for the individual node runs
-    decision_node = DecisionNode(max_retries=3, wait=1)
+    # Retry policy for the individual node runs (jittered so parallel voters don't retry in lockstep)
+    decision_node = DecisionNode(retry_policy=RetryPolicy())
 
     # Create the parallel batch flow, starting with the decision node
-    parallel_flow = ParallelCharacterDecisionFlow(start=decision_node)
+    parallel_flow = ParallelCharacterDecisionFlow(
+        start=decision_node, phase_deadline=phase_deadline, max_concurrency=max_concurrency, on_result=on_result
+    )
     return parallel_flow
 
+# --- Background draft ---
+class DecisionDraft:
+    """
+    A DecisionNode run split in two so it can start before it is needed:
+    prep runs now (caller's thread, reads the DB), exec runs on the background event loop,
+    and post only runs (logging to the DB) when the draft is committed.
+    Used to pre-generate the user's character's decision while their input form is shown.
+    """
+    def __init__(self, shared, character_name, key=None):
+        self.key = key # Lets callers check the draft is still for the current turn
+        self.node = DecisionNode(retry_policy=RetryPolicy())
+        self.node.set_params({"character_name": character_name})
+        self.prep_res = asyncio.run(self.node.prep_async(shared))
+        self.future = submit_async(self.node._exec, self.prep_res)
+
+    def commit(self, shared, timeout=None):
+        """Logs the drafted decision. Returns False (nothing logged) if generation failed or timed out."""
+        try:
+            exec_res = self.future.result(timeout)
+        except Exception as e:
+            print(f"Warning: Draft for {self.prep_res['character_name']} unusable ({type(e).__name__}: {e}); generating a new decision.")
+            metrics.increment("decision_drafts", outcome="failed")
+            return False
+        asyncio.run(self.node.post_async(shared, self.prep_res, exec_res))
+        metrics.increment("decision_drafts", outcome="used")
+        return True
+
+    def discard(self):
+        """Drops the draft (the user gave their own input), cancelling its LLM call if it is still running."""
+        self.future.cancel()
+        metrics.increment("decision_drafts", outcome="discarded")
+
+class VoteBatchDraft:
+    """
+    Starts a voting phase's decisions before the phase itself (e.g. the class-trial vote while
+    the end of the discussion is still playing). Each voter is prepped now with the phase as a
+    param; all exec calls run together on one background event loop, bounded by the phase
+    deadline. Nothing is written to the DB until commit(), so the votes stay hidden until then.
+    """
+    def __init__(self, shared, character_names, phase, key=None, phase_deadline=PHASE_DEADLINE, max_concurrency=MAX_CONCURRENCY):
+        self.key = key
+        self.phase = phase
+        self.character_names = list(character_names)
+        self.phase_deadline = phase_deadline
+        self.max_concurrency = max_concurrency
+        self.done_count = 0 # Updated from the background thread as voters finish
+        self.nodes, self.prep_results = [], []
+        for name in self.character_names:
+            node = DecisionNode(retry_policy=RetryPolicy())
+            node.set_params({"character_name": name, "phase": phase})
+            self.nodes.append(node)
+            self.prep_results.append(asyncio.run(node.prep_async(shared)))
+        self.future = submit_async(self._exec_all)
+
+    async def _exec_all(self):
+        semaphore = asyncio.Semaphore(self.max_concurrency) if self.max_concurrency else None
+
+        async def exec_one(node, prep_res):
+            try:
+                if semaphore is None:
+                    return await node._exec(prep_res)
+                async with semaphore:
+                    return await node._exec(prep_res)
+            finally:
+                self.done_count += 1
+
+        tasks = [asyncio.ensure_future(exec_one(node, prep_res)) for node, prep_res in zip(self.nodes, self.prep_results)]
+        if not tasks:
+            return []
+        try:
+            done, pending = await asyncio.wait(tasks, timeout=self.phase_deadline or None)
+        except asyncio.CancelledError: # Discarded: stop every voter's call too
+            for task in tasks:
+                task.cancel()
+            raise
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        # Per voter: exec result, the exception it raised, or None if it missed the deadline
+        return [(task.exception() or task.result()) if task in done else None for task in tasks]
+
+    def commit(self, shared, on_progress=None):
+        """Logs every drafted vote (waiting for stragglers). Voters whose draft failed are re-run now.
+        While waiting, on_progress(done_count, total) is called as voters finish."""
+        if on_progress:
+            shown = None
+            while not self.future.done():
+                if self.done_count != shown:
+                    shown = self.done_count
+                    on_progress(shown, len(self.character_names))
+                time.sleep(0.2)
+            on_progress(len(self.character_names), len(self.character_names))
+        asyncio.run(self._commit_async(shared, self.future.result()))
+
+    def discard(self):
+        """Drops the draft (it no longer matches the vote), cancelling the voters' LLM calls still running."""
+        self.future.cancel()
+        metrics.increment("vote_batch_drafts", outcome="discarded")
+
+    async def _commit_async(self, shared, outcomes):
+        batch = create_parallel_decision_flow(phase_deadline=self.phase_deadline)
+        failed = []
+        for name, node, prep_res, outcome in zip(self.character_names, self.nodes, self.prep_results, outcomes):
+            if isinstance(outcome, Exception):
+                print(f"Warning: Early {self.phase} decision for {name} failed ({type(outcome).__name__}: {outcome}); retrying now.")
+                failed.append(name)
+            elif outcome is None:
+                await batch._log_default_abstain(shared, {"character_name": name, "phase": self.phase})
+            else:
+                await node.post_async(shared, prep_res, outcome)
+        metrics.increment("vote_batch_drafts", outcome="retried" if failed else "used")
+        if failed:
+            batch.set_params({"acting_characters": failed, "phase": self.phase})
+            await batch._run_async(shared)
+
+# --- Dependency-aware phase scheduler ---
+DAGStep = namedtuple("DAGStep", ["name", "flow", "reads", "writes"])
+
+class PhaseDAG(AsyncFlow):
+    """
+    Runs pocketflow flows/nodes as a DAG instead of a fixed sequence.
+    Steps are added in narrative order and declare what they read and write (free-form
+    resource names such as "roles" or "actions:NIGHT_PHASE_GUARDIAN"). A step depends on
+    every earlier step that writes something it reads or writes, or reads something it
+    writes, so steps with no such overlap run concurrently. Results are reported in
+    declaration order whatever order the steps finish in.
+    """
+    def __init__(self):
+        super().__init__()
+        self.steps = []
+
+    def add_step(self, name, flow, reads=(), writes=()):
+        """Adds a step after the existing ones (narrative order). Returns self for chaining."""
+        self.steps.append(DAGStep(name, flow, frozenset(reads), frozenset(writes)))
+        return self
+
+    def dependencies(self):
+        """Returns {step name: set of step names it must wait for}."""
+        deps = {}
+        for i, step in enumerate(self.steps):
+            deps[step.name] = {
+                earlier.name for earlier in self.steps[:i]
+                if earlier.writes & (step.reads | step.writes) or step.writes & earlier.reads
+            }
+        return deps
+
+    async def stream_async(self, shared):
+        """Runs the DAG, yielding (step name, result) in declaration order as results become available."""
+        deps = self.dependencies()
+        waiting = list(self.steps)
+        running = {} # task -> step
+        results = {}
+        emitted = 0
+        try:
+            while waiting or running:
+                for step in [s for s in waiting if deps[s.name] <= results.keys()]:
+                    waiting.remove(step)
+                    running[asyncio.ensure_future(self._run_step(shared, step))] = step
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    results[running.pop(task).name] = task.result()
+                # Hold back anything that finished ahead of an earlier step
+                while emitted < len(self.steps) and self.steps[emitted].name in results:
+                    yield self.steps[emitted].name, results[self.steps[emitted].name]
+                    emitted += 1
+        finally:
+            for task in running:
+                task.cancel()
+
+    async def _run_step(self, shared, step):
+        start = time.perf_counter()
+        result = await step.flow._run_async(shared)
+        metrics.observe("dag_step_seconds", time.perf_counter() - start, step=step.name)
+        return result
+
+    async def _run_async(self, shared):
+        prep_res = await self.prep_async(shared)
+        results = {name: result async for name, result in self.stream_async(shared)}
+        return await self.post_async(shared, prep_res, results)
+
+def create_night_actions_dag(blackened_voters, truth_seeker_name=None, guardian_name=None,
+                             phase_deadline=PHASE_DEADLINE) -> PhaseDAG:
+    """
+    Builds the night as a PhaseDAG. The Blackened vote, Truth-Seeker and Guardian decisions
+    run concurrently; each is a deadline-bounded decision batch with its phase as a param.
+
+    History and tonight's decisions are the same `actions` table, so the resources split it:
+    "actions:history" is everything logged before tonight and "actions:<phase>" is tonight's
+    rows for one phase. DecisionNode queries the whole table, but rows of another role's night
+    phase are hidden from it (role_phase_visibility) and each character has one role, so a
+    step only sees the history plus its own phase. Nothing writes the history or the roles
+    during the night: the kill is applied in MORNING_ANNOUNCEMENT.
+    """
+    def decision_batch(characters, phase):
+        batch = create_parallel_decision_flow(phase_deadline=phase_deadline)
+        batch.set_params({"acting_characters": characters, "phase": phase})
+        return batch
+
+    dag = PhaseDAG()
+    if blackened_voters:
+        dag.add_step("blackened_vote", decision_batch(blackened_voters, "NIGHT_PHASE_BLACKENED_VOTE"),
+                     reads={"roles", "actions:history", "actions:NIGHT_PHASE_BLACKENED_VOTE"},
+                     writes={"actions:NIGHT_PHASE_BLACKENED_VOTE"})
+    if truth_seeker_name:
+        dag.add_step("truth_seeker", decision_batch([truth_seeker_name], "NIGHT_PHASE_TRUTH_SEEKER"),
+                     reads={"roles", "actions:history", "actions:NIGHT_PHASE_TRUTH_SEEKER"},
+                     writes={"actions:NIGHT_PHASE_TRUTH_SEEKER"})
+    if guardian_name:
+        # Needs last night's protection, which is in the history (an earlier day)
+        dag.add_step("guardian", decision_batch([guardian_name], "NIGHT_PHASE_GUARDIAN"),
+                     reads={"roles", "actions:history", "actions:NIGHT_PHASE_GUARDIAN"},
+                     writes={"actions:NIGHT_PHASE_GUARDIAN"})
+    return dag
+
 # Example Conceptual Usage:
 # async def run_sequential_turn(shared_state, character_name):
 #     flow = create_sequential_decision_flow()
@@ -55,4 +395,4 @@ def create_parallel_decision_flow() -> AsyncParallelBatchFlow:
 # async def run_parallel_phase(shared_state, acting_characters_list):
 #     shared_state["acting_characters"] = acting_characters_list
 #     flow = create_parallel_decision_flow()
-#     await flow.run_async(shared_state)
\ No newline at end of file
+#     await flow.run_async(shared_state)
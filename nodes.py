@@ -1,9 +1,70 @@
+import asyncio
+import time
 from pocketflow import AsyncNode
-from utils.call_llm import call_llm_async
-import yaml
+from utils.call_llm import call_llm_async, stream_llm_async
+from utils.yaml_stream import YamlFieldStreamer
+from utils.repair_output import UnrepairableOutputError, load_output, repair_emotion, repair_vote_index
+from utils.retry_policy import RetryPolicy
+from utils.model_routing import resolve_route
+from utils.game_content import CONTENT, hint_text_for
+from utils import metrics, profiling
+
+# Phase -> (action type DecisionNode.post_async logs, whether the statement carries an emotion)
+PHASE_ACTIONS = {
+    'NIGHT_PHASE_BLACKENED_DISCUSSION': ('statement', False), # Action type 'statement', emotion not required
+    'CLASS_TRIAL_DISCUSSION': ('statement', True),      # Action type 'statement', emotion required
+    'NIGHT_PHASE_BLACKENED_USER_INPUT': ('statement', False), # Action type 'statement', emotion not required
+    'CLASS_TRIAL_USER_INPUT': ('statement', True), # Action type 'statement', emotion required (like trial discussion)
+    'NIGHT_PHASE_BLACKENED_VOTE': ('blackened_decision', False),
+    'NIGHT_PHASE_TRUTH_SEEKER': ('truth_seeker_decision', False),
+    'NIGHT_PHASE_GUARDIAN': ('guardian_decision', False),
+    'CLASS_TRIAL_VOTE': ('vote', False),
+}
+
+# (phase, phases selected for profiling, tag) of a DecisionNode call, for utils/profiling.py
+def _profile_prep(node, shared):
+    return node.params.get("phase") or shared.get("current_state"), shared.get("profile_phases"), node.params.get("character_name")
+
+def _profile_exec(node, context):
+    return context["current_phase"], context.get("profile_phases"), context["character_name"]
+
+def _profile_post(node, shared, context, exec_res):
+    return context["current_phase"], shared.get("profile_phases"), context["character_name"]
 
 class DecisionNode(AsyncNode):
     """Generates a character's action (statement or vote) based on the current game phase."""
+    def __init__(self, *, retry_policy=None, max_retries=1, wait=0):
+        super().__init__(max_retries=max_retries, wait=wait)
+        # Retries are driven by the policy (per error class), not pocketflow's fixed max_retries/wait
+        self.retry_policy = retry_policy or RetryPolicy()
+
+    @profiling.profiled("decision_exec", _profile_exec)
+    async def _exec(self, prep_res):
+        """Run exec_async, retrying according to self.retry_policy.
+        Parse failures and transport failures draw from separate budgets.
+        """
+        current_phase = prep_res.get("current_phase", "UNKNOWN_STATE")
+        attempts = {'parse': 0, 'transport': 0}
+        start = time.perf_counter()
+        while True:
+            try:
+                result = await self.exec_async(prep_res)
+                metrics.observe("decision_seconds", time.perf_counter() - start, phase=current_phase) # Including retries
+                return result
+            except Exception as e:
+                kind = self.retry_policy.classify(e)
+                if attempts.get(kind, 0) >= self.retry_policy.budget(kind):
+                    metrics.increment("decision_retries_exhausted", phase=current_phase, kind=kind)
+                    return await self.exec_fallback_async(prep_res, e)
+                delay = self.retry_policy.next_delay(kind, attempts[kind], e)
+                attempts[kind] += 1
+                metrics.increment("decision_retries", phase=current_phase, kind=kind)
+                metrics.increment("decision_retry_wait_seconds", delay, phase=current_phase, kind=kind)
+                print(f"Warning: Retrying {prep_res.get('character_name')} in {current_phase} after {kind} error ({type(e).__name__}); waiting {delay:.1f}s")
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+    @profiling.profiled("decision_prep", _profile_prep)
     async def prep_async(self, shared):
         """Gather context for the LLM prompt, including role, history, and valid targets.
            History filtering is ALWAYS done from the perspective of the acting character.
@@ -13,20 +74,21 @@ class DecisionNode(AsyncNode):
             raise ValueError("DecisionNode requires 'character_name' in params")
 
         current_day = shared.get("current_day", 0)
-        current_phase = shared.get("current_state", "UNKNOWN_STATE")
+        # A 'phase' param lets a decision run ahead of the game state (e.g. night actions run together)
+        current_phase = self.params.get("phase") or shared.get("current_state", "UNKNOWN_STATE")
         db_conn = shared.get("db_conn")
-        game_introduction_text = shared.get("game_introduction_text", "(Game Introduction Missing)")
-        character_profiles = shared.get("character_profiles", {})
-        hint_text = shared.get("hint_text", "(Hint text missing)")
         speaking_order = shared.get("shuffled_character_order", []) # Used for display only
         user_character_name = shared.get("user_character_name") # Get user character name
+        # Static content comes from the process-wide registry, not session state
+        game_introduction_text = CONTENT.game_introduction_text
+        hint_text = hint_text_for(user_character_name)
         user_input_for_prompt = None # Initialize
 
         # Check if it's the user's turn and fetch input if available
         if character_name == user_character_name:
             user_input_for_prompt = shared.get("user_input") # Fetch from shared state
 
-        character_profile = character_profiles.get(character_name, {})
+        character_profile = CONTENT.character_profiles.get(character_name, {})
         my_role = "Unknown"
         living_players_tuples = [] # List of (id, name, role)
         all_living_player_names = [] # List of names of all living players
@@ -40,8 +102,10 @@ class DecisionNode(AsyncNode):
             # Decide if we should raise an error or return minimal context
             raise ConnectionError("Database connection is missing, cannot proceed.")
 
-        # Use synchronous DB operations directly
-        cursor = db_conn.cursor()
+        # Concurrent decisions read through their own per-thread connection when a read pool is set up
+        read_pool = shared.get("db_read_pool")
+        cursor = (read_pool.get() if read_pool else db_conn).cursor()
+        query_start = time.perf_counter()
 
         # Get my role
         cursor.execute("SELECT role FROM roles WHERE name = ? AND is_alive = 1", (character_name,))
@@ -104,6 +168,7 @@ class DecisionNode(AsyncNode):
                ORDER BY id ASC""" # Fetch all actions, filter/format in Python
         )
         all_actions = cursor.fetchall()
+        metrics.observe("db_query_seconds", time.perf_counter() - query_start, op="decision_context")
 
         formatted_history = []
         voting_phase_types = ['blackened_decision', 'vote'] # Action types for voting phases
@@ -169,6 +234,7 @@ class DecisionNode(AsyncNode):
             "blackened_teammates": blackened_teammates,
             "last_guardian_target": last_guardian_target, # For context/logging if needed
             "user_input": user_input_for_prompt, # Add user input to context
+            "profile_phases": shared.get("profile_phases"), # Phases to profile (utils/profiling.py), for exec
         }
         return context
 
@@ -264,8 +330,23 @@ class DecisionNode(AsyncNode):
                 # Show all examples for trial discussion phases
                 example_str = "\n".join([f"- {k}: {v}" for k, v in examples.items()])
 
+        # --- Model routing: cheap phases can use a smaller/faster model (see model_routing.yaml) ---
+        route = resolve_route(current_phase, character=character_name, role=my_role)
+        generation_config = {"max_output_tokens": route["max_output_tokens"], "temperature": route["temperature"]}
+        reasoning_mode = route["reasoning"] # full | short | none (vote only)
+        metrics.increment("llm_routed_calls", phase=current_phase, model=route["model"] or "default")
+
         # --- Define YAML instruction parts ---
-        yaml_thinking_instruction = f"""
+        if reasoning_mode == "short":
+            # Short reasoning: the decision still comes with a reason, just fewer tokens to generate
+            yaml_thinking_instruction = """
+# One short sentence (max 20 words): who you chose and the main reason. Be conclusive.
+thinking: <short reason>
+"""
+        elif reasoning_mode == "none":
+            yaml_thinking_instruction = ""
+        else:
+            yaml_thinking_instruction = f"""
 # DON'T follow the speaking style examples for thinking. But simple and clear about your thoughts.
 # For the decision, be conclusive! DON'T: I decide to think harder ... read the history carefully.
 thinking: >
@@ -287,13 +368,22 @@ vote_target_index: <Index Number>
 """
 
         # --- Build the final YAML output instructions string ---
-        yaml_output_instructions_parts = [yaml_thinking_instruction]
-        if is_talking_phase:
-            yaml_output_instructions_parts.append(yaml_talking_instruction)
-        if requires_emotion:
-            yaml_output_instructions_parts.append(yaml_emotion_instruction)
-        if is_voting_phase:
-            yaml_output_instructions_parts.append(yaml_vote_instruction)
+        # Callers that render the statement live pass 'stream_callback' (receives the 'talking' text so far)
+        stream_callback = self.params.get("stream_callback") if is_talking_phase else None
+        if stream_callback:
+            # Streaming: ask for 'talking' first so the chat bubble fills from the first tokens
+            yaml_output_instructions_parts = [yaml_talking_instruction]
+            if requires_emotion:
+                yaml_output_instructions_parts.append(yaml_emotion_instruction)
+            yaml_output_instructions_parts.append(yaml_thinking_instruction)
+        else:
+            yaml_output_instructions_parts = [yaml_thinking_instruction]
+            if is_talking_phase:
+                yaml_output_instructions_parts.append(yaml_talking_instruction)
+            if requires_emotion:
+                yaml_output_instructions_parts.append(yaml_emotion_instruction)
+            if is_voting_phase:
+                yaml_output_instructions_parts.append(yaml_vote_instruction)
 
         # Ensure we have instructions for the phase
         if not is_talking_phase and not is_voting_phase:
@@ -349,74 +439,117 @@ Now, generate your response as {character_name}:
 """
 
         # --- LLM Call (use await and the async function) ---
-        llm_response_raw = await call_llm_async(prompt)
+        metrics.adjust_gauge("llm_calls_in_flight", 1)
+        llm_start = time.perf_counter()
+        try:
+            if stream_callback:
+                llm_response_raw = await self._stream_llm(prompt, stream_callback, route["model"], generation_config)
+            else:
+                # load_output lets a hedged duplicate win if the first reply is unparseable
+                llm_response_raw = await call_llm_async(
+                    prompt, validate=load_output, model=route["model"], generation_config=generation_config
+                )
+        finally:
+            metrics.adjust_gauge("llm_calls_in_flight", -1)
+            metrics.observe("llm_call_seconds", time.perf_counter() - llm_start, phase=current_phase)
+
+        try:
+            parsed_output = self._parse_and_repair(
+                llm_response_raw, context, is_talking_phase, is_voting_phase, requires_emotion,
+                require_thinking=reasoning_mode != "none"
+            )
+        except (ValueError, KeyError, TypeError) as e:
+            # Only outputs we cannot fix locally go back to the LLM (_exec retries via RetryPolicy, from its parse budget)
+            metrics.increment("decision_output_retries", phase=current_phase)
+            if isinstance(e, UnrepairableOutputError):
+                raise
+            # RetryPolicy treats a bare ValueError/KeyError as fatal; here it came from an odd reply, so retry it as one
+            raise UnrepairableOutputError(f"Could not validate LLM output for phase {current_phase}: {e!r}. Raw: {llm_response_raw}") from e
 
-        if "```yaml" in llm_response_raw:
-            yaml_content = llm_response_raw.split("```yaml")[1].split("```")[0].strip()
-        else:
-            # If fences are missing, maybe log a warning but try parsing anyway
-            print(f"Warning: LLM output for {character_name} in {current_phase} missing YAML fences. Attempting direct parse.")
-            yaml_content = llm_response_raw.strip()
+        if is_voting_phase:
+            vote_index_one_based = parsed_output['vote_target_index']
+
+            # Get the actual name from the validated index or set to None for Abstain
+            if vote_index_one_based == 0:
+                validated_target_name = None # Represent Abstain as None
+            else:
+                validated_target_name = valid_target_names[vote_index_one_based - 1] # Convert 1-based index to 0-based for list access
+
+            # Store both validated index and name for post-processing
+            parsed_output['validated_target_name'] = validated_target_name
+            # Keep 'vote_target_index' as the validated integer
+            parsed_output['vote_target_index'] = vote_index_one_based
+
+        return parsed_output # Contains validated keys based on phase
 
-        # Let YAML parsing errors propagate naturally
-        parsed_output = yaml.safe_load(yaml_content)
+    async def _stream_llm(self, prompt, stream_callback, model=None, generation_config=None):
+        """Stream the LLM response, pushing the 'talking' field to stream_callback as it grows.
+        Returns the full raw response for normal parsing."""
+        streamer = YamlFieldStreamer("talking")
+        chunks = []
+        shown_text = ""
+        stream_callback(shown_text) # Reset the bubble; a retry starts streaming from scratch
+        async for chunk in stream_llm_async(prompt, model=model, generation_config=generation_config):
+            chunks.append(chunk)
+            talking_so_far = streamer.feed(chunk)
+            if talking_so_far != shown_text:
+                shown_text = talking_so_far
+                stream_callback(shown_text)
+        return "".join(chunks)
+
+    def _parse_and_repair(self, llm_response_raw, context, is_talking_phase, is_voting_phase, requires_emotion, require_thinking=True):
+        """Parse the raw LLM output and fix recoverable mistakes deterministically.
+        Raises UnrepairableOutputError only when the intent cannot be recovered.
+        With require_thinking=False (vote-only mode) 'thinking' is set to None and not logged.
+        """
+        character_name = context["character_name"]
+        current_phase = context["current_phase"]
+        valid_target_names = context.get("valid_target_names", [])
 
-        if not isinstance(parsed_output, dict):
-            # This check is still useful after safe_load
-            raise ValueError(f"LLM output did not parse into a dictionary. Raw: {llm_response_raw}")
+        parsed_output, repairs = load_output(llm_response_raw)
 
-        # --- Validation ---
-        # Always require 'thinking'
-        if 'thinking' not in parsed_output or not isinstance(parsed_output['thinking'], str):
-            raise ValueError(f"LLM output missing or invalid 'thinking'. Parsed: {parsed_output}. Raw: {llm_response_raw}")
+        # --- Validation (with repair) ---
+        # 'thinking' is only logged, so a missing one is not worth a full re-prompt
+        if not require_thinking:
+            parsed_output['thinking'] = None
+        elif not isinstance(parsed_output.get('thinking'), str):
+            parsed_output['thinking'] = str(parsed_output['thinking']) if parsed_output.get('thinking') else "No thinking process recorded."
+            repairs.append("thinking")
 
         if is_talking_phase:
             # Require 'talking'
-            if 'talking' not in parsed_output or not isinstance(parsed_output['talking'], str):
-                 raise ValueError(f"LLM output missing or invalid 'talking' for phase {current_phase}. Parsed: {parsed_output}. Raw: {llm_response_raw}")
+            talking = parsed_output.get('talking')
+            if not talking:
+                raise UnrepairableOutputError(f"LLM output missing or invalid 'talking' for phase {current_phase}. Parsed: {parsed_output}. Raw: {llm_response_raw}")
+            if not isinstance(talking, str):
+                parsed_output['talking'] = str(talking)
+                repairs.append("talking")
 
         if requires_emotion:
-             # Require 'emotion' only if in an emotion phase
-            if 'emotion' not in parsed_output or not isinstance(parsed_output['emotion'], str):
-                 raise ValueError(f"LLM output missing or invalid 'emotion' for phase {current_phase}. Parsed: {parsed_output}. Raw: {llm_response_raw}")
-            valid_emotions = ['normal', 'determined', 'think', 'worried']
-            if parsed_output['emotion'] not in valid_emotions:
-                 raise ValueError(f"Invalid emotion: '{parsed_output['emotion']}'. Must be one of {valid_emotions} for phase {current_phase}. Parsed: {parsed_output}. Raw: {llm_response_raw}")
-        elif is_talking_phase and not requires_emotion and 'emotion' in parsed_output:
+            emotion, repaired = repair_emotion(parsed_output.get('emotion'))
+            if repaired:
+                parsed_output['emotion'] = emotion
+                repairs.append("emotion")
+        elif is_talking_phase and 'emotion' in parsed_output:
             # Emotion provided when not required (e.g., Blackened Discussion) - Log/ignore
             print(f"Warning: Emotion field provided by LLM for {character_name} in phase {current_phase} when not required. It will be ignored. Parsed: {parsed_output}")
-            # del parsed_output['emotion'] # Optionally remove
 
         if is_voting_phase:
-            # Require 'vote_target_index' (as str initially), convert to int, validate
             if 'vote_target_index' not in parsed_output:
-                 raise ValueError(f"LLM output missing required key 'vote_target_index' for phase {current_phase}. Parsed: {parsed_output}. Raw: {llm_response_raw}")
-
-            raw_index_str = str(parsed_output['vote_target_index']) # Ensure it's a string first
-
-            try:
-                vote_index_one_based = int(raw_index_str)
-            except ValueError:
-                 raise ValueError(f"LLM output 'vote_target_index' ('{raw_index_str}') is not a valid integer. Parsed: {parsed_output}. Raw: {llm_response_raw}")
-
-            num_valid_targets = len(valid_target_names)
-            # Allow 0 for Abstain
-            if not (0 <= vote_index_one_based <= num_valid_targets):
-                 raise ValueError(f"Invalid vote_target_index: {vote_index_one_based}. Must be between 0 (Abstain) and {num_valid_targets}. Targets: {valid_target_names}. Parsed: {parsed_output}. Raw: {llm_response_raw}")
-
-            # Get the actual name from the validated index or set to None for Abstain
-            if vote_index_one_based == 0:
-                validated_target_name = None # Represent Abstain as None
-            else:
-                validated_target_name = valid_target_names[vote_index_one_based - 1] # Convert 1-based index to 0-based for list access
-
-            # Store both validated index and name for post-processing
-            parsed_output['validated_target_name'] = validated_target_name
+                raise UnrepairableOutputError(f"LLM output missing required key 'vote_target_index' for phase {current_phase}. Parsed: {parsed_output}. Raw: {llm_response_raw}")
+            vote_index, repaired = repair_vote_index(parsed_output['vote_target_index'], valid_target_names)
+            if repaired:
+                repairs.append("vote_target_index")
             # Keep 'vote_target_index' as the validated integer
-            parsed_output['vote_target_index'] = vote_index_one_based
+            parsed_output['vote_target_index'] = vote_index
 
-        return parsed_output # Contains validated keys based on phase
+        for kind in repairs:
+            metrics.increment("decision_output_repairs", phase=current_phase, kind=kind)
+        if repairs:
+            print(f"Warning: Repaired LLM output for {character_name} in {current_phase}: {', '.join(repairs)}")
+        return parsed_output
 
+    @profiling.profiled("decision_post", _profile_post)
     async def post_async(self, shared, prep_res, exec_res):
         """Log thinking and the appropriate action (statement or vote/decision) to the database."""
         db_conn = shared.get("db_conn")
@@ -430,8 +563,10 @@ Now, generate your response as {character_name}:
         current_phase = prep_res["current_phase"] # Use phase determined in prep
         thinking = exec_res.get("thinking", "No thinking process recorded.")
 
-        # Use synchronous DB operations directly
-        cursor = db_conn.cursor()
+        # Rows are collected and written together at the end, in one transaction
+        insert_sql = """INSERT INTO actions (day, phase, actor_name, action_type, content, target_name, emotion)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)"""
+        log_rows = []
 
         # --- Map User Input Phases to Main Phases for Logging ---
         logging_phase_map = {
@@ -445,34 +580,17 @@ Now, generate your response as {character_name}:
         logging_phase = logging_phase_map.get(current_phase, current_phase) # Use mapped phase or original if not a user input phase
         # --- End Mapping ---
 
-        # Log the thinking process first, using the mapped phase name
-        cursor.execute(
-            """INSERT INTO actions (day, phase, actor_name, action_type, content, target_name, emotion)
-               VALUES (?, ?, ?, ?, ?, ?, ?)""",
-            (current_day, logging_phase, character_name, 'thinking', thinking, None, None) # Use logging_phase
-        )
-        # Commit after each logical operation or group
-        db_conn.commit()
+        # Log the thinking process first, using the mapped phase name (skipped in vote-only mode)
+        if thinking is not None:
+            log_rows.append((current_day, logging_phase, character_name, 'thinking', thinking, None, None)) # Use logging_phase
         
         # Determine and log the primary action based on phase
         action_type = None
         content = None
         target_name = None
 
-        # Define phase-to-action mapping
-        phase_actions = {
-            'NIGHT_PHASE_BLACKENED_DISCUSSION': ('statement', False), # Action type 'statement', emotion not required
-            'CLASS_TRIAL_DISCUSSION': ('statement', True),      # Action type 'statement', emotion required
-            'NIGHT_PHASE_BLACKENED_USER_INPUT': ('statement', False), # Action type 'statement', emotion not required
-            'CLASS_TRIAL_USER_INPUT': ('statement', True), # Action type 'statement', emotion required (like trial discussion)
-            'NIGHT_PHASE_BLACKENED_VOTE': ('blackened_decision', False),
-            'NIGHT_PHASE_TRUTH_SEEKER': ('truth_seeker_decision', False),
-            'NIGHT_PHASE_GUARDIAN': ('guardian_decision', False),
-            'CLASS_TRIAL_VOTE': ('vote', False),
-        }
-
-        if current_phase in phase_actions:
-            action_type, requires_emotion = phase_actions[current_phase]
+        if current_phase in PHASE_ACTIONS:
+            action_type, requires_emotion = PHASE_ACTIONS[current_phase]
 
             if action_type == 'statement': # Check if it's a statement-logging phase
                 content = exec_res.get("talking", "No statement recorded.")
@@ -482,12 +600,7 @@ Now, generate your response as {character_name}:
                     emotion_to_log = exec_res.get("emotion", "") # Emotion was validated in exec for these phases
 
                 # Log statement (emotion will be None if not required/provided)
-                cursor.execute(
-                    """INSERT INTO actions (day, phase, actor_name, action_type, content, target_name, emotion)
-                        VALUES (?, ?, ?, ?, ?, ?, ?)""",
-                    (current_day, logging_phase, character_name, action_type, content, None, emotion_to_log) # Use logging_phase
-                )
-                db_conn.commit()
+                log_rows.append((current_day, logging_phase, character_name, action_type, content, None, emotion_to_log)) # Use logging_phase
             else: # Voting/Decision phase (action_type is not 'statement')
                 # validated_target_name will be None if the vote was to Abstain (index 0)
                 target_name = exec_res.get("validated_target_name") # Use the name derived from the validated index, or None
@@ -499,12 +612,16 @@ Now, generate your response as {character_name}:
                     raise ValueError("Validated target name key missing after voting phase execution.")
 
                 # Log vote/decision (target_name will be None if abstain)
-                cursor.execute(
-                    """INSERT INTO actions (day, phase, actor_name, action_type, content, target_name, emotion)
-                        VALUES (?, ?, ?, ?, ?, ?, ?)""",
-                    (current_day, logging_phase, character_name, action_type, None, target_name, None) # Use logging_phase
-                )
-                db_conn.commit()
+                log_rows.append((current_day, logging_phase, character_name, action_type, None, target_name, None)) # Use logging_phase
         else:
             # Should not happen if exec validation is correct
-            print(f"Warning: Unknown phase '{current_phase}' encountered in DecisionNode post for {character_name}. No primary action logged.")
\ No newline at end of file
+            print(f"Warning: Unknown phase '{current_phase}' encountered in DecisionNode post for {character_name}. No primary action logged.")
+        # Concurrent decisions share one serialized writer when available; otherwise write on the shared connection
+        db_writer = shared.get("db_writer")
+        write_start = time.perf_counter()
+        if db_writer:
+            await db_writer.write_async([(insert_sql, row) for row in log_rows])
+        else:
+            db_conn.executemany(insert_sql, log_rows)
+            db_conn.commit()
+        metrics.observe("db_query_seconds", time.perf_counter() - write_start, op="decision_log")
@@ -0,0 +1,33 @@
+import asyncio
+import threading
+
+# Process-wide event loop for work that should keep going while Streamlit waits on the user
+# (e.g. drafting the user's character's decision while their input form is shown). Drafts are
+# LLM calls that mostly wait on the network, so one loop thread runs every session's drafts
+# concurrently; nothing queues behind a fixed number of workers. How many calls run at once is
+# left to the callers' LLM concurrency limits (e.g. LLM_MAX_CONCURRENCY per voting batch).
+_loop = None
+_loop_lock = threading.Lock()
+
+def _background_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="background-loop", daemon=True).start()
+            _loop = loop
+        return _loop
+
+def submit_async(coro_fn, *args):
+    """Runs coro_fn(*args) on the shared background event loop.
+    Returns a concurrent.futures.Future with the coroutine's result; cancelling it cancels the coroutine."""
+    return asyncio.run_coroutine_threadsafe(coro_fn(*args), _background_loop())
+
+if __name__ == "__main__":
+    import time
+    async def slow_double(x):
+        await asyncio.sleep(0.1)
+        return x * 2
+    start = time.perf_counter()
+    futures = [submit_async(slow_double, i) for i in range(50)]
+    print([f.result() for f in futures][-1], f"{time.perf_counter() - start:.2f}s") # All 50 overlap
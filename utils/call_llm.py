@@ -5,6 +5,11 @@ import logging
 import json
 from datetime import datetime
 import asyncio
+import time
+import threading
+from collections import defaultdict, deque
+from utils import metrics, transcript
+from utils.local_llm import generate_local_response
 
 # Configure logging
 log_directory = os.getenv("LOG_DIR", "logs")
@@ -19,12 +24,134 @@ file_handler = logging.FileHandler(log_file)
 file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
 logger.addHandler(file_handler)
 
-# Simple cache configuration
-# By default, we Google Gemini 2.5 flash, as it shows great performance for code understanding
-async def call_llm_async(prompt):
-    # Log the prompt
-    logger.info(f"PROMPT: {prompt}")
-    
+# Per-call deadline (seconds). A timed-out call raises asyncio.TimeoutError, which the
+# DecisionNode retry policy treats as a transport error.
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+# Hedged requests: once a call has been running longer than the recent p95 latency,
+# send a duplicate and take whichever valid response arrives first.
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1"
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+
+# Recent successful call latencies per route (model, max_output_tokens), used to pick the
+# hedge delay. A vote-only call and a full statement take very different times, so each is
+# hedged against its own p95. Streaming calls are never hedged and aren't sampled.
+_latencies = defaultdict(lambda: deque(maxlen=200))
+
+def _latency_key(model=None, generation_config=None):
+    return (model or _get_model(), (generation_config or {}).get("max_output_tokens"))
+
+def latency_percentile(p, model=None, generation_config=None):
+    """Returns the p-th percentile (0-100) of recent call latencies for this route, or None if there are too few samples."""
+    samples = _latencies.get(_latency_key(model, generation_config), ())
+    if len(samples) < LLM_HEDGE_MIN_SAMPLES:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+# Degraded mode: while the circuit breaker is open, calls go to a fallback instead of the
+# primary model. LLM_FALLBACK=model uses GEMINI_FALLBACK_MODEL; LLM_FALLBACK=local uses the
+# offline stand-in in utils/local_llm.py so games keep moving even if Gemini is fully down.
+LLM_FALLBACK = os.getenv("LLM_FALLBACK", "model")
+FALLBACK_MODEL = os.getenv("GEMINI_FALLBACK_MODEL", "gemini-2.0-flash-lite")
+# LLM_BACKEND=local sends every call to the offline stand-in (no network, no API key needed);
+# LLM_BACKEND=replay serves responses recorded with LLM_RECORD (see utils/transcript.py)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+
+class CircuitBreaker:
+    """Trips when the primary model's recent error rate or slow-call rate gets too high.
+
+    closed    -> every call uses the primary model.
+    open      -> calls go to the fallback until `cooldown` seconds have passed.
+    half_open -> one probe call goes to the primary; success closes, failure re-opens.
+    The state is published as the `llm_breaker_state` gauge (0 closed, 1 half-open, 2 open).
+    """
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+    def __init__(self, window=20, min_calls=5, error_rate=0.5, slow_seconds=30.0, slow_rate=0.5, cooldown=30.0):
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_seconds = slow_seconds
+        self.slow_rate = slow_rate
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self._outcomes = deque(maxlen=window) # (failed, slow) per primary call
+        self._opened_at = 0.0
+        self._probe_started_at = None
+        self._lock = threading.Lock() # Shared by every session's event loop thread
+        self._publish()
+
+    def allow_request(self):
+        """True if this call should go to the primary model."""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == self.OPEN and now - self._opened_at >= self.cooldown:
+                self._set_state(self.HALF_OPEN)
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN:
+                # A single probe at a time; a probe that never reported back is retried after the cooldown
+                if self._probe_started_at is None or now - self._probe_started_at >= self.cooldown:
+                    self._probe_started_at = now
+                    return True
+            return False
+
+    def record_success(self, latency):
+        self._record(failed=False, slow=latency >= self.slow_seconds)
+
+    def record_failure(self):
+        self._record(failed=True, slow=False)
+
+    def record_abandoned(self, elapsed):
+        """A primary call was cancelled (deadline or lost hedge). Counts only if it was already slow."""
+        if elapsed >= self.slow_seconds:
+            self._record(failed=False, slow=True)
+        else:
+            with self._lock:
+                self._probe_started_at = None
+
+    def _record(self, failed, slow):
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probe_started_at = None
+                if failed or slow:
+                    self._trip()
+                else:
+                    self._outcomes.clear()
+                    self._set_state(self.CLOSED)
+                return
+            if self.state == self.OPEN:
+                return # Stragglers from before the trip
+            self._outcomes.append((failed, slow))
+            if len(self._outcomes) >= self.min_calls:
+                failures = sum(1 for f, _ in self._outcomes if f) / len(self._outcomes)
+                slow_calls = sum(1 for _, s in self._outcomes if s) / len(self._outcomes)
+                if failures >= self.error_rate or slow_calls >= self.slow_rate:
+                    self._trip()
+
+    def _trip(self):
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        metrics.increment("llm_breaker_trips")
+        logger.info(f"CIRCUIT BREAKER OPEN: routing calls to fallback ({LLM_FALLBACK}) for {self.cooldown}s")
+        self._set_state(self.OPEN)
+
+    def _set_state(self, state):
+        self.state = state
+        self._publish()
+
+    def _publish(self):
+        metrics.set_gauge("llm_breaker_state", {self.CLOSED: 0, self.HALF_OPEN: 1, self.OPEN: 2}[self.state])
+
+breaker = CircuitBreaker(
+    window=int(os.getenv("LLM_BREAKER_WINDOW", "20")),
+    min_calls=int(os.getenv("LLM_BREAKER_MIN_CALLS", "5")),
+    error_rate=float(os.getenv("LLM_BREAKER_ERROR_RATE", "0.5")),
+    slow_seconds=float(os.getenv("LLM_BREAKER_SLOW_SECONDS", "30")),
+    slow_rate=float(os.getenv("LLM_BREAKER_SLOW_RATE", "0.5")),
+    cooldown=float(os.getenv("LLM_BREAKER_COOLDOWN", "30")),
+)
+
+def _get_client():
     # Call the LLM
     # client = genai.Client(
     #     vertexai=True, 
@@ -33,26 +160,217 @@ async def call_llm_async(prompt):
     #     location=os.getenv("GEMINI_LOCATION", "us-central1")
     # )
     # You can comment the previous line and use the AI Studio key instead:
-    client = genai.Client(
+    return genai.Client(
         api_key=os.getenv("GEMINI_API_KEY"),
     )
 
+def _get_model():
     # Using gemini-2.0 because of reduced quota - could swap to  gemini-2.0-flash-lite
-    model = os.getenv("GEMINI_MODEL", "gemini-2.0-flash") # gemini-2.5-flash-preview-04-17
-    # model = os.getenv("GEMINI_MODEL", "gemini-2.5-pro-preview-03-25")
+    return os.getenv("GEMINI_MODEL", "gemini-2.0-flash") # gemini-2.5-flash-preview-04-17
+    # return os.getenv("GEMINI_MODEL", "gemini-2.5-pro-preview-03-25")
+
+def _build_config(generation_config):
+    """Turns a routing dict like {'max_output_tokens': 512, 'temperature': None} into a
+    GenerateContentConfig, dropping unset fields. Returns None when nothing is set."""
+    settings = {k: v for k, v in (generation_config or {}).items() if v is not None}
+    return types.GenerateContentConfig(**settings) if settings else None
+
+def _record(prompt, response_text, latency, stream=False):
+    """Adds the call to the transcript when recording (LLM_RECORD); replayed calls aren't re-recorded."""
+    recorder = transcript.recorder()
+    if recorder is not None and LLM_BACKEND != "replay":
+        recorder.record(prompt, response_text, latency, stream)
+
+async def _generate_async(prompt, model=None, generation_config=None):
+    if LLM_BACKEND == "replay":
+        return await transcript.replayer().respond(prompt)
+    if LLM_BACKEND == "local":
+        return generate_local_response(prompt)
+    if not breaker.allow_request():
+        return await _fallback_generate_async(prompt, generation_config)
+
+    client = _get_client()
+    model = model or _get_model()
     
     # Use the async client method and await
-    response = await client.aio.models.generate_content( 
-        model=model,
-        contents=[prompt]
+    start = time.monotonic()
+    try:
+        response = await client.aio.models.generate_content( 
+            model=model,
+            contents=[prompt],
+            config=_build_config(generation_config)
+        )
+    except asyncio.CancelledError:
+        breaker.record_abandoned(time.monotonic() - start)
+        raise
+    except Exception:
+        breaker.record_failure()
+        raise
+    latency = time.monotonic() - start
+    breaker.record_success(latency)
+    _latencies[_latency_key(model, generation_config)].append(latency)
+    return response.text
+
+async def _fallback_generate_async(prompt, generation_config=None):
+    """Degraded-mode call used while the breaker is open."""
+    metrics.increment("llm_fallback_calls", backend=LLM_FALLBACK)
+    if LLM_FALLBACK == "local":
+        return generate_local_response(prompt)
+    response = await _get_client().aio.models.generate_content(
+        model=FALLBACK_MODEL,
+        contents=[prompt],
+        config=_build_config(generation_config)
     )
-    response_text = response.text
+    return response.text
+
+async def _hedged_generate_async(prompt, hedge_delay, validate, model=None, generation_config=None):
+    """Runs the call, duplicating it after hedge_delay seconds; returns the first valid response."""
+    primary = asyncio.ensure_future(_generate_async(prompt, model, generation_config))
+    tasks = [primary]
+    hedged = False
+    last_error = None
+    try:
+        while tasks:
+            done, _ = await asyncio.wait(
+                tasks, timeout=None if hedged else hedge_delay, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                # Primary is slower than p95: fire the duplicate
+                hedged = True
+                metrics.increment("llm_hedged_requests")
+                tasks.append(asyncio.ensure_future(_generate_async(prompt, model, generation_config)))
+                continue
+            for task in done:
+                tasks.remove(task)
+                try:
+                    response_text = task.result()
+                    if validate:
+                        validate(response_text)
+                    if task is not primary:
+                        metrics.increment("llm_hedge_wins")
+                    return response_text
+                except Exception as e:
+                    last_error = e
+        raise last_error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+# By default, we Google Gemini 2.5 flash, as it shows great performance for code understanding
+async def call_llm_async(prompt, timeout=None, hedge=None, validate=None, model=None, generation_config=None):
+    """Calls the LLM with a per-call deadline and optional hedging.
+
+    model:             overrides GEMINI_MODEL for this call (see utils/model_routing.py).
+    generation_config: dict of GenerateContentConfig fields, e.g. max_output_tokens, temperature.
+    timeout:  seconds before giving up (defaults to LLM_TIMEOUT; 0 disables).
+    hedge:    whether to send a duplicate request after this route's p95 latency (defaults to LLM_HEDGE).
+    validate: optional callable that raises on an unusable response; with hedging, the first
+              response that passes wins.
+    """
+    # Log the prompt
+    logger.info(f"PROMPT: {prompt}")
+    logger.info(f"ROUTE: model={model or _get_model()} config={generation_config or {}}")
+
+    timeout = LLM_TIMEOUT if timeout is None else timeout
+    hedge = LLM_HEDGE if hedge is None else hedge
+    hedge_delay = latency_percentile(95, model, generation_config) if hedge else None
+
+    if hedge_delay is not None:
+        call = _hedged_generate_async(prompt, hedge_delay, validate, model, generation_config)
+    else:
+        call = _generate_async(prompt, model, generation_config)
+
+    start = time.monotonic()
+    try:
+        response_text = await asyncio.wait_for(call, timeout or None)
+    except asyncio.TimeoutError:
+        metrics.increment("llm_timeouts")
+        logger.info(f"TIMEOUT after {timeout}s")
+        raise
     
     # Log the response
     logger.info(f"RESPONSE: {response_text}")
+    _record(prompt, response_text, time.monotonic() - start)
     
     return response_text
 
+async def stream_llm_async(prompt, timeout=None, model=None, generation_config=None):
+    """Streams the LLM response, yielding text chunks as they arrive.
+
+    The whole stream shares one deadline (defaults to LLM_TIMEOUT; 0 disables); running
+    out raises asyncio.TimeoutError like call_llm_async.
+    """
+    logger.info(f"PROMPT (stream): {prompt}")
+    logger.info(f"ROUTE (stream): model={model or _get_model()} config={generation_config or {}}")
+    timeout = LLM_TIMEOUT if timeout is None else timeout
+    deadline = time.monotonic() + timeout if timeout else None
+
+    def remaining():
+        return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+    if LLM_BACKEND == "replay":
+        yield await asyncio.wait_for(transcript.replayer().respond(prompt), remaining())
+        return
+    start = time.monotonic()
+    if LLM_BACKEND == "local":
+        response_text = generate_local_response(prompt)
+        _record(prompt, response_text, time.monotonic() - start, stream=True)
+        yield response_text
+        return
+
+    use_primary = breaker.allow_request()
+    if not use_primary:
+        metrics.increment("llm_fallback_calls", backend=LLM_FALLBACK)
+        if LLM_FALLBACK == "local":
+            response_text = generate_local_response(prompt)
+            _record(prompt, response_text, time.monotonic() - start, stream=True)
+            yield response_text
+            return
+
+    client = _get_client()
+    chunks = []
+    try:
+        stream = await asyncio.wait_for(
+            client.aio.models.generate_content_stream(
+                model=(model or _get_model()) if use_primary else FALLBACK_MODEL,
+                contents=[prompt],
+                config=_build_config(generation_config)
+            ),
+            remaining()
+        )
+        iterator = stream.__aiter__()
+        while True:
+            try:
+                chunk = await asyncio.wait_for(iterator.__anext__(), remaining())
+            except StopAsyncIteration:
+                break
+            if chunk.text:
+                if not chunks:
+                    metrics.increment("llm_streams")
+                    metrics.observe("llm_time_to_first_token_seconds", time.monotonic() - start)
+                chunks.append(chunk.text)
+                yield chunk.text
+    except asyncio.TimeoutError:
+        metrics.increment("llm_timeouts")
+        logger.info(f"TIMEOUT (stream) after {timeout}s")
+        if use_primary:
+            breaker.record_abandoned(time.monotonic() - start)
+        raise
+    except asyncio.CancelledError:
+        if use_primary:
+            breaker.record_abandoned(time.monotonic() - start)
+        raise
+    except Exception:
+        if use_primary:
+            breaker.record_failure()
+        raise
+    if use_primary:
+        breaker.record_success(time.monotonic() - start)
+
+    # Log the full response
+    logger.info(f"RESPONSE (stream): {''.join(chunks)}")
+    _record(prompt, ''.join(chunks), time.monotonic() - start, stream=True)
+
 if __name__ == "__main__":
     test_prompt = "Give me a quick joke about a chicken."
     
@@ -0,0 +1,152 @@
+import asyncio
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from utils import metrics
+
+# Concurrent DecisionNodes (on the event loop, in background threads) must not share one
+# connection's transaction. Reads use a connection per thread; every write goes through a
+# single writer thread that owns its own connection and commits in order.
+
+LOCKED_RETRY_SECONDS = 5.0 # How long the writer retries a write that hits a locked table
+
+class DBWriter:
+    """Single serialized writer.
+
+    submit() queues a list of (sql, params) statements that must be applied atomically and
+    returns a concurrent Future. The writer thread runs each list inside one transaction;
+    lists queued while it was busy are grouped into the same commit (group commit).
+    """
+    def __init__(self, connect_fn, max_batch=100):
+        self._connect = connect_fn
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, statements):
+        """Queues statements for one transaction. The Future resolves to the last statement's lastrowid."""
+        future = Future()
+        self._queue.put((list(statements), future))
+        return future
+
+    def write(self, sql, params=()):
+        """Runs one statement and waits for it to be committed."""
+        return self.submit([(sql, params)]).result()
+
+    async def write_async(self, statements):
+        """Awaitable submit(); the event loop keeps running while the write is queued."""
+        return await asyncio.wrap_future(self.submit(statements))
+
+    def flush(self):
+        """Waits until everything queued so far has been committed."""
+        self.submit([]).result()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        conn = self._connect()
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None) # Finish this batch, then stop
+                    break
+                batch.append(item)
+            # A request cancelled while queued (e.g. its voter missed the phase deadline) is not written;
+            # the rest can no longer be cancelled
+            batch = [entry for entry in batch if entry[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                self._write_batch(conn, batch)
+            except Exception as e: # Keep the writer alive for the session's later writes
+                print(f"Warning: DB writer failed on a batch of {len(batch)}: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+        conn.close()
+
+    def _write_batch(self, conn, batch):
+        start = time.perf_counter()
+        deadline = time.monotonic() + LOCKED_RETRY_SECONDS
+        while True:
+            try:
+                with conn: # One transaction; rolled back if any statement fails
+                    results = [self._apply(conn, statements) for statements, _ in batch]
+                break
+            except sqlite3.OperationalError as e:
+                if "locked" in str(e) and time.monotonic() < deadline:
+                    time.sleep(0.01) # Another connection is mid-write; try again shortly
+                    continue
+                return self._fail(conn, batch, e)
+            except Exception as e:
+                return self._fail(conn, batch, e)
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+        metrics.increment("db_write_transactions")
+        metrics.observe("db_query_seconds", time.perf_counter() - start, op="write_batch")
+        metrics.increment("db_write_requests", len(batch))
+
+    def _apply(self, conn, statements):
+        cursor = conn.cursor()
+        for sql, params in statements:
+            cursor.execute(sql, params)
+        return cursor.lastrowid
+
+    def _fail(self, conn, batch, exc):
+        if len(batch) > 1:
+            # One bad request shouldn't fail the others grouped with it
+            for entry in batch:
+                self._write_batch(conn, [entry])
+        else:
+            batch[0][1].set_exception(exc)
+
+class ReadPool:
+    """Read connections, one per thread, opened on first use.
+    Connections of threads that have exited are closed on the next get()."""
+    def __init__(self, connect_fn):
+        self._connect = connect_fn
+        self._lock = threading.Lock()
+        self._connections = {} # thread -> connection
+
+    def get(self):
+        thread = threading.current_thread()
+        with self._lock:
+            conn = self._connections.get(thread)
+            if conn is None:
+                for dead in [t for t in self._connections if not t.is_alive()]:
+                    self._connections.pop(dead).close()
+                conn = self._connections[thread] = self._connect()
+            return conn
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections.values():
+                conn.close()
+            self._connections.clear()
+
+if __name__ == "__main__":
+    import os, tempfile
+    from functools import partial
+    from utils import game_db
+    from utils.game_db import connect, create_game, new_game_id
+    game_db.GAME_STORE_PATH = os.path.join(tempfile.mkdtemp(), "games.db")
+    game_id = new_game_id()
+    create_game(game_id)
+    writer, reads = DBWriter(partial(connect, game_id)), ReadPool(partial(connect, game_id))
+    futures = [writer.submit([("INSERT INTO actions (day, phase, actor_name, action_type) VALUES (?, 'DEMO', 'Monokuma', 'statement')", (i,))])
+               for i in range(100)]
+    print([f.result() for f in futures][-1], reads.get().execute("SELECT COUNT(*) FROM actions").fetchone())
+    writer.close()
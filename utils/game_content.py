@@ -0,0 +1,47 @@
+from collections import namedtuple
+from types import MappingProxyType
+from assets import texts
+from utils import metrics
+
+# Static game content, loaded once per process and shared (read-only) by every session.
+# Sessions keep only their per-game deltas (roster order, roles, history) in session state.
+GameContent = namedtuple("GameContent", [
+    "character_profiles", "character_intros", "game_introduction_text", "hint_text", "monokuma_tutorial",
+])
+
+def freeze(value):
+    """Read-only copy of nested dicts/lists: dicts become mappingproxies, lists tuples."""
+    if isinstance(value, dict):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+CONTENT = GameContent(
+    character_profiles=freeze(texts.character_profiles),
+    character_intros=freeze(texts.character_intros),
+    game_introduction_text=texts.game_introduction_text,
+    hint_text=texts.hint_text,
+    monokuma_tutorial=freeze(texts.monokuma_tutorial),
+)
+
+_hint_texts = {} # player character -> hint text
+
+def hint_text_for(player_name):
+    """The hint text with PLAYERCHARACTER replaced by the human player's character.
+    Cached, so every game with the same player character shares one string."""
+    text = _hint_texts.get(player_name)
+    if text is not None:
+        metrics.increment("cache_hits", cache="hint_text")
+        return text
+    metrics.increment("cache_misses", cache="hint_text")
+    text = CONTENT.hint_text.replace("PLAYERCHARACTER", player_name) if player_name else CONTENT.hint_text
+    return _hint_texts.setdefault(player_name, text)
+
+if __name__ == "__main__":
+    print(sorted(CONTENT.character_profiles)[:3], len(CONTENT.monokuma_tutorial))
+    print(hint_text_for("Kaede") is hint_text_for("Kaede"), "Kaede" in hint_text_for("Kaede"))
+    try:
+        CONTENT.character_profiles["Kaede"] = {}
+    except TypeError as e:
+        print("read-only:", e)
@@ -0,0 +1,298 @@
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from utils import metrics
+
+# All games share one SQLite store (WAL mode): `game_roles` and `game_actions` carry a game_id.
+# A connection is opened for one game, with TEMP views named `roles` and `actions` that only
+# see (and write) that game's rows, so the game's queries stay unchanged.
+GAME_DB_DIR = os.getenv("GAME_DB_DIR", "games")
+GAME_STORE_PATH = os.getenv("GAME_STORE_PATH", os.path.join(GAME_DB_DIR, "games.db"))
+ARCHIVE_DIR = os.getenv("GAME_ARCHIVE_DIR", os.path.join(GAME_DB_DIR, "archive"))
+FINISHED_RETENTION = float(os.getenv("GAME_FINISHED_RETENTION", str(24 * 3600))) # Seconds a finished game stays in the store
+ABANDONED_RETENTION = float(os.getenv("GAME_ABANDONED_RETENTION", str(7 * 24 * 3600))) # Seconds since an unfinished game was last saved
+
+PRAGMAS = [
+    "PRAGMA journal_mode = WAL",     # Readers don't block the writer thread (and vice versa)
+    "PRAGMA synchronous = NORMAL",   # Safe with WAL; skips an fsync per commit
+    "PRAGMA busy_timeout = 5000",    # Wait for another session's write instead of failing
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -2048",     # 2 MiB page cache per connection; a game is far smaller
+    "PRAGMA wal_autocheckpoint = 1000",
+]
+
+GAME_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+FINISHED_STATES = ["GAME_OVER_HOPE", "GAME_OVER_DESPAIR"]
+
+# Session state persisted with the game so a reconnect can pick up where it left off
+SAVED_FIELDS = ["current_state", "current_day", "user_character_name", "viewer_mode_selection",
+                "current_phase_actors", "messages", "buttons_used", "total_speakers_this_trial", "user_speaker_index"]
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS main.games (
+        game_id TEXT PRIMARY KEY,
+        status TEXT NOT NULL DEFAULT 'active' CHECK (status IN ('active', 'finished')),
+        seed TEXT,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL,
+        current_state TEXT,
+        current_day INTEGER,
+        user_character_name TEXT,
+        viewer_mode_selection TEXT,
+        current_phase_actors TEXT,
+        messages TEXT,
+        buttons_used TEXT,
+        total_speakers_this_trial INTEGER,
+        user_speaker_index INTEGER
+    )""",
+    """CREATE TABLE IF NOT EXISTS main.game_roles (
+        game_id TEXT NOT NULL,
+        id INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        role TEXT NOT NULL,
+        is_alive BOOLEAN NOT NULL CHECK (is_alive IN (0, 1)),
+        PRIMARY KEY (game_id, id),
+        UNIQUE (game_id, name)
+    )""",
+    """CREATE TABLE IF NOT EXISTS main.game_actions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        game_id TEXT NOT NULL,
+        day INTEGER NOT NULL,
+        phase TEXT NOT NULL,
+        actor_name TEXT NOT NULL,
+        action_type TEXT NOT NULL,
+        content TEXT,
+        target_name TEXT,
+        emotion TEXT
+    )""",
+    # Game queries filter by day/phase (history, vote tallies) or by actor/action (night decisions)
+    "CREATE INDEX IF NOT EXISTS main.actions_game_day_phase ON game_actions (game_id, day, phase)",
+    "CREATE INDEX IF NOT EXISTS main.actions_game_actor ON game_actions (game_id, actor_name, action_type, day)",
+    "CREATE INDEX IF NOT EXISTS main.games_status_updated ON games (status, updated_at)",
+]
+
+# Columns added after a store may already have been created: (table, column, type)
+COLUMN_MIGRATIONS = [
+    ("games", "seed", "TEXT"),
+    ("games", "total_speakers_this_trial", "INTEGER"),
+    ("games", "user_speaker_index", "INTEGER"),
+]
+
+# Per-connection views over one game's rows; {game_id} is a validated hex id
+GAME_VIEWS = [
+    "CREATE TEMP VIEW roles AS SELECT id, name, role, is_alive FROM main.game_roles WHERE game_id = '{game_id}'",
+    """CREATE TEMP TRIGGER roles_insert INSTEAD OF INSERT ON roles BEGIN
+        INSERT INTO game_roles (game_id, id, name, role, is_alive) VALUES ('{game_id}', NEW.id, NEW.name, NEW.role, NEW.is_alive);
+    END""",
+    """CREATE TEMP TRIGGER roles_update INSTEAD OF UPDATE ON roles BEGIN
+        UPDATE game_roles SET id = NEW.id, name = NEW.name, role = NEW.role, is_alive = NEW.is_alive
+        WHERE game_id = '{game_id}' AND id = OLD.id;
+    END""",
+    """CREATE TEMP TRIGGER roles_delete INSTEAD OF DELETE ON roles BEGIN
+        DELETE FROM game_roles WHERE game_id = '{game_id}' AND id = OLD.id;
+    END""",
+    """CREATE TEMP VIEW actions AS SELECT id, day, phase, actor_name, action_type, content, target_name, emotion
+        FROM main.game_actions WHERE game_id = '{game_id}'""",
+    """CREATE TEMP TRIGGER actions_insert INSTEAD OF INSERT ON actions BEGIN
+        INSERT INTO game_actions (id, game_id, day, phase, actor_name, action_type, content, target_name, emotion)
+        VALUES (NEW.id, '{game_id}', NEW.day, NEW.phase, NEW.actor_name, NEW.action_type, NEW.content, NEW.target_name, NEW.emotion);
+    END""",
+    """CREATE TEMP TRIGGER actions_update INSTEAD OF UPDATE ON actions BEGIN
+        UPDATE game_actions SET day = NEW.day, phase = NEW.phase, actor_name = NEW.actor_name, action_type = NEW.action_type,
+            content = NEW.content, target_name = NEW.target_name, emotion = NEW.emotion
+        WHERE game_id = '{game_id}' AND id = OLD.id;
+    END""",
+    """CREATE TEMP TRIGGER actions_delete INSTEAD OF DELETE ON actions BEGIN
+        DELETE FROM game_actions WHERE game_id = '{game_id}' AND id = OLD.id;
+    END""",
+]
+
+_store_lock = threading.Lock()
+_store_conn = None # Process-wide connection for store-level work (creating, finding, cleaning up games)
+_last_cleanup = 0.0
+
+def new_game_id():
+    return uuid.uuid4().hex
+
+def _check_game_id(game_id):
+    if not GAME_ID_PATTERN.match(game_id or ""):
+        raise ValueError(f"Invalid game id: {game_id!r}")
+    return game_id
+
+def _open(path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def _store():
+    """The process-wide store connection; creates the schema on first use. Call with _store_lock held."""
+    global _store_conn
+    if _store_conn is None:
+        _store_conn = _open(GAME_STORE_PATH)
+        with _store_conn:
+            for statement in SCHEMA:
+                _store_conn.execute(statement)
+            for table, column, column_type in COLUMN_MIGRATIONS:
+                columns = [row[1] for row in _store_conn.execute(f"PRAGMA main.table_info({table})")]
+                if column not in columns:
+                    _store_conn.execute(f"ALTER TABLE main.{table} ADD COLUMN {column} {column_type}")
+    return _store_conn
+
+def connect(game_id):
+    """Opens a store connection scoped to one game (see GAME_VIEWS). Usable from any thread."""
+    _check_game_id(game_id)
+    with _store_lock:
+        _store() # Make sure the shared tables exist
+    conn = _open(GAME_STORE_PATH)
+    for statement in GAME_VIEWS:
+        conn.execute(statement.format(game_id=game_id))
+    return conn
+
+def create_game(game_id, seed=None):
+    """Registers a new game in the store, with the seed its random decisions derive from."""
+    now = time.time()
+    with _store_lock, _store() as conn:
+        conn.execute("INSERT INTO main.games (game_id, seed, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                     (_check_game_id(game_id), seed, now, now))
+
+def game_exists(game_id):
+    if not GAME_ID_PATTERN.match(game_id or ""):
+        return False
+    with _store_lock:
+        return _store().execute("SELECT 1 FROM main.games WHERE game_id = ?", (game_id,)).fetchone() is not None
+
+def assign_roles_and_log(conn, character_list, rng=random):
+    """Assigns roles, populates the roles table, and logs the assignment.
+    `rng` shuffles the roles (a seeded random.Random makes the assignment reproducible)."""
+    cursor = conn.cursor()
+    num_players = len(character_list)
+    # Example role distribution (adjust as needed)
+    roles = ["Blackened"] * 3 + ["Truth-Seeker"] * 1 + ["Guardian"] * 1 + ["Student"] * (num_players - 5)
+    rng.shuffle(roles)
+
+    for i, name in enumerate(character_list):
+        role = roles[i]
+        player_order = i + 1 # 1-based initial order
+        # Insert into roles table
+        cursor.execute(
+            "INSERT INTO roles (id, name, role, is_alive) VALUES (?, ?, ?, ?)",
+            (player_order, name, role, True)
+        )
+    conn.commit()
+
+def night_decision_logged(cursor, actor_name, action_type, day):
+    """True if actor_name already logged this night's decision (e.g. decided alongside the Blackened vote)."""
+    cursor.execute(
+        "SELECT 1 FROM actions WHERE actor_name = ? AND action_type = ? AND day = ? LIMIT 1",
+        (actor_name, action_type, day)
+    )
+    return cursor.fetchone() is not None
+
+def save_game_state(conn, game_id, state):
+    """Writes the SAVED_FIELDS of `state` (e.g. st.session_state) to the game's row in `games`."""
+    start = time.perf_counter()
+    values = {field: state.get(field) for field in SAVED_FIELDS}
+    conn.execute(
+        """UPDATE main.games SET status = ?, updated_at = ?, current_state = ?, current_day = ?,
+               user_character_name = ?, viewer_mode_selection = ?, current_phase_actors = ?, messages = ?, buttons_used = ?,
+               total_speakers_this_trial = ?, user_speaker_index = ?
+           WHERE game_id = ?""",
+        ("finished" if values["current_state"] in FINISHED_STATES else "active", time.time(),
+         values["current_state"], values["current_day"], values["user_character_name"], values["viewer_mode_selection"],
+         json.dumps(values["current_phase_actors"]) if values["current_phase_actors"] is not None else None,
+         json.dumps(values["messages"] or []), json.dumps(sorted(values["buttons_used"] or [])),
+         values["total_speakers_this_trial"], values["user_speaker_index"], game_id)
+    )
+    conn.commit()
+    metrics.observe("db_query_seconds", time.perf_counter() - start, op="save_state")
+
+def load_game_state(conn, game_id):
+    """Returns the saved session state as a dict (see SAVED_FIELDS) plus the player order
+    and the game's seed, or None."""
+    start = time.perf_counter()
+    row = conn.execute(
+        """SELECT current_state, current_day, user_character_name, viewer_mode_selection,
+                  current_phase_actors, messages, buttons_used, total_speakers_this_trial, user_speaker_index, seed
+           FROM main.games WHERE game_id = ?""", (game_id,)
+    ).fetchone()
+    if row is None or row[0] is None:
+        return None # Unknown game, or nothing saved yet
+    state = dict(zip(SAVED_FIELDS, row))
+    state["game_seed"] = row[-1]
+    state["current_phase_actors"] = json.loads(state["current_phase_actors"]) if state["current_phase_actors"] else None
+    state["messages"] = json.loads(state["messages"])
+    state["buttons_used"] = set(json.loads(state["buttons_used"]))
+    state["shuffled_character_order"] = [name for (name,) in conn.execute("SELECT name FROM roles ORDER BY id")]
+    metrics.observe("db_query_seconds", time.perf_counter() - start, op="load_state")
+    return state
+
+def archive_game(game_id):
+    """Moves a game's rows out of the shared store into its own file under ARCHIVE_DIR. Returns the path."""
+    _check_game_id(game_id)
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    path = os.path.join(ARCHIVE_DIR, f"{game_id}.db")
+    with _store_lock:
+        conn = _store()
+        conn.execute("ATTACH DATABASE ? AS archive", (path,))
+        try:
+            with conn:
+                # The archive is a single-game database: the game's row plus plain `roles` and `actions` tables
+                conn.execute("CREATE TABLE IF NOT EXISTS archive.games AS SELECT * FROM main.games WHERE 0")
+                conn.execute("CREATE TABLE IF NOT EXISTS archive.roles AS SELECT id, name, role, is_alive FROM main.game_roles WHERE 0")
+                conn.execute("""CREATE TABLE IF NOT EXISTS archive.actions AS
+                                SELECT id, day, phase, actor_name, action_type, content, target_name, emotion FROM main.game_actions WHERE 0""")
+                conn.execute("INSERT INTO archive.games SELECT * FROM main.games WHERE game_id = ?", (game_id,))
+                conn.execute("INSERT INTO archive.roles SELECT id, name, role, is_alive FROM main.game_roles WHERE game_id = ?", (game_id,))
+                conn.execute("""INSERT INTO archive.actions
+                                SELECT id, day, phase, actor_name, action_type, content, target_name, emotion
+                                FROM main.game_actions WHERE game_id = ?""", (game_id,))
+                for table in ["game_actions", "game_roles", "games"]:
+                    conn.execute(f"DELETE FROM main.{table} WHERE game_id = ?", (game_id,))
+        finally:
+            conn.execute("DETACH DATABASE archive")
+    return path
+
+def cleanup_games(now=None):
+    """Archives finished games older than FINISHED_RETENTION and deletes unfinished games
+    not saved for ABANDONED_RETENTION. Returns (archived, deleted) counts."""
+    global _last_cleanup
+    now = now or time.time()
+    _last_cleanup = now
+    with _store_lock:
+        conn = _store()
+        finished = [game_id for (game_id,) in conn.execute(
+            "SELECT game_id FROM main.games WHERE status = 'finished' AND updated_at < ?", (now - FINISHED_RETENTION,))]
+        abandoned = [game_id for (game_id,) in conn.execute(
+            "SELECT game_id FROM main.games WHERE status = 'active' AND updated_at < ?", (now - ABANDONED_RETENTION,))]
+        with conn:
+            for game_id in abandoned:
+                for table in ["game_actions", "game_roles", "games"]:
+                    conn.execute(f"DELETE FROM main.{table} WHERE game_id = ?", (game_id,))
+    for game_id in finished:
+        archive_game(game_id)
+    return len(finished), len(abandoned)
+
+def cleanup_due(interval=3600):
+    """True if cleanup_games() hasn't run in this process for `interval` seconds."""
+    return time.time() - _last_cleanup > interval
+
+if __name__ == "__main__":
+    import tempfile
+    GAME_DB_DIR = tempfile.mkdtemp()
+    GAME_STORE_PATH, ARCHIVE_DIR = os.path.join(GAME_DB_DIR, "games.db"), os.path.join(GAME_DB_DIR, "archive")
+    game_ids = [new_game_id(), new_game_id()]
+    for game_id in game_ids:
+        create_game(game_id)
+        conn = connect(game_id)
+        assign_roles_and_log(conn, ["Kaede", "Kokichi", "Shuichi", "Maki", "Kaito", "Himiko"])
+        save_game_state(conn, game_id, {"current_state": "GAME_OVER_HOPE", "current_day": 2, "messages": [], "buttons_used": {"start_game"}})
+    conn = connect(game_ids[0]) # Reconnect as a restarted server would
+    print(game_exists(game_ids[0]), conn.execute("SELECT COUNT(*) FROM roles").fetchone(), load_game_state(conn, game_ids[0]))
+    print(cleanup_games(now=time.time() + FINISHED_RETENTION + 1), game_exists(game_ids[0]), os.listdir(ARCHIVE_DIR))
@@ -0,0 +1,46 @@
+import hashlib
+import random
+import re
+
+# Offline stand-in for the LLM. It reads the DecisionNode prompt and answers with
+# well-formed YAML: a canned statement for talking phases, a pseudo-random target for
+# votes. Used as the degraded-mode fallback and for running games without network access.
+
+STOCK_STATEMENTS = [
+    "I don't have enough to go on yet. Let's watch who votes together.",
+    "Something about last night doesn't sit right with me. Let's stay sharp.",
+    "I'm keeping my eyes on the quiet ones. Silence hides a lot.",
+    "We need to vote together, or the Blackened win by default.",
+    "I trust the evidence, not the speeches. Let's look at the votes again.",
+]
+
+def _rng_for(prompt):
+    # Seeded by the prompt so the same game state always gets the same answer
+    return random.Random(hashlib.sha256(prompt.encode("utf-8")).hexdigest())
+
+def generate_local_response(prompt):
+    """Returns a fenced YAML response that satisfies the DecisionNode output format."""
+    rng = _rng_for(prompt)
+    name_match = re.search(r"You are acting as (.+?)\.", prompt)
+    character_name = name_match.group(1) if name_match else "I"
+    output_format = prompt.split("Output Format", 1)[-1]
+
+    lines = []
+    if re.search(r"^thinking:", output_format, re.MULTILINE):
+        lines.append(f"thinking: I am {character_name}. I will keep it simple and follow the hints.")
+    if re.search(r"^talking:", output_format, re.MULTILINE):
+        lines.append(f"talking: \"{rng.choice(STOCK_STATEMENTS)}\"")
+    if re.search(r"^emotion:", output_format, re.MULTILINE):
+        lines.append(f"emotion: {rng.choice(['normal', 'determined', 'think', 'worried'])}")
+    if re.search(r"^vote_target_index:", output_format, re.MULTILINE):
+        targets = re.findall(r"^(\d+)\. (.+)$", prompt.split("Available Targets", 1)[-1].split("Output Format", 1)[0], re.MULTILINE)
+        # Prefer someone else; Abstain (0) only if there is no one to pick
+        candidates = [int(i) for i, name in targets if int(i) > 0 and name.strip() != character_name]
+        lines.append(f"vote_target_index: {rng.choice(candidates) if candidates else 0}")
+    return "```yaml\n" + "\n".join(lines) + "\n```"
+
+if __name__ == "__main__":
+    print(generate_local_response(
+        "You are acting as Kaede.\nAvailable Targets for CLASS_TRIAL_VOTE: \n0. Abstain # Do not vote\n1. Kaede\n2. Kokichi\n"
+        "Output Format (Strictly follow this YAML format):\n```yaml\nthinking: >\n  ...\nvote_target_index: <Index Number>\n```"
+    ))
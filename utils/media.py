@@ -0,0 +1,35 @@
+import base64
+from utils import metrics
+
+# Character sprites and voice clips live under assets/<character>/<emotion>.png|.wav
+def get_asset_path(character_name, asset_type, emotion="normal"):
+    """Constructs path to character assets. asset_type can be 'avatar' or 'audio'."""
+    extension = "png" if asset_type == "avatar" else "wav"
+    path = f"./assets/{character_name}/{emotion}.{extension}"
+    return path
+
+def get_hidden_autoplay_html(file_path,errorLoop=False):
+    """Generates minimal HTML for AUTOPLAY audio. ASSUMES file exists & is .wav"""
+    # DON'T check if file exists first. Let it fail if it doesn't.
+    try:
+        with open(file_path, "rb") as f:
+            data = f.read()
+        b64 = base64.b64encode(data).decode()
+        mime_type = "audio/wav" # Assume wav for simplicity
+        html = f"""
+        <audio autoplay style="display:none">
+            <source src="data:{mime_type};base64,{b64}" type="{mime_type}">
+            Your browser does not support the audio element.
+        </audio>
+        """
+        metrics.increment("asset_bytes_served", len(html), type="audio") # Inlined into the page as base64
+    except:
+        if errorLoop: return ""
+        else: return get_hidden_autoplay_html(file_path="assets/Monokuma/think.wav",errorLoop=True)
+        # Fail safely for missing audio, using a default file if possible
+    
+    return html
+
+if __name__ == "__main__":
+    path = get_asset_path("Monokuma", "audio", "think")
+    print(path, len(get_hidden_autoplay_html(path)))
@@ -0,0 +1,178 @@
+import bisect
+import os
+import re
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Simple in-process counters, gauges and histograms, keyed by (name, sorted labels).
+# METRICS_PORT serves them in the Prometheus text format at http://METRICS_HOST:METRICS_PORT/metrics
+# (off when unset; the host defaults to loopback so the endpoint isn't public).
+METRICS_PORT = os.getenv("METRICS_PORT")
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# Seconds; covers sub-millisecond DB reads up to slow LLM calls and long script runs
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_gauges = {}
+_histograms = {} # key -> _Histogram
+_server = None
+
+def _key(name, labels):
+    return (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+def increment(name, amount=1, **labels):
+    """Adds `amount` to the counter `name` with the given labels."""
+    with _lock:
+        _counters[_key(name, labels)] += amount
+
+def get_counter(name, **labels):
+    """Returns the current value of a counter (0 if never incremented)."""
+    with _lock:
+        return _counters.get(_key(name, labels), 0)
+
+def set_gauge(name, value, **labels):
+    """Sets the gauge `name` (a value that can go up and down) to `value`."""
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+def clear_gauge(name, **labels):
+    """Removes a gauge (e.g. one labelled with a session that no longer exists)."""
+    with _lock:
+        _gauges.pop(_key(name, labels), None)
+
+def adjust_gauge(name, amount, **labels):
+    """Adds `amount` (may be negative) to a gauge, e.g. +1/-1 around work in flight."""
+    with _lock:
+        key = _key(name, labels)
+        _gauges[key] = _gauges.get(key, 0) + amount
+
+def get_gauge(name, **labels):
+    """Returns the current value of a gauge (None if never set)."""
+    with _lock:
+        return _gauges.get(_key(name, labels))
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1) # Per bucket (not cumulative); the last is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+def observe(name, value, buckets=DEFAULT_BUCKETS, **labels):
+    """Records `value` (e.g. a duration in seconds) in the histogram `name`.
+    The buckets are fixed by the first observation of each name and labels."""
+    with _lock:
+        key = _key(name, labels)
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = _Histogram(buckets)
+        histogram.counts[bisect.bisect_left(histogram.buckets, value)] += 1
+        histogram.sum += value
+        histogram.count += 1
+
+def get_histogram(name, **labels):
+    """Returns {"count", "sum", "buckets": {upper bound: cumulative count}} (None if never observed)."""
+    with _lock:
+        histogram = _histograms.get(_key(name, labels))
+        if histogram is None:
+            return None
+        cumulative, total = {}, 0
+        for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+            total += count
+            cumulative[bound] = total
+        return {"count": histogram.count, "sum": histogram.sum, "buckets": cumulative}
+
+def snapshot():
+    """Returns a copy of all counters and gauges as {(name, labels): value}."""
+    with _lock:
+        return {**_counters, **_gauges}
+
+def _metric_name(name):
+    name = re.sub(r"[^a-zA-Z0-9_:]", "_", name)
+    return name if not name[:1].isdigit() else f"_{name}"
+
+def _format_labels(labels, extra=()):
+    pairs = [(re.sub(r"[^a-zA-Z0-9_]", "_", k), v) for k, v in labels] + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+def render_prometheus():
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    with _lock:
+        series = [(name, "counter", labels, value) for (name, labels), value in _counters.items()]
+        series += [(name, "gauge", labels, value) for (name, labels), value in _gauges.items() if value is not None]
+        histograms = [(name, labels, h.buckets, list(h.counts), h.sum, h.count) for (name, labels), h in _histograms.items()]
+    lines, typed = [], set()
+    for name, kind, labels, value in sorted(series, key=lambda s: (s[0], s[2])):
+        name = _metric_name(name)
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} {kind}")
+        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    for name, labels, buckets, counts, total, count in sorted(histograms, key=lambda h: (h[0], h[1])):
+        name = _metric_name(name)
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} histogram")
+        cumulative = 0
+        for bound, bucket_count in zip(buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', _format_value(bound))])} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+        lines.append(f"{name}_count{_format_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # Scrapes every few seconds would flood stderr
+
+def start_http_server(port=None, host=None):
+    """Serves /metrics from a daemon thread (once per process). Without a port (or METRICS_PORT)
+    this does nothing. Returns the server, or None if it is off or the port is taken."""
+    global _server
+    port = port if port is not None else METRICS_PORT
+    if port in (None, ""):
+        return None
+    with _lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((host or METRICS_HOST, int(port)), _MetricsHandler)
+            except (OSError, ValueError) as e:
+                print(f"Warning: Could not serve metrics on {host or METRICS_HOST}:{port}: {e}")
+                _server = False # Don't retry on every script run
+                return None
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+        return _server or None
+
+if __name__ == "__main__":
+    import urllib.request
+    increment("example_total", phase="CLASS_TRIAL_VOTE")
+    increment("example_total", phase="CLASS_TRIAL_VOTE")
+    adjust_gauge("example_in_flight", 1)
+    for seconds in (0.003, 0.2, 4):
+        observe("example_seconds", seconds, phase="CLASS_TRIAL_VOTE")
+    print(snapshot())
+    server = start_http_server(0) # Any free port
+    with urllib.request.urlopen(f"http://{METRICS_HOST}:{server.server_address[1]}/metrics") as response:
+        print(response.read().decode())
@@ -0,0 +1,68 @@
+import os
+import threading
+import yaml
+from utils import metrics
+
+# Routing table: maps phase (and optionally role/character) to a model and generation config.
+ROUTING_FILE = os.getenv(
+    "MODEL_ROUTING_FILE",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "model_routing.yaml")
+)
+ROUTE_FIELDS = ["model", "max_output_tokens", "temperature", "reasoning"]
+MATCH_FIELDS = ["phase", "role", "character"]
+# How much 'thinking' the prompt asks for: full reasoning, one short sentence, or none (vote only)
+REASONING_MODES = ["full", "short", "none"]
+
+_lock = threading.Lock()
+_cache = {"key": None, "table": None}
+
+def load_routing_table(path=None):
+    """Loads (and caches until the file changes) the routing table. A missing file means no routing."""
+    path = path or ROUTING_FILE
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return {"default": {}, "routes": []}
+    with _lock:
+        if _cache["key"] == (path, mtime):
+            metrics.increment("cache_hits", cache="routing_table")
+        else:
+            metrics.increment("cache_misses", cache="routing_table")
+            with open(path, "r") as f:
+                table = yaml.safe_load(f) or {}
+            _cache["table"] = {
+                "default": table.get("default") or {},
+                "routes": [route for route in (table.get("routes") or []) if isinstance(route, dict)],
+            }
+            _cache["key"] = (path, mtime)
+        return _cache["table"]
+
+def resolve_route(phase, character=None, role=None, table=None):
+    """Returns the route for a call as a dict with 'model', 'max_output_tokens', 'temperature',
+    'reasoning' and 'matched' (the route entry that won, or None). Generation fields may be
+    None (use API defaults); 'reasoning' is always one of REASONING_MODES."""
+    table = table or load_routing_table()
+    wanted = {"phase": phase, "role": role, "character": character}
+
+    best_route, best_score = None, 0
+    for route in table["routes"]:
+        if any(field in route and route[field] != wanted[field] for field in MATCH_FIELDS):
+            continue
+        # Character beats role beats phase when several routes match
+        score = (4 if "character" in route else 0) + (2 if "role" in route else 0) + (1 if "phase" in route else 0)
+        if score > best_score:
+            best_route, best_score = route, score
+
+    resolved = {field: table["default"].get(field) for field in ROUTE_FIELDS}
+    if best_route:
+        resolved.update({field: best_route[field] for field in ROUTE_FIELDS if best_route.get(field) is not None})
+    if resolved["reasoning"] not in REASONING_MODES:
+        if resolved["reasoning"] is not None:
+            print(f"Warning: Unknown reasoning mode '{resolved['reasoning']}' in {ROUTING_FILE}; using 'full'.")
+        resolved["reasoning"] = "full"
+    resolved["matched"] = {field: best_route[field] for field in MATCH_FIELDS if field in best_route} if best_route else None
+    return resolved
+
+if __name__ == "__main__":
+    for phase in ["NIGHT_PHASE_GUARDIAN", "CLASS_TRIAL_DISCUSSION", "CLASS_TRIAL_VOTE"]:
+        print(phase, resolve_route(phase, character="Kaede", role="Student"))
@@ -0,0 +1,169 @@
+import cProfile
+import functools
+import itertools
+import os
+import threading
+import time
+import tracemalloc
+from utils import metrics
+
+# On-demand profiling of selected game phases. PROFILE_PHASES (comma-separated states, or
+# "all") turns it on for every game; with PROFILE_QUERY=1 a session can also ask for it with
+# ?profile=CLASS_TRIAL_VOTE,MORNING_ANNOUNCEMENT. Each capture writes a cProfile .pstats file
+# and the top PROFILE_TOP_N allocation sites (tracemalloc) into PROFILE_DIR. Phases that are
+# not selected cost one set lookup.
+PROFILE_PHASES = frozenset(p.strip() for p in os.getenv("PROFILE_PHASES", "").split(",") if p.strip())
+PROFILE_QUERY = os.getenv("PROFILE_QUERY", "0") == "1" # Off by default: a public URL shouldn't fill the disk
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_TOP_N = int(os.getenv("PROFILE_TOP_N", "25"))
+PROFILE_TRACE_FRAMES = int(os.getenv("PROFILE_TRACE_FRAMES", "1")) # Stack depth recorded per allocation
+
+_local = threading.local() # .capture: the capture running in this thread; .phase: the app loop's capture
+_open_phases = {} # thread -> its phase capture, so one left open by a finished script run still gets written
+_trace_lock = threading.Lock()
+_trace_users = 0 # Captures currently using tracemalloc (it is process-wide)
+_counter = itertools.count(1)
+
+def selected_phases(query_value=None):
+    """Phases to profile for a session: PROFILE_PHASES plus ?profile= when PROFILE_QUERY=1."""
+    if not (query_value and PROFILE_QUERY):
+        return PROFILE_PHASES
+    return PROFILE_PHASES | {p.strip() for p in query_value.split(",") if p.strip()}
+
+def wants(phase, selected):
+    return bool(selected) and (phase in selected or "all" in selected)
+
+class _Capture:
+    """One cProfile + tracemalloc capture. Only one runs per thread; a capture opened while
+    another is running in the same thread (a nested call, or another coroutine of a parallel
+    batch) is already covered by it and records nothing itself."""
+    def __init__(self, label, phase, tag=None):
+        self.label, self.phase, self.tag = label, phase, tag
+        self.profile = None
+
+    def __enter__(self):
+        global _trace_users
+        if getattr(_local, "capture", None) is not None:
+            return self
+        _local.capture = self
+        with _trace_lock:
+            if _trace_users == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start(PROFILE_TRACE_FRAMES)
+            _trace_users += 1
+        tracemalloc.reset_peak()
+        self.snapshot = tracemalloc.take_snapshot()
+        self.started = time.perf_counter()
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as e: # Python 3.12+ allows one profiler per process, not per thread
+            print(f"Warning: Skipping profile of {self.phase}/{self.label}: {e}")
+            _local.capture = None
+            self.finish()
+            return self
+        self.profile = profile
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.profile is None:
+            return False
+        self.profile.disable()
+        _local.capture = None
+        self.finish()
+        return False
+
+    def finish(self):
+        """Writes the capture. The profiler must already be off (or its thread gone)."""
+        global _trace_users
+        elapsed = time.perf_counter() - self.started
+        snapshot = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        with _trace_lock:
+            _trace_users -= 1
+            if _trace_users == 0:
+                tracemalloc.stop()
+        if self.profile is None:
+            return
+        try:
+            self._write(elapsed, snapshot, peak)
+        except OSError as e:
+            print(f"Warning: Could not write profile for {self.phase}/{self.label}: {e}")
+
+    def _write(self, elapsed, snapshot, peak):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        name = "-".join(filter(None, [time.strftime("%Y%m%d-%H%M%S"), self.phase, self.label, self.tag, str(next(_counter))]))
+        base = os.path.join(PROFILE_DIR, name)
+        self.profile.dump_stats(base + ".pstats")
+        snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        with open(base + ".alloc.txt", "w") as f:
+            f.write(f"{' '.join(filter(None, [self.phase, self.label, self.tag]))}: {elapsed:.3f}s, peak traced memory {peak / 2**20:.1f} MiB\n")
+            f.write(f"Top {PROFILE_TOP_N} allocation sites by growth during the capture:\n")
+            for stat in snapshot.compare_to(self.snapshot, "lineno")[:PROFILE_TOP_N]:
+                f.write(f"{stat}\n")
+        metrics.increment("profile_captures", phase=self.phase, label=self.label)
+
+class _NoCapture:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NO_CAPTURE = _NoCapture()
+
+def capture(label, phase, selected, tag=None):
+    """Context manager that profiles its body if `phase` is in `selected`."""
+    return _Capture(label, phase, tag) if wants(phase, selected) else _NO_CAPTURE
+
+def profiled(label, phase_of):
+    """Decorates an async method so each call is captured. `phase_of` gets the call's arguments
+    and returns (phase, selected phases, tag)."""
+    def decorate(method):
+        @functools.wraps(method)
+        async def wrapper(*args):
+            phase, selected, tag = phase_of(*args)
+            with capture(label, phase, selected, tag):
+                return await method(*args)
+        return wrapper
+    return decorate
+
+def phase(label, current_phase, selected, tag=None):
+    """Ends this thread's previous phase capture and starts one for `current_phase` if it is
+    selected. For loops that move from state to state (app.py's main loop)."""
+    end_phase()
+    if _open_phases and getattr(_local, "capture", None) is None:
+        for thread, capture in list(_open_phases.items()):
+            if not thread.is_alive(): # The script run ended (st.stop) while a phase was being captured
+                del _open_phases[thread]
+                capture.finish()
+    if wants(current_phase, selected):
+        capture = _Capture(label, current_phase, tag).__enter__()
+        if capture.profile is not None:
+            _local.phase = capture
+            _open_phases[threading.current_thread()] = capture
+
+def end_phase():
+    previous = getattr(_local, "phase", None)
+    if previous is not None:
+        _local.phase = None
+        _open_phases.pop(threading.current_thread(), None)
+        previous.__exit__(None, None, None)
+
+if __name__ == "__main__":
+    import asyncio
+    import tempfile
+    PROFILE_DIR = tempfile.mkdtemp()
+
+    @profiled("demo", lambda n: ("DEMO_PHASE", {"DEMO_PHASE"}, None))
+    async def build(n):
+        return [str(i) * 10 for i in range(n)]
+
+    asyncio.run(build(100000))
+    for state in ["DEMO_PHASE", "OTHER_PHASE"]:
+        phase("loop", state, {"DEMO_PHASE"})
+        sum(range(100000))
+    end_phase()
+    for name in sorted(os.listdir(PROFILE_DIR)):
+        print(name)
+    with open(os.path.join(PROFILE_DIR, sorted(os.listdir(PROFILE_DIR))[0])) as f:
+        print("".join(f.readlines()[:4]))
@@ -0,0 +1,149 @@
+import re
+import yaml
+
+VALID_EMOTIONS = ['normal', 'determined', 'think', 'worried']
+
+# Common off-list emotions mapped to the nearest sprite we actually have
+EMOTION_SYNONYMS = {
+    'angry': 'determined', 'furious': 'determined', 'mad': 'determined',
+    'confident': 'determined', 'serious': 'determined', 'resolute': 'determined',
+    'aggressive': 'determined', 'accusing': 'determined', 'accusatory': 'determined',
+    'frustrated': 'determined', 'annoyed': 'determined', 'defiant': 'determined',
+    'thinking': 'think', 'thoughtful': 'think', 'pensive': 'think',
+    'suspicious': 'think', 'curious': 'think', 'confused': 'think',
+    'analytical': 'think', 'skeptical': 'think', 'doubtful': 'think',
+    'worry': 'worried', 'scared': 'worried', 'afraid': 'worried',
+    'nervous': 'worried', 'anxious': 'worried', 'sad': 'worried',
+    'fearful': 'worried', 'panicked': 'worried', 'desperate': 'worried',
+    'neutral': 'normal', 'calm': 'normal', 'happy': 'normal',
+    'cheerful': 'normal', 'relaxed': 'normal', 'friendly': 'normal',
+}
+
+ABSTAIN_WORDS = {'abstain', 'none', 'nobody', 'no one', 'no vote', 'skip', 'null'}
+
+OUTPUT_KEYS = ['thinking', 'talking', 'emotion', 'vote_target_index']
+
+class UnrepairableOutputError(ValueError):
+    """Raised when an LLM output cannot be repaired deterministically and must be retried."""
+
+def extract_yaml_block(raw):
+    """Pulls the YAML body out of an LLM response.
+
+    Returns (yaml_content, repairs) where repairs lists what had to be fixed.
+    """
+    repairs = []
+    fence_match = re.search(r"```(?:yaml|yml|YAML)?[ \t]*\n(.*?)(?:```|$)", raw, re.DOTALL)
+    if "```yaml" in raw and raw.count("```") >= 2:
+        yaml_content = raw.split("```yaml")[1].split("```")[0].strip()
+    elif fence_match:
+        yaml_content = fence_match.group(1).strip()
+        repairs.append("fences")
+    else:
+        # No fences at all: start from the first known key if there is prose before it
+        key_match = re.search(r"^(%s)\s*:" % "|".join(OUTPUT_KEYS), raw, re.MULTILINE)
+        yaml_content = raw[key_match.start():].strip() if key_match else raw.strip()
+        repairs.append("fences")
+    return yaml_content, repairs
+
+def _parse_known_keys(yaml_content):
+    """Line-based fallback for YAML that safe_load rejects (e.g. unquoted colons in prose).
+    Each known top-level key starts a field; following lines are its continuation."""
+    parsed = {}
+    current_key = None
+    for line in yaml_content.splitlines():
+        key_match = re.match(r"^(%s)\s*:\s*(.*)$" % "|".join(OUTPUT_KEYS), line)
+        if key_match:
+            current_key = key_match.group(1)
+            value = key_match.group(2).strip()
+            # Drop block scalar indicators and trailing comments on short fields
+            if value in ('>', '|', '>-', '|-'):
+                value = ""
+            if current_key in ('emotion', 'vote_target_index'):
+                value = value.split('#')[0].strip()
+            parsed[current_key] = value
+        elif current_key and not line.lstrip().startswith('#'):
+            parsed[current_key] = (parsed[current_key] + " " + line.strip()).strip()
+    return {k: v.strip('"\'') if isinstance(v, str) else v for k, v in parsed.items()}
+
+def load_output(raw):
+    """Extracts and parses the YAML dict from a raw LLM response, repairing where possible.
+
+    Returns (parsed_dict, repairs). Raises UnrepairableOutputError if no dict can be recovered.
+    """
+    if not raw:
+        # Blocked or empty candidates come back as None/""; worth another try
+        raise UnrepairableOutputError("LLM returned an empty response.")
+    yaml_content, repairs = extract_yaml_block(raw)
+    try:
+        parsed = yaml.safe_load(yaml_content)
+    except yaml.YAMLError:
+        parsed = None
+    if not isinstance(parsed, dict):
+        parsed = _parse_known_keys(yaml_content)
+        if not parsed:
+            raise UnrepairableOutputError(f"LLM output did not parse into a dictionary. Raw: {raw}")
+        repairs.append("yaml")
+    return parsed, repairs
+
+def repair_emotion(value):
+    """Maps an emotion to one of VALID_EMOTIONS. Returns (emotion, repaired)."""
+    if value in VALID_EMOTIONS:
+        return value, False
+    cleaned = str(value or "").strip().strip('<>"\'').lower()
+    if cleaned in VALID_EMOTIONS:
+        return cleaned, True
+    if cleaned in EMOTION_SYNONYMS:
+        return EMOTION_SYNONYMS[cleaned], True
+    # Values like "normal|worried" or "determined, angry": take the first recognisable word
+    for word in re.split(r"[^a-z]+", cleaned):
+        if word in VALID_EMOTIONS:
+            return word, True
+        if word in EMOTION_SYNONYMS:
+            return EMOTION_SYNONYMS[word], True
+    # Emotion only picks a sprite; fall back to the neutral one rather than re-prompting
+    return 'normal', True
+
+def repair_vote_index(value, valid_target_names):
+    """Resolves a vote into a 1-based index (0 = Abstain). Returns (index, repaired).
+
+    Only unambiguous answers are repaired: an in-range index with stray formatting ("<3>",
+    "3."), a valid target's exact name, "3. Kokichi" when the index and name agree, or an
+    abstain word. Anything else (an out-of-range index, a sentence that happens to name a
+    target) raises UnrepairableOutputError so the vote is asked again rather than guessed.
+    """
+    num_valid_targets = len(valid_target_names)
+    if isinstance(value, int) and not isinstance(value, bool) and 0 <= value <= num_valid_targets:
+        return value, False
+
+    text = str(value if value is not None else "").strip()
+    if re.fullmatch(r"\d+", text, re.ASCII) and int(text) <= num_valid_targets:
+        return int(text), False
+    cleaned = text.strip('<>"\'` ').rstrip('.').strip().lower()
+    indexed_match = re.fullmatch(r"(\d+)\s*[.):-]?\s*(.*)", cleaned, re.ASCII)
+    if indexed_match:
+        index, name = int(indexed_match.group(1)), indexed_match.group(2).strip('<>"\'` ')
+        if index <= num_valid_targets:
+            listed_name = valid_target_names[index - 1].lower() if index else "abstain"
+            if not name or name == listed_name:
+                return index, True
+    else:
+        names = [name.lower() for name in valid_target_names]
+        if cleaned in names:
+            return names.index(cleaned) + 1, True
+        if cleaned in ABSTAIN_WORDS:
+            return 0, True
+
+    raise UnrepairableOutputError(
+        f"Invalid vote_target_index: '{text}'. Must be between 0 (Abstain) and {num_valid_targets}. Targets: {valid_target_names}."
+    )
+
+if __name__ == "__main__":
+    targets = ["Kaede", "Kokichi", "Shuichi"]
+    print(repair_vote_index("2. Kokichi", targets))
+    print(repair_vote_index("kaede", targets))
+    try:
+        repair_vote_index(7, targets)
+    except UnrepairableOutputError as e:
+        print(e) # Out of range: asked again, never guessed from the reasoning
+    print(repair_emotion("Angry"))
+    print(load_output("Sure!\nthinking: Kokichi lied: he said so.\nvote_target_index: 2"))
@@ -0,0 +1,98 @@
+import asyncio
+import random
+import re
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
+import yaml
+
+from utils.repair_output import UnrepairableOutputError
+
+try:
+    from google.genai import errors as genai_errors
+except ImportError:  # Other LLM backends may not ship google-genai
+    genai_errors = None
+
+# HTTP status codes worth retrying; other 4xx (bad key, bad request) will not fix themselves
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+class RetryPolicy:
+    """Decides whether and when a failed DecisionNode exec should be retried.
+
+    Errors are split into two classes with separate budgets:
+      - 'parse': the LLM answered but the output was unusable. Retried quickly.
+      - 'transport': quota (429), server (5xx), timeouts and connection errors.
+        Retried with exponential backoff and full jitter, honouring Retry-After.
+    Anything else ('fatal', e.g. 400/401/403) fails immediately. That includes a bare
+    ValueError/KeyError, which is a bug rather than a bad reply; DecisionNode re-raises
+    whatever parsing and validating the reply throws as UnrepairableOutputError ('parse').
+    """
+    def __init__(self, max_parse_retries=2, max_transport_retries=4,
+                 base_delay=1.0, max_delay=30.0, parse_delay=0.0, max_retry_after=60.0):
+        self.max_parse_retries = max_parse_retries
+        self.max_transport_retries = max_transport_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.parse_delay = parse_delay
+        self.max_retry_after = max_retry_after
+
+    def classify(self, exc):
+        """Returns 'parse', 'transport' or 'fatal' for an exception raised by exec_async."""
+        if isinstance(exc, (UnrepairableOutputError, yaml.YAMLError)):
+            return 'parse'
+        if genai_errors is not None and isinstance(exc, genai_errors.APIError):
+            return 'transport' if exc.code in RETRYABLE_STATUS_CODES else 'fatal'
+        if isinstance(exc, (asyncio.TimeoutError, TimeoutError, OSError)):
+            return 'transport'
+        if type(exc).__module__.startswith(('httpx', 'aiohttp')):
+            return 'transport'
+        return 'fatal'
+
+    def budget(self, kind):
+        """Number of retries allowed for an error class."""
+        if kind == 'parse':
+            return self.max_parse_retries
+        if kind == 'transport':
+            return self.max_transport_retries
+        return 0
+
+    def next_delay(self, kind, attempt, exc=None):
+        """Seconds to wait before retry number `attempt` (0-based) of the given class."""
+        if kind == 'parse':
+            return self.parse_delay
+        retry_after = get_retry_after(exc) if exc is not None else None
+        if retry_after is not None:
+            # Server told us when to come back; add a little jitter so voters don't return together
+            return min(retry_after, self.max_retry_after) + random.uniform(0, self.base_delay)
+        # Full jitter: uniform over [0, base * 2^attempt], capped
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+def get_retry_after(exc):
+    """Extracts a server-requested delay (seconds) from an API error, or None.
+    Checks the Retry-After header first, then Google's RetryInfo error detail."""
+    response = getattr(exc, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    value = headers.get('retry-after') or headers.get('Retry-After')
+    if value:
+        value = str(value).strip()
+        if value.isdigit():
+            return float(value)
+        try:
+            retry_at = parsedate_to_datetime(value)
+            return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            pass
+
+    details = getattr(exc, 'details', None)
+    if isinstance(details, dict):
+        for detail in details.get('error', {}).get('details', []) or []:
+            if isinstance(detail, dict) and str(detail.get('@type', '')).endswith('RetryInfo'):
+                match = re.match(r"^([\d.]+)s$", str(detail.get('retryDelay', '')))
+                if match:
+                    return float(match.group(1))
+    return None
+
+if __name__ == "__main__":
+    policy = RetryPolicy()
+    print([round(policy.next_delay('transport', attempt), 2) for attempt in range(5)])
+    print(policy.classify(UnrepairableOutputError("bad yaml")), policy.classify(TimeoutError()), policy.classify(KeyError()))
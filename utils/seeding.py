@@ -0,0 +1,22 @@
+import os
+import random
+import secrets
+
+# Every random decision in a game draws from its own RNG derived from the game's seed and
+# the decision's purpose (e.g. "roles", or "tie_break" plus the day), so a seed reproduces
+# the game regardless of the order decisions are made in or whether the game was resumed.
+GAME_SEED = os.getenv("GAME_SEED") # Fixed seed for every new game (benchmarks, regression runs)
+
+def new_seed():
+    """A seed for a new game: GAME_SEED if set, otherwise a fresh random one."""
+    return GAME_SEED or str(secrets.randbits(64))
+
+def game_rng(seed, *purpose):
+    """random.Random for one purpose within a game. String seeds hash the same in every process."""
+    return random.Random(":".join(str(part) for part in (seed,) + purpose))
+
+if __name__ == "__main__":
+    seed = new_seed()
+    names = ["Kaede", "Kokichi", "Shuichi", "Maki"]
+    game_rng(seed, "speaking_order").shuffle(names)
+    print(seed, names, game_rng(seed, "tie_break", 2).random() == game_rng(seed, "tie_break", 2).random())
@@ -0,0 +1,152 @@
+import os
+import sys
+import threading
+import time
+from utils import metrics
+
+# Abandoned tabs keep their session state (DB connections, writer thread, chat history)
+# until Streamlit drops the session. Every session registers its game here; a reaper thread
+# releases sessions that have been idle for SESSION_IDLE_TTL, or the least recently used
+# ones beyond MAX_RESIDENT_GAMES. The game itself is already saved in the game store, so a
+# released session just resumes from it (via ?game=) on its next run.
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "1800"))
+MAX_RESIDENT_GAMES = int(os.getenv("MAX_RESIDENT_GAMES", "200"))
+SESSION_MIN_IDLE = float(os.getenv("SESSION_MIN_IDLE", "60")) # Never evict a session seen more recently (e.g. mid-phase)
+SESSION_REAP_INTERVAL = float(os.getenv("SESSION_REAP_INTERVAL", "30"))
+
+_lock = threading.Lock()
+_sessions = {} # session token -> _ResidentSession
+_reaper = None
+
+class _ResidentSession:
+    def __init__(self, game_id, closables, clearables):
+        self.game_id = game_id
+        self.closables = list(closables) # close()d on eviction (writer thread, connections)
+        self.clearables = list(clearables) # clear()ed in place on eviction (e.g. the messages list)
+        self.last_seen = time.time()
+        self.in_progress = False # Game started and not over yet (counted in the active_games gauge)
+        self.memory_bytes = 0 # Estimated size of its clearables as of its last touch()
+
+    def release(self):
+        for resource in self.closables:
+            try:
+                resource.close()
+            except Exception as e:
+                print(f"Warning: Failed to close {type(resource).__name__} for game {self.game_id}: {e}")
+        for container in self.clearables:
+            container.clear()
+
+def estimate_bytes(obj, _depth=0):
+    """Rough deep size of dicts/lists/sets/tuples of strings and numbers."""
+    size = sys.getsizeof(obj)
+    if _depth > 8:
+        return size
+    if isinstance(obj, dict):
+        size += sum(estimate_bytes(k, _depth + 1) + estimate_bytes(v, _depth + 1) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(estimate_bytes(item, _depth + 1) for item in obj)
+    return size
+
+def process_rss_bytes():
+    """Current resident set size of this process (None where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+def register(token, game_id, closables=(), clearables=()):
+    """Tracks a session's resources. `token` identifies the browser session, not the game."""
+    global _reaper
+    with _lock:
+        _sessions[token] = _ResidentSession(game_id, closables, clearables)
+        if _reaper is None:
+            _reaper = threading.Thread(target=_reap_forever, name="session-reaper", daemon=True)
+            _reaper.start()
+    _update_gauges()
+
+def touch(token, in_progress=None):
+    """Marks a session as active and refreshes its memory estimate. `in_progress` (if given)
+    records whether its game is being played, for the active_games gauge."""
+    with _lock:
+        session = _sessions.get(token)
+        if session is None:
+            return
+        session.last_seen = time.time()
+        if in_progress is not None and in_progress != session.in_progress:
+            session.in_progress = in_progress
+            metrics.set_gauge("active_games", sum(s.in_progress for s in _sessions.values()))
+        clearables = session.clearables
+    memory_bytes = sum(estimate_bytes(c) for c in clearables)
+    with _lock:
+        session.memory_bytes = memory_bytes
+        _update_memory_gauges()
+
+def session_memory_bytes(token):
+    """The session's estimated memory as of its last touch() (None if it isn't resident)."""
+    with _lock:
+        session = _sessions.get(token)
+        return session.memory_bytes if session is not None else None
+
+def _update_memory_gauges():
+    # Aggregates only: a series per session token would grow without bound on the metrics endpoint
+    sizes = [s.memory_bytes for s in _sessions.values()]
+    metrics.set_gauge("session_memory_bytes_total", sum(sizes))
+    metrics.set_gauge("session_memory_bytes_max", max(sizes, default=0))
+
+def is_resident(token):
+    """False once a session has been released; it should then start over from the game store."""
+    with _lock:
+        return token in _sessions
+
+def evict(token, reason="idle"):
+    with _lock:
+        session = _sessions.pop(token, None)
+        if session is None:
+            return False
+    session.release()
+    metrics.increment("session_evictions", reason=reason)
+    with _lock:
+        _update_memory_gauges()
+    print(f"Released session for game {session.game_id} ({reason}).")
+    return True
+
+def reap(now=None):
+    """Evicts sessions idle for longer than SESSION_IDLE_TTL, then the least recently
+    seen ones beyond MAX_RESIDENT_GAMES. Returns the number evicted."""
+    now = now or time.time()
+    with _lock:
+        by_last_seen = sorted(_sessions.items(), key=lambda item: item[1].last_seen)
+        idle = [token for token, s in by_last_seen if now - s.last_seen > SESSION_IDLE_TTL]
+        over_cap = len(by_last_seen) - len(idle) - MAX_RESIDENT_GAMES
+        evictable = [token for token, s in by_last_seen if token not in idle and now - s.last_seen > SESSION_MIN_IDLE]
+        over = evictable[:max(0, over_cap)]
+    evicted = sum(evict(token, "idle") for token in idle) + sum(evict(token, "cap") for token in over)
+    _update_gauges()
+    return evicted
+
+def _update_gauges():
+    with _lock:
+        metrics.set_gauge("resident_sessions", len(_sessions))
+        metrics.set_gauge("active_games", sum(s.in_progress for s in _sessions.values()))
+    rss = process_rss_bytes()
+    if rss is not None:
+        metrics.set_gauge("process_rss_bytes", rss)
+
+def _reap_forever():
+    while True:
+        time.sleep(SESSION_REAP_INTERVAL)
+        try:
+            reap()
+        except Exception as e:
+            print(f"Warning: Session reaper failed: {e}")
+
+if __name__ == "__main__":
+    class Closable:
+        def close(self):
+            print("closed")
+    messages = [{"role": "Monokuma", "content": "Upupupu..." * 100}]
+    register("demo", "0" * 32, closables=[Closable()], clearables=[messages])
+    touch("demo")
+    print(session_memory_bytes("demo"), metrics.get_gauge("session_memory_bytes_total"), metrics.get_gauge("resident_sessions"))
+    print(reap(now=time.time() + SESSION_IDLE_TTL + 1), is_resident("demo"), messages)
@@ -0,0 +1,140 @@
+import asyncio
+import atexit
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from utils import metrics
+
+# LLM transcripts: gzip-compressed JSON lines, one header line then one record per call:
+#   {"seq": 12, "hash": "<sha256 of prompt, 16 hex>", "latency": 1.84, "stream": false, "response": "..."}
+# LLM_RECORD=<path> records every call; LLM_BACKEND=replay with LLM_REPLAY=<path> serves the
+# recorded responses instead of calling the model, so a game (same seed) can be re-run offline.
+TRANSCRIPT_VERSION = 1
+LLM_RECORD = os.getenv("LLM_RECORD")
+LLM_REPLAY = os.getenv("LLM_REPLAY")
+# 0 serves replayed responses immediately, 1 waits as long as the original call took
+LLM_REPLAY_LATENCY_SCALE = float(os.getenv("LLM_REPLAY_LATENCY_SCALE", "0"))
+
+def prompt_hash(prompt):
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+
+class TranscriptRecorder:
+    """Appends call records to a gzip JSONL transcript. Safe to use from several threads."""
+    def __init__(self, path, meta=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._seq = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = gzip.open(path, "wt", encoding="utf-8")
+        self._write({"version": TRANSCRIPT_VERSION, "created": time.time(), **(meta or {})})
+
+    def record(self, prompt, response, latency, stream=False):
+        with self._lock:
+            if self._file is None:
+                return
+            self._seq += 1
+            self._write({"seq": self._seq, "hash": prompt_hash(prompt), "latency": round(latency, 4),
+                         "stream": stream, "response": response})
+            self._file.flush() # Sync-flush so the transcript is readable while the game is still running
+        metrics.increment("llm_transcript_records")
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _write(self, entry):
+        self._file.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+class TranscriptMissError(LookupError):
+    """Raised when a replayed game makes a call the transcript has no response for."""
+
+class TranscriptReplayer:
+    """Serves recorded responses by prompt hash. Repeated prompts are answered in the order
+    they were recorded (their call sequence)."""
+    def __init__(self, path, latency_scale=0.0):
+        self.path = path
+        self.latency_scale = latency_scale
+        self._lock = threading.Lock()
+        self._by_hash = defaultdict(deque)
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            self.header = json.loads(f.readline())
+            if self.header.get("version") != TRANSCRIPT_VERSION:
+                raise ValueError(f"Unsupported transcript version in {path}: {self.header.get('version')}")
+            for line in f:
+                entry = json.loads(line)
+                self._by_hash[entry["hash"]].append(entry)
+        self.remaining = sum(len(q) for q in self._by_hash.values())
+
+    def take(self, prompt):
+        """Returns the next recorded entry for this prompt. Raises TranscriptMissError if there is none."""
+        key = prompt_hash(prompt)
+        with self._lock:
+            queue = self._by_hash.get(key)
+            if not queue:
+                metrics.increment("llm_replay_misses")
+                raise TranscriptMissError(f"No recorded response for prompt {key} in {self.path}")
+            self.remaining -= 1
+            return queue.popleft()
+
+    async def respond(self, prompt):
+        entry = self.take(prompt)
+        if self.latency_scale:
+            await asyncio.sleep(entry["latency"] * self.latency_scale)
+        metrics.increment("llm_replayed_calls")
+        return entry["response"]
+
+_recorder = None
+_replayer = None
+
+def start_recording(path, meta=None):
+    """Records every following LLM call to `path` (replacing any current recording)."""
+    global _recorder
+    stop_recording()
+    _recorder = TranscriptRecorder(path, meta)
+    return _recorder
+
+def stop_recording():
+    global _recorder
+    if _recorder is not None:
+        _recorder.close()
+        _recorder = None
+
+def recorder():
+    return _recorder
+
+def load_replay(path, latency_scale=None):
+    """Serves LLM calls from the transcript at `path` (used when LLM_BACKEND=replay)."""
+    global _replayer
+    _replayer = TranscriptReplayer(path, LLM_REPLAY_LATENCY_SCALE if latency_scale is None else latency_scale)
+    return _replayer
+
+def replayer():
+    if _replayer is None:
+        if not LLM_REPLAY:
+            raise RuntimeError("LLM_BACKEND=replay needs LLM_REPLAY=<transcript path> (or load_replay()).")
+        load_replay(LLM_REPLAY)
+    return _replayer
+
+if LLM_RECORD:
+    start_recording(LLM_RECORD)
+atexit.register(stop_recording)
+
+if __name__ == "__main__":
+    import tempfile
+    path = os.path.join(tempfile.mkdtemp(), "demo.jsonl.gz")
+    start_recording(path, {"seed": "42"})
+    recorder().record("prompt A", "```yaml\nvote_target_index: 1\n```", 1.2)
+    recorder().record("prompt A", "```yaml\nvote_target_index: 2\n```", 0.8)
+    stop_recording()
+    replay = load_replay(path)
+    print(replay.header["seed"], asyncio.run(replay.respond("prompt A")), replay.take("prompt A")["latency"])
+    try:
+        replay.take("prompt B")
+    except TranscriptMissError as e:
+        print(e)
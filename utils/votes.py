@@ -0,0 +1,92 @@
+from collections import Counter
+
+# Vote counting and the vote breakdown shown after Blackened and Class Trial votes.
+
+def tally_votes(individual_votes, tie_break_strategy='none', rng=None):
+    """Tally votes based on plurality, handling Abstain and tie-breaking.
+
+    Args:
+        individual_votes (list): List of tuples (actor_name, target_name).
+                                target_name can be None for Abstain.
+        tie_break_strategy (str): 'none' (tie means no winner) or
+                                  'random' (tie means random winner).
+        rng (random.Random): RNG for the 'random' tie-break (seeded per game).
+
+    Returns:
+        str or None: The name of the winning target, or None if Abstain wins,
+                     there's an unbreakable tie, or no votes were cast.
+    """
+    if not individual_votes:
+        return None
+
+    # Count votes for each target, including None (Abstain)
+    vote_counts = Counter(target for _, target in individual_votes)
+
+    if not vote_counts:
+        return None # Should not happen if individual_votes is not empty, but safe check
+
+    # Find the maximum vote count
+    max_votes = 0
+    for count in vote_counts.values():
+        if count > max_votes:
+            max_votes = count
+
+    # Find all targets (including None) that received the maximum votes
+    winners = [target for target, count in vote_counts.items() if count == max_votes]
+
+    # --- Determine Outcome ---
+    if None in winners:
+        # Abstain received the highest votes (or tied), so no winner/target
+        return None
+    elif len(winners) == 1:
+        # Exactly one non-abstain target received the most votes
+        return winners[0]
+    elif len(winners) > 1:
+        # Tie between multiple non-abstain targets
+        if tie_break_strategy == 'random':
+            return rng.choice(winners) # Randomly pick one of the tied winners
+        else: # Default or 'none'
+            return None # Tie means no winner
+    else:
+        # No winners found (e.g., only votes were for Abstain but it wasn't max?)
+        # This case *shouldn't* be reachable given the logic, but default to None
+        return None
+
+def format_vote_summary(individual_votes):
+    """Formats a list of votes into an aggregated summary string.
+
+    Args:
+        individual_votes (list): List of tuples (actor_name, target_name).
+                                target_name can be None for Abstain.
+
+    Returns:
+        str: A formatted string summarizing the votes, or an empty string
+             if no votes were cast.
+    """
+    if not individual_votes:
+        return ""
+
+    votes_by_target = {}
+    for actor, target in individual_votes:
+        target_display = target if target is not None else "Abstain"
+        if target_display not in votes_by_target:
+            votes_by_target[target_display] = []
+        votes_by_target[target_display].append(actor)
+
+    summary_lines = []
+    # Sort targets alphabetically, potentially placing "Abstain" last or first if needed
+    sorted_targets = sorted(votes_by_target.keys(), key=lambda x: (x == "Abstain", x))
+
+    for target in sorted_targets:
+        voters = votes_by_target[target]
+        voter_list_str = ", ".join(sorted(voters)) # Sort voters for consistent output
+        summary_lines.append(f"- **{target}** ({len(voters)}): {voter_list_str}")
+
+    return "\n\n**Vote Breakdown:**\n" + "\n".join(summary_lines)
+
+if __name__ == "__main__":
+    import random
+    votes = [("Kaede", "Kokichi"), ("Shuichi", "Kokichi"), ("Kokichi", "Kaede"), ("Maki", None)]
+    print(tally_votes(votes))
+    print(tally_votes(votes[2:], tie_break_strategy='random', rng=random.Random(1)))
+    print(format_vote_summary(votes))
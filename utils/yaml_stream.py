@@ -0,0 +1,72 @@
+import re
+
+class YamlFieldStreamer:
+    """Incrementally extracts one top-level field from a YAML response as it streams in.
+
+    feed() takes the next chunk and returns the field's text so far (block scalars folded
+    into one line). Text is only reported once it can no longer turn out to be the start
+    of the next key or the closing fence, so the value never shrinks between calls.
+    """
+    def __init__(self, field):
+        self.field = field
+        self.buffer = ""
+        self.text = ""
+        self.complete = False
+
+    def feed(self, chunk):
+        if self.complete:
+            return self.text
+        self.buffer += chunk
+        text, complete = self._extract()
+        # Only ever grow: a shorter value means we're mid-way through something ambiguous
+        if text.startswith(self.text):
+            self.text = text
+        self.complete = complete
+        return self.text
+
+    def _extract(self):
+        key_match = re.search(r"^%s:[ \t]*" % re.escape(self.field), self.buffer, re.MULTILINE)
+        if not key_match:
+            return "", False
+        rest = self.buffer[key_match.end():]
+
+        block_match = re.match(r"[>|][-+]?[ \t]*(?:#[^\n]*)?\n", rest)
+        if block_match:
+            body = rest[block_match.end():]
+            first_line = ""
+        elif "\n" in rest or not re.fullmatch(r"[>|][-+]?[ \t]*", rest):
+            # Inline scalar: the remainder of the key line is content
+            first_line, _, body = rest.partition("\n")
+            body = "\n" + body if _ else ""
+        else:
+            return "", False # Only saw the block indicator so far
+
+        # The value ends at the next unindented line (another key or the closing fence)
+        end_match = re.search(r"^\S", body, re.MULTILINE)
+        complete = end_match is not None
+        if complete:
+            body = body[:end_match.start()]
+        else:
+            # A trailing unindented partial line might be the next key; hold it back
+            last_newline = body.rfind("\n")
+            tail = body[last_newline + 1:]
+            if last_newline >= 0 and tail == "":
+                pass
+            elif last_newline >= 0 and not tail[0].isspace():
+                body = body[:last_newline + 1]
+
+        lines = [first_line] + body.splitlines()
+        text = " ".join(line.strip() for line in lines if line.strip())
+        # Inline quoted scalars: drop the quotes
+        if first_line.strip()[:1] in ('"', "'"):
+            quote = first_line.strip()[0]
+            text = text[1:]
+            if text.endswith(quote):
+                text = text[:-1]
+        return text, complete
+
+if __name__ == "__main__":
+    streamer = YamlFieldStreamer("talking")
+    response = "```yaml\ntalking: >\n  Kokichi, your story\n  doesn't add up!\nemotion: determined\nthinking: >\n  He lied.\n```"
+    for i in range(0, len(response), 7):
+        print(repr(streamer.feed(response[i:i + 7])))